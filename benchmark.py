@@ -0,0 +1,237 @@
+"""
+Benchmark riproducibile della pipeline di generazione.
+
+Sintetizza guardaroba di varie dimensioni in database SQLite temporanei e
+misura avvio, generate() (da zero e con la cache persistente degli score),
+score_calculator e processing dei feedback.
+I risultati sono emessi in JSON per confrontare run diverse:
+
+    python benchmark.py --output new.json --compare old.json
+"""
+import argparse
+import contextlib
+import dataclasses
+import io
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from color_utils import rgb_to_cielab
+from db_manager import DB_Manager, FeedbackReason, Garment
+from outfit_engine import GenerationStats, Outfit
+from wardrobe import Wardrobe
+
+DEFAULT_SCALES = [20, 100, 500, 2000]
+DEFAULT_SEED = 42
+DEFAULT_REPEAT = 3
+# Oltre questo numero di combinazioni generate() non viene eseguito
+DEFAULT_MAX_CANDIDATES = 200_000
+SCORE_SAMPLES = 1000
+FEEDBACK_SAMPLES = 50
+REGRESSION_THRESHOLD = 0.20
+
+# Slot: (category, layer_role, quota del guardaroba, formality media, warmth media)
+SLOT_PROFILES = [
+    ('shoes', 'none', 0.15, 5, 5),
+    ('trousers', 'none', 0.20, 5, 5),
+    ('base_top', 'base', 0.30, 4, 3),
+    ('mid_top', 'mid', 0.25, 5, 6),
+    ('outerwear', 'outer', 0.10, 6, 8),
+]
+
+# Colori tipici da guardaroba (RGB) con peso relativo: prevalgono i neutri
+PALETTE = [
+    ((0, 0, 0), 8), ((255, 255, 255), 8), ((128, 128, 128), 6), ((0, 0, 128), 8),
+    ((245, 245, 220), 4), ((210, 180, 140), 4), ((139, 69, 19), 3), ((85, 107, 47), 3),
+    ((128, 0, 32), 2), ((70, 130, 180), 3), ((178, 34, 34), 1), ((255, 215, 0), 1),
+    ((46, 139, 87), 1), ((255, 140, 0), 1),
+]
+
+PATTERNS = [('plain', 60), ('logo', 20), ('striped', 10), ('velluto', 10)]
+
+def _weighted_choice(rng: random.Random, options):
+    values, weights = zip(*options)
+    return rng.choices(values, weights=weights)[0]
+
+def _clamp(value, low=1, high=10) -> int:
+    return int(max(low, min(high, round(value))))
+
+def synthesize_wardrobe(db: DB_Manager, size: int, rng: random.Random) -> dict:
+    """Popola il database con un guardaroba sintetico di `size` capi"""
+    counts = {}
+    with db.transaction():
+        for category, layer_role, share, formality, warmth in SLOT_PROFILES:
+            count = max(1, round(size * share))
+            counts[category] = count
+            for i in range(count):
+                rgb = _weighted_choice(rng, PALETTE)
+                # Variazione leggera del colore per evitare duplicati esatti
+                rgb = tuple(_clamp(c + rng.gauss(0, 12), 0, 255) for c in rgb)
+                lab = rgb_to_cielab(rgb)
+                db.add_garment(Garment(
+                    name=f"{category} {i}",
+                    category=category,
+                    layer_role=layer_role,
+                    color_hex='#{:02x}{:02x}{:02x}'.format(*rgb),
+                    color_lab_l=float(lab[0]),
+                    color_lab_a=float(lab[1]),
+                    color_lab_b=float(lab[2]),
+                    pattern=_weighted_choice(rng, PATTERNS),
+                    warmth=_clamp(rng.gauss(warmth, 1.5)),
+                    formality=_clamp(rng.gauss(formality, 2)),
+                    season_tags='all',
+                    occasion_tags='casual',
+                    active=True,
+                ))
+    return counts
+
+def _random_outfits(lists, n: int, rng: random.Random) -> list[Outfit]:
+    shoes, bottoms, bases, mids, outers = lists
+    return [
+        Outfit(
+            shoes=rng.choice(shoes)['id'],
+            bottom=rng.choice(bottoms)['id'],
+            base_top=rng.choice(bases)['id'],
+            mid_top=rng.choice(mids)['id'] if mids and rng.random() < 0.5 else None,
+            outerwear=rng.choice(outers)['id'] if outers and rng.random() < 0.3 else None,
+        )
+        for _ in range(n)
+    ]
+
+def _startup(path: Path) -> Wardrobe:
+    """Ripete il lavoro di avvio di main.py"""
+    return Wardrobe(path=path)
+
+def _median_time(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def run_scale(size: int, seed: int, repeat: int, max_candidates: int) -> dict:
+    """Esegue tutti i benchmark su un guardaroba sintetico di `size` capi"""
+    rng = random.Random(seed + size)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'wardrobe.db'
+        db = DB_Manager(path)
+        counts = synthesize_wardrobe(db, size, rng)
+        db.close()
+
+        result = {'scale': size, 'garments': counts}
+
+        startup_timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            wardrobe = _startup(path)
+            startup_timings.append(time.perf_counter() - start)
+            wardrobe.close()
+        result['startup_s'] = statistics.median(startup_timings)
+
+        wardrobe = _startup(path)
+        db, generator = wardrobe.db, wardrobe.generator
+        lists = wardrobe.garment_lists()
+        shoes, bottoms, bases, mids, outers = lists
+        candidates = len(shoes) * len(bottoms) * len(bases) * (len(mids) + 1) * (len(outers) + 1)
+        result['candidates'] = candidates
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            if candidates <= max_candidates:
+                stats = GenerationStats()
+                generate = lambda: generator.generate(shoes, bottoms, bases, mids, outers, db, count=1, stats=stats, seed=seed)
+                # Scoring da zero: cache persistente degli score disattivata
+                cache = generator._garment_cache(db)
+                scores_path, cache.scores_path, cache.scores = cache.scores_path, None, None
+                result['generate_s'] = _median_time(generate, repeat)
+                # Dettaglio per fase dell'ultima ripetizione
+                result['generate_stats'] = dataclasses.asdict(stats)
+                # Con la cache persistente: la prima chiamata la popola, le altre rileggono gli score
+                cache.scores_path = scores_path
+                generate()
+                result['generate_cached_s'] = _median_time(generate, repeat)
+                # Top-N materializzato: ricostruzione completa e lettura
+                result['ranked_rebuild_s'] = _median_time(wardrobe.ranking.rebuild, repeat)
+                result['suggest_ms'] = _median_time(lambda: wardrobe.suggest(count=1), repeat) * 1e3
+            else:
+                result['generate_s'] = None
+                result['generate_skipped'] = f"{candidates} combinazioni > max_candidates={max_candidates}"
+
+            outfits = _random_outfits(lists, SCORE_SAMPLES, rng)
+            elapsed = _median_time(lambda: [generator.score_calculator(o, db) for o in outfits], repeat)
+            result['score_calculator_us'] = elapsed / SCORE_SAMPLES * 1e6
+
+            feedback_manager = wardrobe.feedback
+            reasons = [r.value for r in FeedbackReason]
+            start = time.perf_counter()
+            for outfit in _random_outfits(lists, FEEDBACK_SAMPLES, rng):
+                feedback_manager.process_feedback(outfit, 0, rng.choice(reasons))
+            result['feedback_ms'] = (time.perf_counter() - start) / FEEDBACK_SAMPLES * 1e3
+            result['replay_s'] = _median_time(feedback_manager.replay_feedback, repeat)
+
+        wardrobe.close()
+    return result
+
+def compare(results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    """Confronta due run e restituisce le regressioni oltre la soglia"""
+    regressions = []
+    baseline_by_scale = {r['scale']: r for r in baseline['results']}
+    for result in results['results']:
+        base = baseline_by_scale.get(result['scale'])
+        if base is None:
+            continue
+        for metric in ('startup_s', 'generate_s', 'generate_cached_s', 'ranked_rebuild_s', 'suggest_ms', 'score_calculator_us', 'feedback_ms', 'replay_s'):
+            new, old = result.get(metric), base.get(metric)
+            if new is None or not old:
+                continue
+            change = (new - old) / old
+            if change > threshold:
+                regressions.append(f"scale {result['scale']} {metric}: {old:.4g} → {new:.4g} (+{change:.0%})")
+    return regressions
+
+def run(scales=DEFAULT_SCALES, seed: int = DEFAULT_SEED, repeat: int = DEFAULT_REPEAT,
+        max_candidates: int = DEFAULT_MAX_CANDIDATES) -> dict:
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': seed,
+            'repeat': repeat,
+        },
+        'results': [run_scale(size, seed, repeat, max_candidates) for size in scales],
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline di generazione outfit")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help="dimensioni dei guardaroba sintetici")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="ripetizioni per misura (si usa la mediana)")
+    parser.add_argument('--max-candidates', type=int, default=DEFAULT_MAX_CANDIDATES, help="salta generate() oltre questo numero di combinazioni")
+    parser.add_argument('--output', type=Path, help="file JSON di output (default: stdout)")
+    parser.add_argument('--compare', type=Path, help="JSON di una run precedente da confrontare")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help="soglia di regressione (0.2 = +20%%)")
+    args = parser.parse_args(argv)
+
+    results = run(args.scales, args.seed, args.repeat, args.max_candidates)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.threshold)
+        for line in regressions:
+            print(f"REGRESSIONE: {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""
+Vincoli hard dichiarativi, compilati in maschere di bit prima dello scoring.
+
+Ogni regola registrata in RULES si esprime in uno (o più) di tre modi:
+- per capo (allows): quali opzioni di uno slot sono ammesse;
+- per coppia di capi (compatible): quali opzioni di due slot possono convivere;
+- additiva (value + bounds): la somma di un attributo sui capi presenti
+  deve restare in [min, max].
+
+compile() traduce le regole in bitset (interi Python, un bit per opzione
+dello slot): le opzioni ammesse per uno slot, dati i capi già scelti, sono
+l'AND delle maschere. L'enumerazione visita solo i bit rimasti, quindi ogni
+regola in più riduce i candidati invece di aggiungere controlli.
+Lo slot vuoto (None per mid_top/outerwear) è sempre ammesso e vale 0.
+"""
+import math
+from array import array
+from dataclasses import dataclass, field, fields
+from itertools import combinations
+from typing import ClassVar
+
+FORMALITY_THRESHOLD = 4
+
+# Fascia di warmth complessiva (somma dei capi, warmth 1-10 ciascuno) in funzione della
+# temperatura in °C: il centro scende di WARMTH_PER_DEGREE per grado a partire da
+# WARMTH_AT_ZERO_C. Con scarpe e pantaloni ~5, base ~3, mid ~6, capospalla ~8-10:
+# 25 °C → solo base (~13), 15 °C → mid (~20), 0 °C → mid + outer (~30).
+# Fuori da questi estremi la fascia viene riportata entro la warmth raggiungibile
+# dal wardrobe (vedi CompiledConstraints), per proporre gli outfit più vicini
+WARMTH_AT_ZERO_C = 31
+WARMTH_PER_DEGREE = 0.7
+WARMTH_BAND_HALF_WIDTH = 6
+
+def warmth_band(temperature: float) -> tuple:
+    """(min, max) della warmth complessiva adatta alla temperatura"""
+    center = WARMTH_AT_ZERO_C - WARMTH_PER_DEGREE * temperature
+    return (center - WARMTH_BAND_HALF_WIDTH, center + WARMTH_BAND_HALF_WIDTH)
+
+def clamp_band(lo, hi, reachable_min, reachable_max) -> tuple:
+    """Fascia [lo, hi] spostata dentro [reachable_min, reachable_max] se non lo interseca"""
+    if lo > reachable_max:
+        return (reachable_max - (hi - lo), reachable_max)
+    if hi < reachable_min:
+        return (reachable_min, reachable_min + (hi - lo))
+    return (lo, hi)
+
+# Nome della regola -> classe, per costruire regole da configurazioni JSON
+RULES = {}
+
+def register_rule(name: str):
+    def decorator(cls):
+        cls.name = name
+        RULES[name] = cls
+        return cls
+    return decorator
+
+def _coerce_param(name: str, value, kind):
+    """Parametro JSON convertito al tipo del campo della regola (int, float, str o frozenset di coppie)"""
+    if kind in (int, float):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) \
+                or (kind is int and not float(value).is_integer()):
+            raise ValueError(f"'{name}' deve essere un {'intero' if kind is int else 'numero'}")
+        return kind(value)
+    if kind is str:
+        if not isinstance(value, str):
+            raise ValueError(f"'{name}' deve essere una stringa")
+        return value
+    if kind is frozenset:
+        if not isinstance(value, (list, tuple, set, frozenset)) or not all(
+            isinstance(pair, (list, tuple)) and len(pair) == 2
+            and all(isinstance(item, (int, str)) and not isinstance(item, bool) for item in pair)
+            for pair in value
+        ):
+            raise ValueError(f"'{name}' deve essere una lista di coppie")
+        return frozenset(tuple(pair) for pair in value)
+    return value
+
+def rule_from_dict(spec: dict) -> 'Rule':
+    """Regola da una specifica {"rule": nome, ...parametri}; i parametri sono convertiti al tipo dei campi"""
+    if not isinstance(spec, dict) or spec.get('rule') not in RULES:
+        raise ValueError(f"Regola sconosciuta: {spec}. Regole disponibili: {sorted(RULES)}")
+    cls = RULES[spec['rule']]
+    kinds = {f.name: f.type for f in fields(cls)}
+    params = {k: _coerce_param(k, v, kinds.get(k)) for k, v in spec.items() if k != 'rule'}
+    try:
+        return cls(**params)
+    except TypeError as e:
+        raise ValueError(f"Parametri non validi per la regola {spec['rule']}: {e}")
+
+@dataclass(frozen=True)
+class Rule:
+    """Base delle regole: i metodi non ridefiniti non vincolano nulla"""
+    name: ClassVar[str] = None
+    unary: ClassVar[bool] = False
+    pairwise: ClassVar[bool] = False
+    additive: ClassVar[bool] = False
+    # Regole additive con fascia "morbida": se cade fuori dalla somma raggiungibile
+    # viene spostata, con la stessa ampiezza, verso l'estremo più vicino
+    clamped: ClassVar[bool] = False
+
+    def allows(self, garment) -> bool:
+        return True
+
+    def compatible(self, garment_1, garment_2) -> bool:
+        return True
+
+    def value(self, garment) -> int:
+        return 0
+
+    @property
+    def bounds(self) -> tuple:
+        return (float('-inf'), float('inf'))
+
+@register_rule('formality_gap')
+@dataclass(frozen=True)
+class FormalityGap(Rule):
+    """Gap massimo di formality: max - min <= threshold equivale a ogni coppia entro threshold"""
+    threshold: int = FORMALITY_THRESHOLD
+    pairwise: ClassVar[bool] = True
+
+    def compatible(self, garment_1, garment_2) -> bool:
+        return abs(garment_1['formality'] - garment_2['formality']) <= self.threshold
+
+@register_rule('warmth_range')
+@dataclass(frozen=True)
+class WarmthRange(Rule):
+    """Warmth complessiva dell'outfit (somma dei capi presenti) entro [min_warmth, max_warmth]"""
+    min_warmth: int = 0
+    max_warmth: int = 50
+    additive: ClassVar[bool] = True
+
+    def value(self, garment) -> int:
+        return garment['warmth']
+
+    @property
+    def bounds(self) -> tuple:
+        return (self.min_warmth, self.max_warmth)
+
+@register_rule('temperature')
+@dataclass(frozen=True)
+class TemperatureWarmth(Rule):
+    """Warmth complessiva nella fascia adatta alla temperatura (vedi warmth_band)"""
+    temperature: float
+    additive: ClassVar[bool] = True
+    clamped: ClassVar[bool] = True
+
+    def value(self, garment) -> int:
+        return garment['warmth']
+
+    @property
+    def bounds(self) -> tuple:
+        return warmth_band(self.temperature)
+
+@register_rule('season')
+@dataclass(frozen=True)
+class SeasonMatch(Rule):
+    """Solo capi con la stagione tra i season_tags ('all' = tutte le stagioni)"""
+    season: str
+    unary: ClassVar[bool] = True
+
+    def allows(self, garment) -> bool:
+        tags = {tag.strip() for tag in garment['season_tags'].split(',')}
+        return self.season in tags or 'all' in tags
+
+@register_rule('forbidden_categories')
+@dataclass(frozen=True)
+class ForbiddenCategories(Rule):
+    """Coppie di categorie che non possono stare nello stesso outfit"""
+    pairs: frozenset = field(default_factory=frozenset)
+    pairwise: ClassVar[bool] = True
+
+    def __post_init__(self):
+        object.__setattr__(self, 'pairs', frozenset(frozenset(pair) for pair in self.pairs))
+
+    def compatible(self, garment_1, garment_2) -> bool:
+        return frozenset((garment_1['category'], garment_2['category'])) not in self.pairs
+
+@register_rule('never_together')
+@dataclass(frozen=True)
+class NeverTogether(Rule):
+    """Coppie di garment_id indicate dall'utente come "mai insieme" """
+    pairs: frozenset = field(default_factory=frozenset)
+    pairwise: ClassVar[bool] = True
+
+    def __post_init__(self):
+        object.__setattr__(self, 'pairs', frozenset(tuple(sorted(pair)) for pair in self.pairs))
+
+    def compatible(self, garment_1, garment_2) -> bool:
+        id_1, id_2 = garment_1['id'], garment_2['id']
+        return ((id_1, id_2) if id_1 < id_2 else (id_2, id_1)) not in self.pairs
+
+class ConstraintSet:
+    """Insieme di regole applicato a un outfit intero o compilato sulle opzioni per slot"""
+    def __init__(self, rules=()):
+        self.rules = tuple(rules)
+
+    def allows(self, garments) -> bool:
+        """True se l'outfit (garment in qualsiasi ordine, None = slot vuoto) rispetta tutte le regole"""
+        present = [g for g in garments if g is not None]
+        for rule in self.rules:
+            if rule.unary and not all(rule.allows(g) for g in present):
+                return False
+            if rule.pairwise and not all(rule.compatible(a, b) for a, b in combinations(present, 2)):
+                return False
+            if rule.additive:
+                lo, hi = rule.bounds
+                if not lo <= sum(rule.value(g) for g in present) <= hi:
+                    return False
+        return True
+
+    def compile(self, slots: list) -> 'CompiledConstraints':
+        return CompiledConstraints(self.rules, slots)
+
+class CompiledConstraints:
+    """
+    Maschere delle regole sulle opzioni di ciascuno slot.
+
+    unary[k]: opzioni ammesse dello slot k;
+    pair[k][j][i]: opzioni dello slot k compatibili con l'opzione i dello slot j < k;
+    per le regole additive, i valori per opzione e i minimi/massimi ancora
+    raggiungibili dagli slot successivi, da cui la maschera dell'intervallo ammesso.
+    """
+    def __init__(self, rules: tuple, slots: list):
+        self.slots = slots
+        self.radices = [len(options) for options in slots]
+        full = [(1 << n) - 1 for n in self.radices]
+
+        self.unary = list(full)
+        for k, options in enumerate(slots):
+            for rule in rules:
+                if rule.unary:
+                    for i, garment in enumerate(options):
+                        if garment is not None and not rule.allows(garment):
+                            self.unary[k] &= ~(1 << i)
+
+        pair_rules = [rule for rule in rules if rule.pairwise]
+        self.pair = [[None] * k for k in range(len(slots))]
+        if pair_rules:
+            for k, options_k in enumerate(slots):
+                for j in range(k):
+                    masks = []
+                    for garment_j in slots[j]:
+                        mask = full[k]
+                        if garment_j is not None:
+                            for i, garment_k in enumerate(options_k):
+                                if garment_k is not None and not all(r.compatible(garment_j, garment_k) for r in pair_rules):
+                                    mask &= ~(1 << i)
+                        masks.append(mask)
+                    self.pair[k][j] = masks
+        self.has_pairs = bool(pair_rules)
+
+        self.additive = []
+        for rule in rules:
+            if not rule.additive:
+                continue
+            values = [[rule.value(g) if g is not None else 0 for g in options] for options in slots]
+            allowed = [[v for i, v in enumerate(vs) if self.unary[k] >> i & 1] or [0] for k, vs in enumerate(values)]
+            rest_min, rest_max = [0] * (len(slots) + 1), [0] * (len(slots) + 1)
+            for k in reversed(range(len(slots))):
+                rest_min[k] = rest_min[k + 1] + min(allowed[k])
+                rest_max[k] = rest_max[k + 1] + max(allowed[k])
+            lo, hi = rule.bounds
+            if rule.clamped:
+                lo, hi = clamp_band(lo, hi, rest_min[0], rest_max[0])
+            self.additive.append((values, lo, hi, rest_min, rest_max))
+        self._range_masks = {}
+        self._bit_indices = {}
+
+    def _range_mask(self, rule_index: int, slot: int, lo, hi) -> int:
+        """Opzioni dello slot con valore della regola additiva in [lo, hi]"""
+        key = (rule_index, slot, lo, hi)
+        mask = self._range_masks.get(key)
+        if mask is None:
+            values = self.additive[rule_index][0][slot]
+            mask = sum(1 << i for i, v in enumerate(values) if lo <= v <= hi)
+            self._range_masks[key] = mask
+        return mask
+
+    def _bits(self, mask: int) -> tuple:
+        """Indici dei bit attivi, in ordine crescente"""
+        indices = self._bit_indices.get(mask)
+        if indices is None:
+            indices, rest = [], mask
+            while rest:
+                low = rest & -rest
+                indices.append(low.bit_length() - 1)
+                rest ^= low
+            indices = self._bit_indices[mask] = tuple(indices)
+        return indices
+
+    def candidates(self) -> array:
+        """
+        Combinazioni ammesse, impacchettate in base mista come in
+        OutfitGenerator._unpack e in ordine crescente.
+        """
+        out = array('q')
+        if all(self.unary):
+            self._extend(out, 0, 0, [], [0] * len(self.additive))
+        return out
+
+    def _extend(self, out: array, slot: int, prefix: int, chosen: list, sums: list):
+        mask = self.unary[slot]
+        if self.has_pairs:
+            pair = self.pair[slot]
+            for j, i in enumerate(chosen):
+                mask &= pair[j][i]
+        for r, (_, lo, hi, rest_min, rest_max) in enumerate(self.additive):
+            # Il valore di questo slot deve lasciare raggiungibile l'intervallo con gli slot successivi
+            s = sums[r]
+            mask &= self._range_mask(r, slot, lo - s - rest_max[slot + 1], hi - s - rest_min[slot + 1])
+        if not mask:
+            return
+
+        base = prefix * self.radices[slot]
+        if slot == len(self.slots) - 1:
+            out.extend([base + i for i in self._bits(mask)])
+            return
+        for i in self._bits(mask):
+            chosen.append(i)
+            self._extend(out, slot + 1, base + i, chosen,
+                         [s + values[slot][i] for s, (values, *_) in zip(sums, self.additive)])
+            chosen.pop()
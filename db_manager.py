@@ -1,11 +1,120 @@
+import re
 import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
 from pathlib import Path
 from dataclasses import dataclass
 from enum import Enum
+from garment_index import GarmentIndex
 
 db_path = Path('data/wardrobe.db')
 db_path.parent.mkdir(exist_ok=True) # Crea la cartella data se non esiste
 
+# Guardaroba aggiuntivi (uno per membro della famiglia): data/wardrobes/<id>.db
+DEFAULT_WARDROBE_ID = 'default'
+wardrobes_dir = db_path.parent / 'wardrobes'
+_WARDROBE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+def wardrobe_path(wardrobe_id: str, directory: Path = None) -> Path:
+    """
+    Percorso del database di un guardaroba ('default' = data/wardrobe.db).
+    Con `directory` tutti i guardaroba, compreso il default, stanno in quella cartella.
+    """
+    if wardrobe_id == DEFAULT_WARDROBE_ID and directory is None:
+        return db_path
+    if not _WARDROBE_ID_PATTERN.match(wardrobe_id):
+        raise ValueError(f"ID guardaroba non valido: '{wardrobe_id}'")
+    directory = Path(directory) if directory is not None else wardrobes_dir
+    directory.mkdir(exist_ok=True)
+    return directory / f'{wardrobe_id}.db'
+
+# Versione dello schema (PRAGMA user_version), incrementata ad ogni migrazione
+SCHEMA_VERSION = 3
+
+# Contatore di versione -> tabelle che lo incrementano
+VERSION_TRIGGERS = {
+    'garment_version': ('garment', 'never_together'),
+    'weights_version': ('weights', 'pair_penalties', 'item_penalties'),
+    'feedback_version': ('feedback',),
+}
+
+# Slot di un outfit e relativa colonna nelle tabelle feedback/outfit_history
+OUTFIT_SLOTS = {
+    'shoes': 'shoes_id',
+    'bottom': 'bottom_id',
+    'base_top': 'base_top_id',
+    'mid_top': 'mid_top_id',
+    'outerwear': 'outerwear_id',
+}
+OUTFIT_COLUMNS_SQL = ', '.join(OUTFIT_SLOTS.values())
+# Un outfit confrontato con le colonne per slot (IS: gli slot vuoti sono NULL)
+OUTFIT_MATCH_SQL = ' AND '.join(f"{column} IS ?" for column in OUTFIT_SLOTS.values())
+
+# Trigger che alimentano ranked_outfit_changes: (tabella, evento, valori inseriti)
+_NO_OUTFIT = "NULL, NULL, NULL, NULL, NULL"
+RANKED_CHANGE_TRIGGERS = [
+    ('garment', 'INSERT', "'garment', NEW.id, NULL, NULL, NULL, NULL, " + _NO_OUTFIT),
+    ('garment', 'UPDATE', "'garment', NEW.id, NULL, NULL, NULL, NULL, " + _NO_OUTFIT),
+    ('garment', 'DELETE', "'garment', OLD.id, NULL, NULL, NULL, NULL, " + _NO_OUTFIT),
+    ('pair_penalties', 'INSERT', "'pair', NEW.garment_id_1, NEW.garment_id_2, NULL, NULL, NEW.penalty_score, " + _NO_OUTFIT),
+    ('pair_penalties', 'UPDATE', "'pair', NEW.garment_id_1, NEW.garment_id_2, NULL, OLD.penalty_score, NEW.penalty_score, " + _NO_OUTFIT),
+    ('pair_penalties', 'DELETE', "'pair', OLD.garment_id_1, OLD.garment_id_2, NULL, OLD.penalty_score, NULL, " + _NO_OUTFIT),
+    ('never_together', 'INSERT', "'pair', NEW.garment_id_1, NEW.garment_id_2, NULL, NULL, NULL, " + _NO_OUTFIT),
+    ('never_together', 'DELETE', "'pair', OLD.garment_id_1, OLD.garment_id_2, NULL, NULL, NULL, " + _NO_OUTFIT),
+    ('weights', 'INSERT', "'weight', NULL, NULL, NEW.key, NULL, NEW.value, " + _NO_OUTFIT),
+    ('weights', 'UPDATE', "'weight', NULL, NULL, NEW.key, OLD.value, NEW.value, " + _NO_OUTFIT),
+    ('weights', 'DELETE', "'weight', NULL, NULL, OLD.key, OLD.value, NULL, " + _NO_OUTFIT),
+    ('feedback', 'INSERT', "'outfit', NULL, NULL, NULL, NULL, NULL, " + ', '.join(f"NEW.{column}" for column in OUTFIT_SLOTS.values())),
+    ('feedback', 'DELETE', "'outfit', NULL, NULL, NULL, NULL, NULL, " + ', '.join(f"OLD.{column}" for column in OUTFIT_SLOTS.values())),
+]
+
+# Chiave canonica di un outfit: i 5 garment_id nell'ordine di OUTFIT_SLOTS (None = slot vuoto).
+# Nel database corrisponde alle colonne per slot, coperte da indici compositi
+def outfit_signature(shoes_id, bottom_id, base_top_id, mid_top_id=None, outerwear_id=None) -> tuple:
+    return (shoes_id, bottom_id, base_top_id, mid_top_id or None, outerwear_id or None)
+
+# Tabelle ricostruite dalle migrazioni ({name} = nome della tabella)
+FEEDBACK_TABLE_SQL = '''
+                CREATE TABLE IF NOT EXISTS {name} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    shoes_id INTEGER NOT NULL,
+                    bottom_id INTEGER NOT NULL,
+                    base_top_id INTEGER NOT NULL,
+                    mid_top_id INTEGER,
+                    outerwear_id INTEGER,
+                    verdict INTEGER NOT NULL CHECK(verdict IN (0, 1)),
+                    reason TEXT CHECK(reason IN ('colors_clash', 'too_many_neutrals', 'too_formal', 
+                                                   'too_casual', 'bad_layering', 
+                                                   'dont_like_combination', 'boring', 'too_flashy')),
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (shoes_id) REFERENCES garment(id),
+                    FOREIGN KEY (bottom_id) REFERENCES garment(id),
+                    FOREIGN KEY (base_top_id) REFERENCES garment(id),
+                    FOREIGN KEY (mid_top_id) REFERENCES garment(id),
+                    FOREIGN KEY (outerwear_id) REFERENCES garment(id)
+                )
+'''
+
+OUTFIT_HISTORY_TABLE_SQL = '''
+                CREATE TABLE IF NOT EXISTS {name} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    shoes_id INTEGER NOT NULL,
+                    bottom_id INTEGER NOT NULL,
+                    base_top_id INTEGER NOT NULL,
+                    mid_top_id INTEGER,
+                    outerwear_id INTEGER,
+                    worn_date DATE NOT NULL DEFAULT (date('now')),
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (shoes_id) REFERENCES garment(id),
+                    FOREIGN KEY (bottom_id) REFERENCES garment(id),
+                    FOREIGN KEY (base_top_id) REFERENCES garment(id),
+                    FOREIGN KEY (mid_top_id) REFERENCES garment(id),
+                    FOREIGN KEY (outerwear_id) REFERENCES garment(id)
+                )
+'''
+
 @dataclass
 class Garment:
     name: str
@@ -22,6 +131,37 @@ class Garment:
     occasion_tags: str
     active: bool
 
+# Vincoli dei campi di garment, gli stessi dei CHECK della tabella
+LAYER_ROLES = ('base', 'mid', 'outer', 'none')
+GARMENT_INT_RANGES = {'warmth': (1, 10), 'formality': (1, 10)}
+
+def validate_garment_field(field_name: str, value):
+    """Valore di un campo di garment se rispetta i vincoli della tabella, altrimenti ValueError"""
+    if field_name in GARMENT_INT_RANGES:
+        low, high = GARMENT_INT_RANGES[field_name]
+        if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+            raise ValueError(f"{field_name} deve essere un intero tra {low} e {high}")
+    elif field_name == 'active':
+        if value not in (0, 1):
+            raise ValueError("active deve essere true/false")
+        return bool(value)
+    elif field_name == 'layer_role':
+        if value not in LAYER_ROLES:
+            raise ValueError(f"layer_role deve essere tra: {', '.join(LAYER_ROLES)}")
+    elif field_name.startswith('color_lab_'):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"{field_name} deve essere un numero")
+        return float(value)
+    elif not isinstance(value, str):
+        raise ValueError(f"{field_name} deve essere una stringa")
+    return value
+
+def validate_garment(garment: Garment) -> Garment:
+    """Il garment, se tutti i campi rispettano i vincoli della tabella (vedi validate_garment_field)"""
+    for field_name, value in vars(garment).items():
+        validate_garment_field(field_name, value)
+    return garment
+
 @dataclass
 class FeedbackReason(Enum):
     COLORS_CLASH = 'colors_clash'
@@ -33,134 +173,477 @@ class FeedbackReason(Enum):
     BORING = 'boring'
     TOO_FLASHY = 'too_flashy'
 
-class DB_Manager():
+def half_life_decay(age_days, half_life_days) -> float:
+    """Fattore di decadimento esponenziale (1.0 se half-life disattivata)"""
+    if age_days is None or not half_life_days or half_life_days <= 0:
+        return 1.0
+    return 0.5 ** (max(0.0, age_days) / half_life_days)
+
+class QueryProfiler:
+    """
+    Raccoglie numero di esecuzioni, tempo totale e latenze p50/p99
+    per ogni statement SQL normalizzato (letterali sostituiti da '?').
+    """
+    _LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    _WHITESPACE = re.compile(r"\s+")
+
     def __init__(self):
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row
+        self._timings = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def normalize(cls, sql: str) -> str:
+        sql = cls._WHITESPACE.sub(' ', sql).strip()
+        return cls._LITERALS.sub('?', sql)
+
+    def record(self, sql: str, elapsed: float):
+        key = self.normalize(sql)
+        with self._lock:
+            self._timings[key].append(elapsed)
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+
+    @staticmethod
+    def _percentile(sorted_values: list, p: float) -> float:
+        index = max(0, min(len(sorted_values) - 1, round(p * len(sorted_values)) - 1))
+        return sorted_values[index]
+
+    def summary(self) -> list[dict]:
+        """Statistiche per statement, ordinate per tempo totale decrescente"""
+        with self._lock:
+            items = [(sql, sorted(timings)) for sql, timings in self._timings.items()]
+        rows = [{
+            'sql': sql,
+            'count': len(timings),
+            'total_s': sum(timings),
+            'p50_s': self._percentile(timings, 0.50),
+            'p99_s': self._percentile(timings, 0.99),
+        } for sql, timings in items]
+        rows.sort(key=lambda r: r['total_s'], reverse=True)
+        return rows
+
+    def report(self, limit: int = 10, width: int = 70) -> str:
+        rows = self.summary()
+        if not rows:
+            return "Nessuna query registrata"
+        total_count = sum(r['count'] for r in rows)
+        total_time = sum(r['total_s'] for r in rows)
+        lines = [
+            f"--- SQL: {total_count} query, {total_time*1000:.1f} ms ---",
+            f"{'count':>7} {'total ms':>9} {'p50 µs':>8} {'p99 µs':>8}  statement",
+        ]
+        for r in rows[:limit]:
+            sql = r['sql'] if len(r['sql']) <= width else r['sql'][:width - 1] + '…'
+            lines.append(f"{r['count']:>7} {r['total_s']*1000:>9.1f} {r['p50_s']*1e6:>8.0f} {r['p99_s']*1e6:>8.0f}  {sql}")
+        return '\n'.join(lines)
+
+class _ProfiledCursor(sqlite3.Cursor):
+    """Cursor che misura execute/executemany e li registra nel profiler"""
+    profiler = None
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.profiler.record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.profiler.record(sql, time.perf_counter() - start)
+
+class _PooledConnection(sqlite3.Connection):
+    """Connessione del pool: se il profiling è attivo restituisce cursor strumentati"""
+    pool = None
+
+    def cursor(self, factory=None):
+        profiler = self.pool.profiler if self.pool is not None else None
+        if profiler is None:
+            return super().cursor() if factory is None else super().cursor(factory)
+        cursor = super().cursor(_ProfiledCursor)
+        cursor.profiler = profiler
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+class ConnectionPool:
+    """
+    Pool di connessioni SQLite in modalità WAL.
+    Ogni thread ottiene una propria connessione di lettura, mentre tutte le
+    scritture passano da un'unica connessione writer serializzata da un lock.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self.statement_count = 0  # statement SQL eseguiti da tutte le connessioni del pool
+        self.profiler = None      # QueryProfiler attivo (opt-in)
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, factory=_PooledConnection)
+        conn.pool = self
+        conn.row_factory = sqlite3.Row
+        conn.create_function('half_life_decay', 2, half_life_decay)
+        conn.set_trace_callback(self._count_statement)
+        return conn
+
+    def _count_statement(self, _sql):
+        # Contatore solo statistico: senza lock, tra thread qualche incremento può andare perso
+        self.statement_count += 1
+
+    def reader(self) -> sqlite3.Connection:
+        """Restituisce la connessione di lettura del thread corrente"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """
+        Transazione di scrittura serializzata.
+        I blocchi annidati condividono la stessa transazione: il commit
+        avviene solo all'uscita del blocco più esterno.
+        """
+        with self._write_lock:
+            self._write_depth += 1
+            try:
+                yield self._writer.cursor()
+                if self._write_depth == 1:
+                    self._writer.commit()
+            except BaseException:
+                if self._write_depth == 1:
+                    self._writer.rollback()
+                raise
+            finally:
+                self._write_depth -= 1
+
+    @property
+    def in_transaction(self) -> bool:
+        """True se una transazione di scrittura è aperta (anche da un altro thread)"""
+        return self._write_depth > 0
+
+    def close(self):
+        """Chiude tutte le connessioni del pool"""
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        self._local = threading.local()
+        with self._write_lock:
+            self._writer.close()
+
+class DB_Manager():
+    def __init__(self, path=db_path):
+        self.pool = ConnectionPool(path)
+        # Indice Lab dei garment, costruito alla prima ricerca di capi simili
+        self._garment_index = None
+        self._index_lock = threading.Lock()
         self._initialize_tables()
+        self._migrate()
         self._initialize_defaults()
 
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connessione di lettura del thread corrente"""
+        return self.pool.reader()
+
+    def transaction(self):
+        """Apre una transazione di scrittura (serializzata tra i thread)"""
+        return self.pool.writer()
+
+    def enable_profiling(self) -> QueryProfiler:
+        """Attiva la strumentazione delle query su tutte le connessioni"""
+        if self.pool.profiler is None:
+            self.pool.profiler = QueryProfiler()
+        return self.pool.profiler
+
+    def disable_profiling(self):
+        self.pool.profiler = None
+
     def _initialize_tables(self):
         # Verifichiamo che la tabella 'garments' esista già
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS garment (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                category TEXT NOT NULL,
-                layer_role TEXT NOT NULL CHECK(layer_role IN ('base', 'mid', 'outer', 'none')),
-                color_hex TEXT(7) NOT NULL,
-                color_lab_l REAL NOT NULL,
-                color_lab_a REAL NOT NULL,
-                color_lab_b REAL NOT NULL,
-                pattern TEXT NOT NULL,
-                warmth INTEGER NOT NULL CHECK(warmth >= 1 AND warmth <= 10),
-                formality INTEGER NOT NULL CHECK(formality >= 1 AND formality <= 10),
-                season_tags TEXT NOT NULL,
-                occasion_tags TEXT NOT NULL,
-                active INTEGER NOT NULL DEFAULT 1 CHECK(active IN (0, 1))
-            )               
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS feedback (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                outfit_signature TEXT NOT NULL,
-                shoes_id INTEGER NOT NULL,
-                bottom_id INTEGER NOT NULL,
-                base_top_id INTEGER NOT NULL,
-                mid_top_id INTEGER,
-                outerwear_id INTEGER,
-                verdict INTEGER NOT NULL CHECK(verdict IN (0, 1)),
-                reason TEXT CHECK(reason IN ('colors_clash', 'too_many_neutrals', 'too_formal', 
-                                               'too_casual', 'bad_layering', 
-                                               'dont_like_combination', 'boring', 'too_flashy')),
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (shoes_id) REFERENCES garment(id),
-                FOREIGN KEY (bottom_id) REFERENCES garment(id),
-                FOREIGN KEY (base_top_id) REFERENCES garment(id),
-                FOREIGN KEY (mid_top_id) REFERENCES garment(id),
-                FOREIGN KEY (outerwear_id) REFERENCES garment(id)
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS weights (
-                key TEXT PRIMARY KEY,
-                value REAL NOT NULL,
-                default_value REAL NOT NULL,
-                min_value REAL NOT NULL,
-                max_value REAL NOT NULL,
-                last_modified DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS item_penalties (
-                garment_id INTEGER PRIMARY KEY,
-                penalty_score REAL NOT NULL DEFAULT 0.0,
-                last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (garment_id) REFERENCES garment(id)
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pair_penalties (
-                garment_id_1 INTEGER NOT NULL,
-                garment_id_2 INTEGER NOT NULL,
-                penalty_score REAL NOT NULL DEFAULT 0.0,
-                last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (garment_id_1, garment_id_2),
-                FOREIGN KEY (garment_id_1) REFERENCES garment(id),
-                FOREIGN KEY (garment_id_2) REFERENCES garment(id),
-                CHECK (garment_id_1 < garment_id_2)
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS outfit_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                outfit_signature TEXT NOT NULL,
-                shoes_id INTEGER NOT NULL,
-                bottom_id INTEGER NOT NULL,
-                base_top_id INTEGER NOT NULL,
-                mid_top_id INTEGER,
-                outerwear_id INTEGER,
-                worn_date DATE NOT NULL DEFAULT (date('now')),
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (shoes_id) REFERENCES garment(id),
-                FOREIGN KEY (bottom_id) REFERENCES garment(id),
-                FOREIGN KEY (base_top_id) REFERENCES garment(id),
-                FOREIGN KEY (mid_top_id) REFERENCES garment(id),
-                FOREIGN KEY (outerwear_id) REFERENCES garment(id)
+        with self.pool.writer() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS garment (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    layer_role TEXT NOT NULL CHECK(layer_role IN ('base', 'mid', 'outer', 'none')),
+                    color_hex TEXT(7) NOT NULL,
+                    color_lab_l REAL NOT NULL,
+                    color_lab_a REAL NOT NULL,
+                    color_lab_b REAL NOT NULL,
+                    pattern TEXT NOT NULL,
+                    warmth INTEGER NOT NULL CHECK(warmth >= 1 AND warmth <= 10),
+                    formality INTEGER NOT NULL CHECK(formality >= 1 AND formality <= 10),
+                    season_tags TEXT NOT NULL,
+                    occasion_tags TEXT NOT NULL,
+                    active INTEGER NOT NULL DEFAULT 1 CHECK(active IN (0, 1))
+                )               
+            ''')
+            cursor.execute(FEEDBACK_TABLE_SQL.format(name='feedback'))
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_feedback_outfit
+                ON feedback ({OUTFIT_COLUMNS_SQL}, verdict)
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS weights (
+                    key TEXT PRIMARY KEY,
+                    value REAL NOT NULL,
+                    default_value REAL NOT NULL,
+                    min_value REAL NOT NULL,
+                    max_value REAL NOT NULL,
+                    last_modified DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS item_penalties (
+                    garment_id INTEGER PRIMARY KEY,
+                    penalty_score REAL NOT NULL DEFAULT 0.0,
+                    last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (garment_id) REFERENCES garment(id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS pair_penalties (
+                    garment_id_1 INTEGER NOT NULL,
+                    garment_id_2 INTEGER NOT NULL,
+                    penalty_score REAL NOT NULL DEFAULT 0.0,
+                    last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (garment_id_1, garment_id_2),
+                    FOREIGN KEY (garment_id_1) REFERENCES garment(id),
+                    FOREIGN KEY (garment_id_2) REFERENCES garment(id),
+                    CHECK (garment_id_1 < garment_id_2)
+                )
+            ''')
+            # Coppie di capi che l'utente non vuole mai nello stesso outfit (vincolo hard)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS never_together (
+                    garment_id_1 INTEGER NOT NULL,
+                    garment_id_2 INTEGER NOT NULL,
+                    PRIMARY KEY (garment_id_1, garment_id_2),
+                    FOREIGN KEY (garment_id_1) REFERENCES garment(id),
+                    FOREIGN KEY (garment_id_2) REFERENCES garment(id),
+                    CHECK (garment_id_1 < garment_id_2)
+                )
+            ''')
+            cursor.execute(OUTFIT_HISTORY_TABLE_SQL.format(name='outfit_history'))
+            # Tabelle normalizzate: un record per (outfit, slot) indicizzato per garment
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outfit_items (
+                    outfit_id INTEGER NOT NULL,
+                    slot TEXT NOT NULL CHECK(slot IN ('shoes', 'bottom', 'base_top', 'mid_top', 'outerwear')),
+                    garment_id INTEGER NOT NULL,
+                    worn_date DATE NOT NULL,
+                    PRIMARY KEY (outfit_id, slot),
+                    FOREIGN KEY (outfit_id) REFERENCES outfit_history(id),
+                    FOREIGN KEY (garment_id) REFERENCES garment(id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_outfit_items_garment
+                ON outfit_items (garment_id, worn_date)
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS feedback_items (
+                    feedback_id INTEGER NOT NULL,
+                    slot TEXT NOT NULL CHECK(slot IN ('shoes', 'bottom', 'base_top', 'mid_top', 'outerwear')),
+                    garment_id INTEGER NOT NULL,
+                    PRIMARY KEY (feedback_id, slot),
+                    FOREIGN KEY (feedback_id) REFERENCES feedback(id),
+                    FOREIGN KEY (garment_id) REFERENCES garment(id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_feedback_items_garment
+                ON feedback_items (garment_id, feedback_id)
+            ''')
+            # Contatori di versione, incrementati da trigger ad ogni modifica:
+            # permettono alle cache in memoria di capire se sono ancora valide
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS wardrobe_meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.executemany(
+                "INSERT OR IGNORE INTO wardrobe_meta (key, value) VALUES (?, 0)",
+                [(key,) for key in VERSION_TRIGGERS]
             )
-        ''')
-        self.conn.commit()
+            for key, tables in VERSION_TRIGGERS.items():
+                for table in tables:
+                    for event in ('INSERT', 'UPDATE', 'DELETE'):
+                        cursor.execute(f'''
+                            CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                            AFTER {event} ON {table}
+                            BEGIN
+                                UPDATE wardrobe_meta SET value = value + 1 WHERE key = '{key}';
+                            END
+                        ''')
+            # Top-N materializzato degli outfit con le componenti dello score (vedi ranking.py)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS ranked_outfit (
+                    shoes_id INTEGER NOT NULL,
+                    bottom_id INTEGER NOT NULL,
+                    base_top_id INTEGER NOT NULL,
+                    mid_top_id INTEGER,
+                    outerwear_id INTEGER,
+                    color_score REAL NOT NULL,
+                    pattern_score REAL NOT NULL,
+                    formality_score REAL NOT NULL,
+                    neutral_penalty REAL NOT NULL,
+                    color_bonus REAL NOT NULL,
+                    simplicity_bonus REAL NOT NULL,
+                    pair_penalty REAL NOT NULL,
+                    score REAL NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_ranked_outfit_score
+                ON ranked_outfit (score DESC)
+            ''')
+            # Un outfit per riga (IFNULL: nei vincoli UNIQUE i NULL sono tutti distinti)
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_ranked_outfit_outfit
+                ON ranked_outfit (shoes_id, bottom_id, base_top_id, IFNULL(mid_top_id, 0), IFNULL(outerwear_id, 0))
+            ''')
+            # Riga presente = top-N costruito; floor = limite superiore degli score esclusi (NULL = tabella completa)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS ranked_outfit_state (
+                    id INTEGER PRIMARY KEY CHECK(id = 1),
+                    floor REAL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS ranked_outfit_changes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL CHECK(kind IN ('garment', 'pair', 'weight', 'outfit')),
+                    garment_id_1 INTEGER,
+                    garment_id_2 INTEGER,
+                    weight_key TEXT,
+                    old_value REAL,
+                    new_value REAL,
+                    shoes_id INTEGER,
+                    bottom_id INTEGER,
+                    base_top_id INTEGER,
+                    mid_top_id INTEGER,
+                    outerwear_id INTEGER
+                )
+            ''')
+            # Log delle modifiche che invalidano il top-N, scritto solo se il top-N esiste
+            for table, event, values in RANKED_CHANGE_TRIGGERS:
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_ranked
+                    AFTER {event} ON {table}
+                    WHEN EXISTS (SELECT 1 FROM ranked_outfit_state)
+                    BEGIN
+                        INSERT INTO ranked_outfit_changes (kind, garment_id_1, garment_id_2, weight_key, old_value, new_value, {OUTFIT_COLUMNS_SQL})
+                        VALUES ({values});
+                    END
+                ''')
+
+    def _migrate(self):
+        '''Applica le migrazioni mancanti in base a PRAGMA user_version'''
+        with self.pool.writer() as cursor:
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+
+            if version < 1:
+                # v1: backfill di outfit_items/feedback_items dalle colonne per slot
+                for slot, column in OUTFIT_SLOTS.items():
+                    cursor.execute(f'''
+                        INSERT OR IGNORE INTO outfit_items (outfit_id, slot, garment_id, worn_date)
+                        SELECT id, ?, {column}, worn_date FROM outfit_history
+                        WHERE {column} IS NOT NULL
+                    ''', (slot,))
+                    cursor.execute(f'''
+                        INSERT OR IGNORE INTO feedback_items (feedback_id, slot, garment_id)
+                        SELECT id, ?, {column} FROM feedback
+                        WHERE {column} IS NOT NULL
+                    ''', (slot,))
+
+            if version < 3:
+                # v2-v3: gli outfit sono identificati dalle colonne per slot, non più da una
+                # firma (stringa "a-b-c-d-e" fino a v1, intero a 12 bit per slot in v2, che
+                # limitava i garment_id a 4095). feedback e outfit_history vengono ricostruite
+                # senza la colonna outfit_signature, le tabelle del top-N (derivate) ricreate da zero
+                # Motivi non più previsti dal CHECK (es. 'dont_like_item' dei database più vecchi):
+                # ricondotti al motivo più vicino o a NULL, altrimenti la copia fallirebbe
+                known_reasons = ', '.join(f"'{reason.value}'" for reason in FeedbackReason)
+                legacy_reason = f'''
+                    CASE WHEN reason IS NULL OR reason IN ({known_reasons}) THEN reason
+                         WHEN reason = 'dont_like_item' THEN '{FeedbackReason.DONT_LIKE_COMBINATION.value}'
+                    END
+                '''
+                for table, table_sql in (('feedback', FEEDBACK_TABLE_SQL), ('outfit_history', OUTFIT_HISTORY_TABLE_SQL)):
+                    columns = [row['name'] for row in cursor.execute(f"PRAGMA table_info({table})") if row['name'] != 'outfit_signature']
+                    values = [legacy_reason if table == 'feedback' and column == 'reason' else column for column in columns]
+                    cursor.execute(table_sql.format(name=f"{table}_new"))
+                    cursor.execute(f'''
+                        INSERT INTO {table}_new ({', '.join(columns)})
+                        SELECT {', '.join(values)} FROM {table}
+                    ''')
+                    cursor.execute(f"DROP TABLE {table}")
+                    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+                for table, event, _ in RANKED_CHANGE_TRIGGERS:
+                    cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{event.lower()}_ranked")
+                cursor.execute("DROP TABLE IF EXISTS ranked_outfit")
+                cursor.execute("DROP TABLE IF EXISTS ranked_outfit_changes")
+                cursor.execute("DELETE FROM ranked_outfit_state")
+                # Ricrea indici, trigger e tabelle appena eliminati
+                self._initialize_tables()
+
+            if version < SCHEMA_VERSION:
+                cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @staticmethod
+    def _outfit_items(shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id) -> list[tuple]:
+        '''Coppie (slot, garment_id) di un outfit, esclusi gli slot vuoti'''
+        ids = (shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id)
+        return [(slot, garment_id) for slot, garment_id in zip(OUTFIT_SLOTS, ids) if garment_id is not None]
 
     def _initialize_defaults(self):
         '''Popola i pesi di default se la tabella è vuota'''
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM weights")
-        count = cursor.fetchone()[0]
-
-        if count == 0:
-            defaults = [
-                ('formality_threshold', 4, 4, 2, 8),
-                ('neutral_saturation_threshold', 20, 20, 10, 40),
-                ('color_weight', 0.55, 0.55, 0.1, 0.9),
-                ('pattern_weight', 0.3, 0.3, 0.05, 0.7),
-                ('formality_weight', 0.15, 0.15, 0.05, 0.5),
-            ]
-            cursor.executemany('''
-                INSERT INTO weights (key, value, default_value, min_value, max_value)
-                VALUES (?, ?, ?, ?, ?)
-            ''', defaults)
-            self.conn.commit()
+        with self.pool.writer() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM weights")
+            count = cursor.fetchone()[0]
+
+            if count == 0:
+                defaults = [
+                    ('formality_threshold', 4, 4, 2, 8),
+                    ('neutral_saturation_threshold', 20, 20, 10, 40),
+                    ('color_weight', 0.55, 0.55, 0.1, 0.9),
+                    ('pattern_weight', 0.3, 0.3, 0.05, 0.7),
+                    ('formality_weight', 0.15, 0.15, 0.05, 0.5),
+                ]
+                cursor.executemany('''
+                    INSERT INTO weights (key, value, default_value, min_value, max_value)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', defaults)
     
     def add_garment(self, garment: Garment):
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                INSERT INTO garment (name, category, layer_role, color_hex, color_lab_l, color_lab_a, color_lab_b, pattern, warmth, formality, season_tags, occasion_tags, active)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (garment.name, garment.category, garment.layer_role, garment.color_hex, garment.color_lab_l, garment.color_lab_a, garment.color_lab_b, garment.pattern, garment.warmth, garment.formality, garment.season_tags, garment.occasion_tags, int(garment.active)))
-            self.conn.commit()
+            with self.pool.writer() as cursor:
+                cursor.execute('''
+                    INSERT INTO garment (name, category, layer_role, color_hex, color_lab_l, color_lab_a, color_lab_b, pattern, warmth, formality, season_tags, occasion_tags, active)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (garment.name, garment.category, garment.layer_role, garment.color_hex, garment.color_lab_l, garment.color_lab_a, garment.color_lab_b, garment.pattern, garment.warmth, garment.formality, garment.season_tags, garment.occasion_tags, int(garment.active)))
             garment_id = cursor.lastrowid
+            self._update_garment_index(garment_id, 1)
             return garment_id
         except sqlite3.IntegrityError as e:
             print(f"Errore inserimento garment: {e}")
@@ -175,33 +658,109 @@ class DB_Manager():
         return cursor.fetchall()
     
     def deactivate_garment(self, garment_id: int):
-        cursor = self.conn.cursor()
-        cursor.execute("UPDATE garment SET active = 0 WHERE id = ?", (garment_id,))
-        self.conn.commit()
+        with self.pool.writer() as cursor:
+            cursor.execute("UPDATE garment SET active = 0 WHERE id = ?", (garment_id,))
+        self._update_garment_index(garment_id, cursor.rowcount)
         return cursor.rowcount
     
     def activate_garment(self, garment_id: int):
-        cursor = self.conn.cursor()
-        cursor.execute("UPDATE garment SET active = 1 WHERE id = ?", (garment_id,))
-        self.conn.commit()
+        with self.pool.writer() as cursor:
+            cursor.execute("UPDATE garment SET active = 1 WHERE id = ?", (garment_id,))
+        self._update_garment_index(garment_id, cursor.rowcount)
         return cursor.rowcount
     
     def delete_garment(self, garment_id: int):
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM garment WHERE id = ?", (garment_id,))
-        self.conn.commit()
+        with self.pool.writer() as cursor:
+            cursor.execute("DELETE FROM garment WHERE id = ?", (garment_id,))
+        self._update_garment_index(garment_id, cursor.rowcount)
         return cursor.rowcount
     
+    def get_all_garments(self) -> list:
+        """Tutti i garment (attivi e non) in un'unica query"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT * FROM garment")
+        return cursor.fetchall()
+
+    def add_never_together(self, garment_id_1: int, garment_id_2: int):
+        """Vieta che i due capi compaiano nello stesso outfit"""
+        if garment_id_1 == garment_id_2:
+            raise ValueError("Servono due capi diversi")
+        pair = (min(garment_id_1, garment_id_2), max(garment_id_1, garment_id_2))
+        with self.pool.writer() as cursor:
+            found = cursor.execute("SELECT COUNT(*) FROM garment WHERE id IN (?, ?)", pair).fetchone()[0]
+            if found < 2:
+                raise ValueError("Capo non trovato")
+            cursor.execute("INSERT OR IGNORE INTO never_together (garment_id_1, garment_id_2) VALUES (?, ?)", pair)
+
+    def remove_never_together(self, garment_id_1: int, garment_id_2: int):
+        pair = (min(garment_id_1, garment_id_2), max(garment_id_1, garment_id_2))
+        with self.pool.writer() as cursor:
+            cursor.execute("DELETE FROM never_together WHERE garment_id_1 = ? AND garment_id_2 = ?", pair)
+        return cursor.rowcount
+
+    def get_never_together(self) -> set[tuple]:
+        """Coppie (id1, id2) con id1 < id2 vietate nello stesso outfit"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT garment_id_1, garment_id_2 FROM never_together")
+        return {(row[0], row[1]) for row in cursor.fetchall()}
+
+    def _update_garment_index(self, garment_id: int, changed_rows: int):
+        """
+        Aggiorna l'indice Lab dopo la scrittura (già confermata) di un garment.
+        Se la transazione è annidata o il contatore di versione non torna
+        (scritture di altri thread/processi), l'indice verrà ricostruito.
+        """
+        with self._index_lock:
+            index = self._garment_index
+            if index is None or not changed_rows:
+                return
+            version = None if self.pool.in_transaction else self.get_versions().get('garment_version')
+            if version is None or index.version is None or version != index.version + changed_rows:
+                index.version = None
+                return
+            garment = self.get_garment(garment_id)
+            if garment is None:
+                index.remove(garment_id)
+            else:
+                index.upsert(garment)
+            index.version = version
+
+    def garment_index(self) -> GarmentIndex:
+        """Indice Lab dei garment, ricostruito solo se non corrisponde al garment_version corrente"""
+        with self._index_lock:
+            version = self.get_versions().get('garment_version')
+            if self._garment_index is None or self._garment_index.version != version:
+                self._garment_index = GarmentIndex(self.get_all_garments(), version)
+            return self._garment_index
+
+    def find_substitutes(self, garment_id: int, k: int = 5, active_only: bool = True) -> list[tuple]:
+        """
+        I k capi della stessa categoria più simili al garment (colore Lab,
+        formality, pattern), come (distanza, garment) in ordine di distanza
+        """
+        index = self.garment_index()
+        with self._index_lock:
+            garment = index.garments.get(garment_id)
+            if garment is None:
+                return []
+            return index.nearest(garment, k, active_only=active_only, exclude={garment_id})
+
+    def get_versions(self) -> dict:
+        """Contatori di versione di garment, pesi/penalità e feedback"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT key, value FROM wardrobe_meta")
+        return {row['key']: row['value'] for row in cursor.fetchall()}
+
     def get_garment(self, garment_id: int):
         cursor = self.conn.cursor()
         cursor.execute("SELECT * FROM garment WHERE id = ?", (garment_id,))
         return cursor.fetchone()
     
     def update_garment_field(self, garment_id: int, field_name: str, new_value):
-        cursor = self.conn.cursor()
         query = f"UPDATE garment SET {field_name} = ? WHERE id = ?"
-        cursor.execute(query, (new_value, garment_id))
-        self.conn.commit()
+        with self.pool.writer() as cursor:
+            cursor.execute(query, (new_value, garment_id))
+        self._update_garment_index(garment_id, cursor.rowcount)
         return cursor.rowcount
 
     def get_garments_by_category(self, category: str, active_only: bool = True) -> list:
@@ -228,8 +787,6 @@ class DB_Manager():
             verdict: 1 per like, 0 per dislike
             reason: FeedbackReason enum value (opzionale se verdict=1)
         """
-        # 1. Genera outfit signature
-        outfit_signature = f"{shoes_id}-{bottom_id}-{base_top_id}-{mid_top_id or 0}-{outerwear_id or 0}"
         if verdict == 1 and reason is not None:
             #print("Non ci può essere una ragione, se l'outfit ti è piaciuto")
             raise ValueError("Non ci può essere una ragione se l'outfit ti è piaciuto")
@@ -241,24 +798,41 @@ class DB_Manager():
             if reason not in valid_reasons:
                 raise ValueError(f"Ragione non valida. Valori accettati: {valid_reasons}")
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                INSERT INTO feedback (outfit_signature, shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id, verdict, reason)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (outfit_signature, shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id, verdict, reason))
-            self.conn.commit()
-            feedback_id = cursor.lastrowid
+            with self.pool.writer() as cursor:
+                cursor.execute('''
+                    INSERT INTO feedback (shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id, verdict, reason)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id, verdict, reason))
+                feedback_id = cursor.lastrowid
+                items = self._outfit_items(shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id)
+                cursor.executemany('''
+                    INSERT INTO feedback_items (feedback_id, slot, garment_id)
+                    VALUES (?, ?, ?)
+                ''', [(feedback_id, slot, garment_id) for slot, garment_id in items])
             return feedback_id
         except sqlite3.IntegrityError as e:
             print(f"Errore inserimento feedback: {e}")
             raise
     
-    #def get_feedback_by_outfit(self, outfit_signature):
-    #    cursor = self.conn.cursor()
-    #    cursor.execute('''
-    #        SELECT * FROM feedback WHERE outfit_signature = ?
-    #    ''', (outfit_signature,))
-    #    return cursor.fetchall()
+    def get_feedback_by_outfit(self, signature: tuple):
+        """Feedback di un outfit (signature = outfit_signature(...)), dal più vecchio"""
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT * FROM feedback WHERE {OUTFIT_MATCH_SQL}
+            ORDER BY id
+        ''', signature)
+        return cursor.fetchall()
+
+    def get_disliked_signatures(self) -> set[tuple]:
+        """Chiavi (outfit_signature) degli outfit il cui feedback più recente è un dislike"""
+        # Con MAX(id) SQLite prende verdict dalla riga più recente del gruppo;
+        # il GROUP BY scorre l'indice idx_feedback_outfit
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT {OUTFIT_COLUMNS_SQL}, verdict, MAX(id) FROM feedback
+            GROUP BY {OUTFIT_COLUMNS_SQL}
+        ''')
+        return {tuple(row[:5]) for row in cursor.fetchall() if row[5] == 0}
 
     def list_all_feedback(self, limit=None):
         """
@@ -276,49 +850,84 @@ class DB_Manager():
     
     def delete_feedback(self, feedback_id: int):
         """Elimina un feedback specifico"""
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM feedback WHERE id = ?", (feedback_id,))
-        self.conn.commit()
+        with self.pool.writer() as cursor:
+            cursor.execute("DELETE FROM feedback_items WHERE feedback_id = ?", (feedback_id,))
+            cursor.execute("DELETE FROM feedback WHERE id = ?", (feedback_id,))
         return cursor.rowcount  # Restituisce 1 se cancellato, 0 se non trovato
     
     def add_outfit_to_history(self, outfit):
         """Registra un outfit come indossato oggi"""
-        outfit_signature = f"{outfit.shoes}-{outfit.bottom}-{outfit.base_top}-{outfit.mid_top or 0}-{outfit.outerwear or 0}"
-
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO outfit_history (outfit_signature, shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (outfit_signature, outfit.shoes, outfit.bottom, outfit.base_top, outfit.mid_top, outfit.outerwear))
-        self.conn.commit()
-        return cursor.lastrowid
+        with self.pool.writer() as cursor:
+            cursor.execute('''
+                INSERT INTO outfit_history (shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (outfit.shoes, outfit.bottom, outfit.base_top, outfit.mid_top, outfit.outerwear))
+            outfit_id = cursor.lastrowid
+            items = self._outfit_items(outfit.shoes, outfit.bottom, outfit.base_top, outfit.mid_top, outfit.outerwear)
+            cursor.executemany('''
+                INSERT INTO outfit_items (outfit_id, slot, garment_id, worn_date)
+                SELECT ?, ?, ?, worn_date FROM outfit_history WHERE id = ?
+            ''', [(outfit_id, slot, garment_id, outfit_id) for slot, garment_id in items])
+        return outfit_id
     
     def get_garment_last_worn_days(self, garment_id: int) -> int | None:
         """
         Restituisce quanti giorni fa un capo è stato indossato l'ultima volta.ù
         Returns None se mai indossato.
         """
+        # MAX su (garment_id, worn_date) è risolto direttamente dall'indice
         cursor = self.conn.cursor()
         cursor.execute('''
-            SELECT julianday('now') - julianday(worn_date) as days_ago
-            FROM outfit_history
-            WHERE shoes_id = ? OR bottom_id = ? OR base_top_id = ? OR mid_top_id = ? OR outerwear_id = ?
-            ORDER BY worn_date DESC
-            LIMIT 1
-        ''', (garment_id, garment_id, garment_id, garment_id, garment_id))
+            SELECT julianday('now') - julianday(MAX(worn_date)) as days_ago
+            FROM outfit_items
+            WHERE garment_id = ?
+        ''', (garment_id,))
 
         row = cursor.fetchone()
-        return int(row['days_ago']) if row else None
+        return int(row['days_ago']) if row['days_ago'] is not None else None
+
+    def get_history_for_garment(self, garment_id: int, limit=None) -> list:
+        """
+        Outfit indossati che contengono un capo, dal più recente
+
+        Args:
+            limit: numero massimo di risultati (None = tutti)
+        """
+        cursor = self.conn.cursor()
+        query = '''
+            SELECT h.* FROM outfit_items i
+            JOIN outfit_history h ON h.id = i.outfit_id
+            WHERE i.garment_id = ?
+            ORDER BY i.worn_date DESC
+        '''
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        cursor.execute(query, (garment_id,))
+        return cursor.fetchall()
+
+    def get_feedback_for_garment(self, garment_id: int) -> list:
+        """Feedback ricevuti da outfit che contengono un capo, dal più recente"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT f.* FROM feedback_items i
+            JOIN feedback f ON f.id = i.feedback_id
+            WHERE i.garment_id = ?
+            ORDER BY i.feedback_id DESC
+        ''', (garment_id,))
+        return cursor.fetchall()
 
     def close(self):
         """Close connection when finished"""
-        if self.conn:
-            self.conn.close()
+        if self.pool:
+            self.pool.close()
 
 class WeightsManager:
     def __init__(self, db_manager: DB_Manager):
         self.db = db_manager
-        self.conn = db_manager.conn
+
+    @property
+    def conn(self):
+        return self.db.conn
     
     def get_weight(self, key: str) -> float:
         '''Recupera un peso dal database'''
@@ -337,50 +946,51 @@ class WeightsManager:
     
     def set_weight(self, key: str, value: float):
         """Aggiorna un peso con validazione min/max"""
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT min_value, max_value FROM weights WHERE key = ?",
-            (key,)
-        )
-        row = cursor.fetchone()
-        if row is None:
-            raise KeyError(f"Weight '{key}' non trovato")
-        
-        min_val, max_val = row['min_value'], row['max_value']
-        if value < min_val or value > max_val:
-            print(f"Valore {value} fuori range. Uso valori di clamping.")
-        clamped_value = max(min_val, min(max_val, value))
-
-        cursor.execute(
-            "UPDATE weights SET value = ?, last_modified = CURRENT_TIMESTAMP WHERE key = ?",
-            (clamped_value, key)
-        )
-        self.conn.commit()
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                "SELECT min_value, max_value FROM weights WHERE key = ?",
+                (key,)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                raise KeyError(f"Weight '{key}' non trovato")
+            
+            min_val, max_val = row['min_value'], row['max_value']
+            if value < min_val or value > max_val:
+                print(f"Valore {value} fuori range. Uso valori di clamping.")
+            clamped_value = max(min_val, min(max_val, value))
+
+            cursor.execute(
+                "UPDATE weights SET value = ?, last_modified = CURRENT_TIMESTAMP WHERE key = ?",
+                (clamped_value, key)
+            )
         return clamped_value
     
     def adjust_weight(self, key: str, delta: float):
         """Modifica incrementalmente un peso"""
-        current = self.get_weight(key)
-        new_value = current + delta
-        return self.set_weight(key, new_value)
+        # Lettura e scrittura nella stessa transazione: niente aggiornamenti persi tra thread
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT value FROM weights WHERE key = ?", (key,))
+            row = cursor.fetchone()
+            if row is None:
+                raise KeyError(f"Weight '{key}' non trovato nel database")
+            return self.set_weight(key, row['value'] + delta)
     
     def reset_weight(self, key: str):
         """Resetta un peso al valore di default"""
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "UPDATE weights SET value = default_value, last_modified = CURRENT_TIMESTAMP WHERE key = ?",
-            (key,)
-        )
-        self.conn.commit()
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                "UPDATE weights SET value = default_value, last_modified = CURRENT_TIMESTAMP WHERE key = ?",
+                (key,)
+            )
         return cursor.rowcount
     
     def reset_all_weights(self):
         """Resetta tutti i pesi ai valori di default"""
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "UPDATE weights SET value = default_value, last_modified = CURRENT_TIMESTAMP"
-        )
-        self.conn.commit()
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                "UPDATE weights SET value = default_value, last_modified = CURRENT_TIMESTAMP"
+            )
         return cursor.rowcount
     
     def get_item_penalty(self, garment_id: int) -> float:
@@ -392,37 +1002,74 @@ class WeightsManager:
     
     def add_item_penalty(self, garment_id: int, penalty_delta: float):
         """Aggiunge/aggiorna penalità per un item"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO item_penalties (garment_id, penalty_score, last_updated)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(garment_id) DO UPDATE SET
-                penalty_score = penalty_score + ?,
-                last_updated = CURRENT_TIMESTAMP
-        ''', (garment_id, penalty_delta, penalty_delta))
-        self.conn.commit()
-
-    def get_pair_penalty(self, garment_id_1: int, garment_id_2: int) -> float:
-        """Recupera penalità di una coppia (0.0 se non esiste)"""
+        with self.db.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO item_penalties (garment_id, penalty_score, last_updated)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(garment_id) DO UPDATE SET
+                    penalty_score = penalty_score + ?,
+                    last_updated = CURRENT_TIMESTAMP
+            ''', (garment_id, penalty_delta, penalty_delta))
+
+    def get_pair_penalty(self, garment_id_1: int, garment_id_2: int, half_life_days: float = None) -> float:
+        """Recupera penalità di una coppia, decaduta ad oggi (0.0 se non esiste)"""
         # Ordina gli ID per garantire consistenza
         id1, id2 = min (garment_id_1, garment_id_2), max(garment_id_1, garment_id_2)
         cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT penalty_score FROM pair_penalties WHERE garment_id_1 = ? AND garment_id_2 = ?",
-            (id1, id2)
-        )
+        cursor.execute('''
+            SELECT penalty_score * half_life_decay(julianday('now') - julianday(last_updated), ?) AS penalty_score
+            FROM pair_penalties WHERE garment_id_1 = ? AND garment_id_2 = ?
+        ''', (half_life_days, id1, id2))
         row = cursor.fetchone()
         return row['penalty_score'] if row else 0.0
-    
-    def add_pair_penalty(self, garment_id_1: int, garment_id_2: int, penalty_delta: float):
-        """Aggiunge/aggiorna penalità per una coppia"""
-        id1, id2 = min(garment_id_1, garment_id_2), max(garment_id_1, garment_id_2)
+
+    def load_pair_penalties(self, half_life_days: float = None, epsilon: float = 0.0) -> dict:
+        """
+        Carica tutte le penalità di coppia in memoria, decadute ad oggi
+
+        Args:
+            half_life_days: half-life del decadimento (None = nessun decadimento)
+            epsilon: le penalità con valore assoluto inferiore vengono scartate
+
+        Returns:
+            dict {(id1, id2): penalty_score} con id1 < id2
+        """
         cursor = self.conn.cursor()
         cursor.execute('''
-            INSERT INTO pair_penalties (garment_id_1, garment_id_2, penalty_score, last_updated)
-            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(garment_id_1, garment_id_2) DO UPDATE SET
-                penalty_score = penalty_score + ?,
-                last_updated = CURRENT_TIMESTAMP
-        ''', (id1, id2, penalty_delta, penalty_delta))
-        self.conn.commit()
\ No newline at end of file
+            SELECT garment_id_1, garment_id_2,
+                   penalty_score * half_life_decay(julianday('now') - julianday(last_updated), ?)
+            FROM pair_penalties
+        ''', (half_life_days,))
+        return {(id1, id2): score for id1, id2, score in cursor if abs(score) >= epsilon}
+    
+    def add_pair_penalty(self, garment_id_1: int, garment_id_2: int, penalty_delta: float, half_life_days: float = None):
+        """Aggiunge/aggiorna penalità per una coppia (il valore esistente viene prima decaduto)"""
+        id1, id2 = min(garment_id_1, garment_id_2), max(garment_id_1, garment_id_2)
+        with self.db.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO pair_penalties (garment_id_1, garment_id_2, penalty_score, last_updated)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(garment_id_1, garment_id_2) DO UPDATE SET
+                    penalty_score = penalty_score * half_life_decay(julianday('now') - julianday(last_updated), ?) + ?,
+                    last_updated = CURRENT_TIMESTAMP
+            ''', (id1, id2, penalty_delta, half_life_days, penalty_delta))
+
+    def decay_pair_penalties(self, half_life_days: float, epsilon: float) -> tuple[int, int]:
+        """
+        Applica il decadimento a tutte le penalità di coppia con un unico UPDATE
+        e compatta quelle scese sotto epsilon.
+
+        Returns:
+            (coppie aggiornate, coppie eliminate)
+        """
+        with self.db.transaction() as cursor:
+            cursor.execute('''
+                UPDATE pair_penalties SET
+                    penalty_score = penalty_score * half_life_decay(julianday('now') - julianday(last_updated), ?),
+                    last_updated = CURRENT_TIMESTAMP
+                WHERE last_updated < datetime('now')
+            ''', (half_life_days,))
+            updated = cursor.rowcount
+            cursor.execute("DELETE FROM pair_penalties WHERE abs(penalty_score) < ?", (epsilon,))
+            deleted = cursor.rowcount
+        return updated, deleted
@@ -0,0 +1,152 @@
+import json
+import os
+import numpy as np
+from pathlib import Path
+from db_manager import DB_Manager, FeedbackReason, OUTFIT_SLOTS
+from ml_scorer import GarmentFeatures
+
+FEATURE_STORE_PATH = Path('data/feature_store')
+SCHEMA_FILE = 'schema.json'
+SCHEMA_VERSION = 1
+EXPORT_CHUNK_SIZE = 10000
+
+# Codici numerici delle reason (-1 = nessuna reason)
+REASON_CODES = {r.value: code for code, r in enumerate(FeedbackReason)}
+
+# Colonne del dataset: nome -> dtype
+COLUMNS = {
+    'feedback_id': 'int64',
+    'timestamp': 'int64',       # secondi epoch UTC
+    'verdict': 'int8',
+    'reason': 'int8',
+}
+for _slot in OUTFIT_SLOTS:
+    COLUMNS.update({
+        f'{_slot}_id': 'int32',          # -1 = slot vuoto
+        f'{_slot}_lab_l': 'float32',     # NaN = slot vuoto o capo eliminato
+        f'{_slot}_lab_a': 'float32',
+        f'{_slot}_lab_b': 'float32',
+        f'{_slot}_pattern': 'int8',
+        f'{_slot}_warmth': 'int8',
+        f'{_slot}_formality': 'int8',
+    })
+
+class FeatureStore:
+    """
+    Export colonnare del log dei feedback, unito agli attributi dei garment.
+    Ogni colonna è un file binario grezzo (<colonna>.bin) mappabile in memoria
+    con np.memmap; schema.json descrive dtype, numero di righe e ultimo id esportato.
+    """
+    def __init__(self, path: Path = FEATURE_STORE_PATH):
+        self.path = Path(path)
+
+    def _read_schema(self) -> dict | None:
+        schema_path = self.path / SCHEMA_FILE
+        if not schema_path.exists():
+            return None
+        with open(schema_path) as f:
+            schema = json.load(f)
+        # Schema diverso da quello corrente: il dataset va ricostruito
+        if schema.get('version') != SCHEMA_VERSION or schema.get('columns') != COLUMNS:
+            return None
+        return schema
+
+    def _write_schema(self, rows: int, last_feedback_id: int):
+        schema = {
+            'version': SCHEMA_VERSION,
+            'rows': rows,
+            'last_feedback_id': last_feedback_id,
+            'columns': COLUMNS,
+        }
+        # Scrittura atomica: lo schema è il punto di commit dell'export
+        tmp_path = self.path / (SCHEMA_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(schema, f, indent=2)
+        os.replace(tmp_path, self.path / SCHEMA_FILE)
+
+    def export(self, db: DB_Manager, chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+        """
+        Accoda al dataset i feedback successivi all'ultimo id esportato
+
+        Returns:
+            numero di righe aggiunte
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        schema = self._read_schema()
+        rows = schema['rows'] if schema else 0
+        last_id = schema['last_feedback_id'] if schema else 0
+
+        # Tronca eventuali righe scritte da un export interrotto prima del commit dello schema
+        for name, dtype in COLUMNS.items():
+            with open(self.path / f'{name}.bin', 'ab') as f:
+                f.truncate(rows * np.dtype(dtype).itemsize)
+
+        cursor = db.conn.cursor()
+        cursor.execute("SELECT * FROM garment")
+        garments = GarmentFeatures(cursor.fetchall())
+
+        cursor.execute('''
+            SELECT id, CAST(strftime('%s', timestamp) AS INTEGER), verdict, reason,
+                   shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id
+            FROM feedback
+            WHERE id > ?
+            ORDER BY id
+        ''', (last_id,))
+
+        added = 0
+        files = {name: open(self.path / f'{name}.bin', 'ab') for name in COLUMNS}
+        try:
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                columns = self._chunk_columns(chunk, garments)
+                for name, dtype in COLUMNS.items():
+                    files[name].write(columns[name].astype(dtype).tobytes())
+                added += len(chunk)
+                last_id = chunk[-1][0]
+        finally:
+            for f in files.values():
+                f.close()
+
+        if added or schema is None:
+            self._write_schema(rows + added, last_id)
+        return added
+
+    @staticmethod
+    def _chunk_columns(chunk, garments: GarmentFeatures) -> dict:
+        """Converte un blocco di righe feedback in colonne, unendo gli attributi dei garment"""
+        columns = {
+            'feedback_id': np.array([r[0] for r in chunk]),
+            'timestamp': np.array([r[1] or 0 for r in chunk]),
+            'verdict': np.array([r[2] for r in chunk]),
+            'reason': np.array([REASON_CODES.get(r[3], -1) for r in chunk]),
+        }
+        garment_ids = np.array([[g or 0 for g in r[4:]] for r in chunk], dtype=np.int64)
+        rows = garments.rows_for_ids(garment_ids)
+        known = rows > 0
+
+        for i, slot in enumerate(OUTFIT_SLOTS):
+            slot_rows = rows[:, i]
+            lab = garments.lab[slot_rows]
+            columns[f'{slot}_id'] = np.where(garment_ids[:, i] > 0, garment_ids[:, i], -1)
+            columns[f'{slot}_lab_l'] = np.where(known[:, i], lab[:, 0], np.nan)
+            columns[f'{slot}_lab_a'] = np.where(known[:, i], lab[:, 1], np.nan)
+            columns[f'{slot}_lab_b'] = np.where(known[:, i], lab[:, 2], np.nan)
+            columns[f'{slot}_pattern'] = np.where(known[:, i], garments.pattern[slot_rows], -1)
+            columns[f'{slot}_warmth'] = np.where(known[:, i], garments.warmth[slot_rows], -1)
+            columns[f'{slot}_formality'] = np.where(known[:, i], garments.formality[slot_rows], -1)
+        return columns
+
+    def load(self) -> dict:
+        """Mappa in memoria (sola lettura) tutte le colonne del dataset"""
+        schema = self._read_schema()
+        if schema is None:
+            raise FileNotFoundError(f"Nessun feature store valido in {self.path}")
+        rows = schema['rows']
+        if rows == 0:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        return {
+            name: np.memmap(self.path / f'{name}.bin', dtype=dtype, mode='r', shape=(rows,))
+            for name, dtype in COLUMNS.items()
+        }
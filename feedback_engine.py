@@ -1,4 +1,5 @@
-from db_manager import DB_Manager, FeedbackReason, WeightsManager
+from db_manager import DB_Manager, FeedbackReason, WeightsManager, half_life_decay
+from datetime import datetime, timezone
 from itertools import combinations
 from outfit_engine import OutfitGenerator
 
@@ -17,9 +18,50 @@ PAIR_PENALTY_LIGHT = -0.03
 PAIR_PENALTY_MEDIUM = -0.05
 PAIR_PENALTY_HEAVY = -0.08
 
+# Decadimento penalità coppie
+PAIR_PENALTY_HALF_LIFE_DAYS = 180
+PAIR_PENALTY_EPSILON = 0.005
+
+# Regole di adattamento condivise da feedback live e replay
+# reason -> lista di (peso, delta)
+WEIGHT_ADJUSTMENT_RULES = {
+    FeedbackReason.TOO_FORMAL.value: [
+        ('formality_weight', -WEIGHT_ADJUSTMENT_SMALL),
+        ('formality_threshold', -THRESHOLD_ADJUSTMENT_FORMALITY),
+    ],
+    FeedbackReason.TOO_CASUAL.value: [
+        ('formality_weight', +WEIGHT_ADJUSTMENT_SMALL),
+    ],
+    FeedbackReason.TOO_MANY_NEUTRALS.value: [
+        ('neutral_saturation_threshold', -THRESHOLD_ADJUSTMENT_NEUTRAL),
+    ],
+    FeedbackReason.BORING.value: [
+        ('color_weight', +WEIGHT_ADJUSTMENT_MEDIUM),
+        ('pattern_weight', -WEIGHT_ADJUSTMENT_SMALL),
+    ],
+    FeedbackReason.TOO_FLASHY.value: [
+        ('color_weight', -WEIGHT_ADJUSTMENT_MEDIUM),
+    ],
+    FeedbackReason.BAD_LAYERING.value: [
+        ('pattern_weight', +WEIGHT_ADJUSTMENT_SMALL),
+    ],
+    # COLORS_CLASH e DONT_LIKE_COMBINATION non modificano pesi globali
+}
+
+# reason -> penalità applicata a tutte le coppie dell'outfit
+PAIR_PENALTY_RULES = {
+    FeedbackReason.COLORS_CLASH.value: PAIR_PENALTY_HEAVY,
+    FeedbackReason.DONT_LIKE_COMBINATION.value: PAIR_PENALTY_MEDIUM,
+}
+
+def _parse_timestamp(timestamp: str) -> datetime:
+    """Converte un CURRENT_TIMESTAMP di SQLite (UTC) in datetime"""
+    return datetime.fromisoformat(timestamp)
+
 class FeedbackManager:
-    def __init__(self, db: DB_Manager):
+    def __init__(self, db: DB_Manager, generator: OutfitGenerator = None):
         self.db = db
+        self.generator = generator or OutfitGenerator(db)
     
     def _get_garment_ids_from_outfit(self, outfit) -> list[int]:
         """Estrae tutti i garment_id dall'outfit (esclusi None)"""
@@ -36,99 +78,151 @@ class FeedbackManager:
     
     def _apply_weight_adjustments(self, reason: str, weights_mgr: WeightsManager):
         """Modifica i pesi globali in base alla reason"""
-
-        if reason == FeedbackReason.TOO_FORMAL.value:
-            old_fw = weights_mgr.get_weight('formality_weight')
-            new_fw = weights_mgr.adjust_weight('formality_weight', -WEIGHT_ADJUSTMENT_SMALL)
-            print(f"  → formality_weight: {old_fw:.3f} → {new_fw:.3f}")
-            
-            old_ft = weights_mgr.get_weight('formality_threshold')
-            new_ft = weights_mgr.adjust_weight('formality_threshold', -THRESHOLD_ADJUSTMENT_FORMALITY)
-            print(f"  → formality_threshold: {old_ft:.1f} → {new_ft:.1f}")
-    
-        elif reason == FeedbackReason.TOO_CASUAL.value:
-            old_fw = weights_mgr.get_weight('formality_weight')
-            new_fw = weights_mgr.adjust_weight('formality_weight', +WEIGHT_ADJUSTMENT_SMALL)
-            print(f"  → formality_weight: {old_fw:.3f} → {new_fw:.3f}")
-
-        elif reason == FeedbackReason.TOO_MANY_NEUTRALS.value:
-            old_ns = weights_mgr.get_weight('neutral_saturation_threshold')
-            new_ns = weights_mgr.adjust_weight('neutral_saturation_threshold', -THRESHOLD_ADJUSTMENT_NEUTRAL)
-            print(f"  → neutral_saturation_threshold: {old_ns:.1f} → {new_ns:.1f}")
-
-        elif reason == FeedbackReason.BORING.value:
-            old_cw = weights_mgr.get_weight('color_weight')
-            new_cw = weights_mgr.adjust_weight('color_weight', +WEIGHT_ADJUSTMENT_MEDIUM)
-            print(f"  → color_weight: {old_cw:.3f} → {new_cw:.3f}")
-
-            old_pw = weights_mgr.get_weight('pattern_weight')
-            new_pw = weights_mgr.adjust_weight('pattern_weight', -WEIGHT_ADJUSTMENT_SMALL)
-            print(f"  → pattern_weight: {old_pw:.3f} → {new_pw:.3f}")
-
-        elif reason == FeedbackReason.TOO_FLASHY.value:
-            old_cw = weights_mgr.get_weight('color_weight')
-            new_cw = weights_mgr.adjust_weight('color_weight', -WEIGHT_ADJUSTMENT_MEDIUM)
-            print(f"  → color_weight: {old_cw:.3f} → {new_cw:.3f}")
-
-        elif reason == FeedbackReason.BAD_LAYERING.value:
-            old_pw = weights_mgr.get_weight('pattern_weight')
-            new_pw = weights_mgr.adjust_weight('pattern_weight', +WEIGHT_ADJUSTMENT_SMALL)
-            print(f"  → pattern_weight: {old_pw:.3f} → {new_pw:.3f}")
-
-        # COLORS_CLASH e DONT_LIKE_COMBINATION non modificano pesi globali
+        for key, delta in WEIGHT_ADJUSTMENT_RULES.get(reason, []):
+            old_value = weights_mgr.get_weight(key)
+            new_value = weights_mgr.adjust_weight(key, delta)
+            if key.endswith('_threshold'):
+                print(f"  → {key}: {old_value:.1f} → {new_value:.1f}")
+            else:
+                print(f"  → {key}: {old_value:.3f} → {new_value:.3f}")
     
     def _apply_pair_penalties(self, outfit, reason: str, weights_mgr: WeightsManager):
         """Applica penalità alle coppie di item dell'outfit"""
 
         # Solo alcune reason causano penalità di coppia
-        if reason not in [FeedbackReason.COLORS_CLASH.value, FeedbackReason.DONT_LIKE_COMBINATION.value]:
+        penalty = PAIR_PENALTY_RULES.get(reason)
+        if penalty is None:
             return
         
-        # Determina l'entità della penalità
-        if reason == FeedbackReason.COLORS_CLASH.value:
-            penalty = PAIR_PENALTY_HEAVY
-        else:
-            penalty = PAIR_PENALTY_MEDIUM
-        
         # Genera tutte le coppie
         garment_ids = self._get_garment_ids_from_outfit(outfit)
         pairs = self._generate_all_pairs(garment_ids)
 
         # Applica penalità
         for id1, id2 in pairs:
-            weights_mgr.add_pair_penalty(id1, id2, penalty)
+            weights_mgr.add_pair_penalty(id1, id2, penalty, PAIR_PENALTY_HALF_LIFE_DAYS)
         
         print(f"  → {len(pairs)} coppie penalizzate ({penalty:.3f} ciascuna)")
     
     def process_feedback(self, outfit, verdict, reason=None):
         """Processa feedback e aggiorna pesi/penalità"""
-        # 1. Registra nel database
-        self.db.add_feedback(
-            shoes_id=outfit.shoes,
-            bottom_id=outfit.bottom,
-            base_top_id=outfit.base_top,
-            mid_top_id=outfit.mid_top,
-            outerwear_id=outfit.outerwear,
-            verdict=verdict,
-            reason=reason
-        )
-        
-        # Se positivo, stop
-        if verdict == 1:
-            print("✓ Feedback positivo registrato!")
-            return
-        
-        print("✓ Feedback negativo registrato")
-        print("\n📊 Applicazione adattamenti...")
+        # Feedback e adattamenti in un'unica transazione serializzata
+        with self.db.transaction():
+            # 1. Registra nel database
+            self.db.add_feedback(
+                shoes_id=outfit.shoes,
+                bottom_id=outfit.bottom,
+                base_top_id=outfit.base_top,
+                mid_top_id=outfit.mid_top,
+                outerwear_id=outfit.outerwear,
+                verdict=verdict,
+                reason=reason
+            )
+            
+            # Se positivo, stop
+            if verdict == 1:
+                print("✓ Feedback positivo registrato!")
+                return
+            
+            print("✓ Feedback negativo registrato")
+            print("\n📊 Applicazione adattamenti...")
 
-        # 2. Crea WeightsManager
-        weights_mgr = WeightsManager(self.db)
+            # 2. Crea WeightsManager
+            weights_mgr = WeightsManager(self.db)
+
+            # 3. Applica modifiche
+            self._apply_weight_adjustments(reason, weights_mgr)
+            self._apply_pair_penalties(outfit, reason, weights_mgr)
 
-        # 3. Applica modifiche
-        self._apply_weight_adjustments(reason, weights_mgr)
-        self._apply_pair_penalties(outfit, reason, weights_mgr)
+        # 4. Ricarica pesi e penalità nell'engine (dopo il commit)
+        self.generator.load_weights(weights_mgr.get_all_weights())
+        self.generator.load_pair_penalties(
+            weights_mgr.load_pair_penalties(PAIR_PENALTY_HALF_LIFE_DAYS, PAIR_PENALTY_EPSILON)
+        )
+
+        print("\n✓ Adattamenti completati!\n")
+
+    def replay_feedback(self) -> dict:
+        """
+        Ricostruisce pesi e penalità ripercorrendo l'intero log dei feedback.
+
+        Il log viene letto in streaming in ordine di timestamp e piegato in
+        memoria con le stesse regole del feedback live (decadimento delle
+        penalità incluso); lo stato risultante sostituisce quello attuale in
+        un'unica transazione.
+
+        Returns:
+            dict con il numero di eventi rigiocati, i pesi finali e il numero di coppie penalizzate
+        """
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT key, default_value, min_value, max_value FROM weights")
+            weights = {}
+            limits = {}
+            for key, default_value, min_value, max_value in cursor.fetchall():
+                weights[key] = default_value
+                limits[key] = (min_value, max_value)
+            pair_penalties = {}  # (id1, id2) -> [penalty_score, last_updated]
+
+            cursor.execute('''
+                SELECT shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id, reason, timestamp
+                FROM feedback
+                WHERE verdict = 0
+                ORDER BY timestamp, id
+            ''')
+            events = 0
+            for shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id, reason, timestamp in cursor:
+                events += 1
+                for key, delta in WEIGHT_ADJUSTMENT_RULES.get(reason, ()):
+                    if key in limits:
+                        min_val, max_val = limits[key]
+                        weights[key] = max(min_val, min(max_val, weights[key] + delta))
+
+                penalty = PAIR_PENALTY_RULES.get(reason)
+                if penalty is None:
+                    continue
+                garment_ids = [shoes_id, bottom_id, base_top_id]
+                if mid_top_id:
+                    garment_ids.append(mid_top_id)
+                if outerwear_id:
+                    garment_ids.append(outerwear_id)
+                for id1, id2 in combinations(garment_ids, 2):
+                    pair = (id1, id2) if id1 < id2 else (id2, id1)
+                    entry = pair_penalties.get(pair)
+                    if entry is None:
+                        pair_penalties[pair] = [penalty, timestamp]
+                    else:
+                        age_days = (_parse_timestamp(timestamp) - _parse_timestamp(entry[1])).total_seconds() / 86400
+                        entry[0] = entry[0] * half_life_decay(age_days, PAIR_PENALTY_HALF_LIFE_DAYS) + penalty
+                        entry[1] = timestamp
+
+            # Compatta le coppie che, decadute ad oggi, sono sotto epsilon
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            for pair, (score, updated) in list(pair_penalties.items()):
+                age_days = (now - _parse_timestamp(updated)).total_seconds() / 86400
+                if abs(score * half_life_decay(age_days, PAIR_PENALTY_HALF_LIFE_DAYS)) < PAIR_PENALTY_EPSILON:
+                    del pair_penalties[pair]
+
+            # Scrittura in blocco dello stato ricostruito
+            cursor.executemany(
+                "UPDATE weights SET value = ?, last_modified = CURRENT_TIMESTAMP WHERE key = ?",
+                [(value, key) for key, value in weights.items()]
+            )
+            cursor.execute("DELETE FROM pair_penalties")
+            cursor.executemany('''
+                INSERT INTO pair_penalties (garment_id_1, garment_id_2, penalty_score, last_updated)
+                VALUES (?, ?, ?, ?)
+            ''', [(id1, id2, score, updated) for (id1, id2), (score, updated) in pair_penalties.items()])
+            # Nessuna regola produce penalità per singolo item: lo stato derivato è vuoto
+            cursor.execute("DELETE FROM item_penalties")
 
-        # 4. Ricarica pesi nell'engine
-        OutfitGenerator.load_weights(weights_mgr.get_all_weights())
+        weights_mgr = WeightsManager(self.db)
+        self.generator.load_weights(weights)
+        self.generator.load_pair_penalties(
+            weights_mgr.load_pair_penalties(PAIR_PENALTY_HALF_LIFE_DAYS, PAIR_PENALTY_EPSILON)
+        )
 
-        print("\n✓ Adattamenti completati!\n")
\ No newline at end of file
+        return {
+            'events': events,
+            'weights': weights,
+            'pair_penalties': len(pair_penalties),
+        }
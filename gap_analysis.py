@@ -0,0 +1,237 @@
+"""
+Analisi delle lacune del guardaroba: quanti outfit di alto livello sbloccherebbe
+un capo ipotetico ("cosa dovrei comprare?").
+
+Un outfit con il capo nuovo nello slot scelto è una combinazione degli altri
+quattro slot più il capo. Tutto ciò che non dipende dal capo (combinazioni
+valide tra loro, score colore delle coppie esistenti dalla cache, penalità,
+attributi per slot) viene calcolato una volta per slot in SlotContext; per
+ogni candidato restano solo gli score colore con le opzioni degli altri slot
+e poche operazioni vettoriali sugli array del contesto, senza un generate()
+per candidato.
+"""
+from itertools import combinations
+
+import numpy as np
+import webcolors
+
+from color_utils import css_to_rgb, hex_to_rgb, rgb_to_cielab
+from constraints import ConstraintSet
+from db_manager import OUTFIT_SLOTS
+from outfit_engine import (
+    OutfitGenerator,
+    BASE_TOP_TO_BOTTOM_MULTIPLIER, BASE_TOP_TO_SHOES_MULTIPLIER,
+    MID_TOP_TO_BOTTOM_MULTIPLIER, MID_TOP_TO_SHOES_MULTIPLIER, MID_TOP_TO_BASE_TOP_MULTIPLIER,
+    OUTERWEAR_TO_BOTTOM_MULTIPLIER, OUTERWEAR_TO_SHOES_MULTIPLIER, OUTERWEAR_TO_BASE_TOP_MULTIPLIER,
+    OUTERWEAR_TO_MID_TOP_MULTIPLIER, OUTERWEAR_TO_BOTTOM_MULTIPLIER_CASE4,
+)
+from ranking import DEFAULT_TOP_POOL
+
+SLOTS = list(OUTFIT_SLOTS)
+# Categoria e layer_role del capo ipotetico per slot (come in benchmark.SLOT_PROFILES)
+SLOT_GARMENT = {
+    'shoes': ('shoes', 'none'),
+    'bottom': ('trousers', 'none'),
+    'base_top': ('base_top', 'base'),
+    'mid_top': ('mid_top', 'mid'),
+    'outerwear': ('outerwear', 'outer'),
+}
+# Tolleranza sul confronto con la soglia (somme in ordine diverso da score_components)
+SCORE_TOLERANCE = 1e-9
+
+# Moltiplicatori delle coppie di slot nello score colore, per caso
+# (indice = 1 se c'è il mid_top + 2 se c'è l'outerwear), come in score_components
+PAIR_MULTIPLIERS = [
+    {('base_top', 'bottom'): BASE_TOP_TO_BOTTOM_MULTIPLIER, ('base_top', 'shoes'): BASE_TOP_TO_SHOES_MULTIPLIER},
+    {
+        ('mid_top', 'bottom'): MID_TOP_TO_BOTTOM_MULTIPLIER, ('mid_top', 'shoes'): MID_TOP_TO_SHOES_MULTIPLIER,
+        ('mid_top', 'base_top'): MID_TOP_TO_BASE_TOP_MULTIPLIER,
+    },
+    {
+        ('base_top', 'bottom'): BASE_TOP_TO_BOTTOM_MULTIPLIER, ('base_top', 'shoes'): BASE_TOP_TO_SHOES_MULTIPLIER,
+        ('outerwear', 'bottom'): OUTERWEAR_TO_BOTTOM_MULTIPLIER, ('outerwear', 'shoes'): OUTERWEAR_TO_SHOES_MULTIPLIER,
+        ('outerwear', 'base_top'): OUTERWEAR_TO_BASE_TOP_MULTIPLIER,
+    },
+    {
+        ('mid_top', 'bottom'): MID_TOP_TO_BOTTOM_MULTIPLIER, ('mid_top', 'shoes'): MID_TOP_TO_SHOES_MULTIPLIER,
+        ('mid_top', 'base_top'): MID_TOP_TO_BASE_TOP_MULTIPLIER,
+        ('outerwear', 'bottom'): OUTERWEAR_TO_BOTTOM_MULTIPLIER_CASE4, ('outerwear', 'shoes'): OUTERWEAR_TO_SHOES_MULTIPLIER,
+        ('outerwear', 'mid_top'): OUTERWEAR_TO_MID_TOP_MULTIPLIER,
+    },
+]
+
+def _multiplier(case: int, slot_1: str, slot_2: str) -> float:
+    multipliers = PAIR_MULTIPLIERS[case]
+    return multipliers.get((slot_1, slot_2), multipliers.get((slot_2, slot_1), 0.0))
+
+def color_lab(color: str) -> tuple:
+    """(hex, L, a, b) di un colore CSS o esadecimale (#rrggbb)"""
+    if color.startswith('#'):
+        rgb = hex_to_rgb(color)
+    else:
+        rgb = css_to_rgb(color)
+    lab = rgb_to_cielab(tuple(rgb))
+    return ('#{:02x}{:02x}{:02x}'.format(*rgb), float(lab[0]), float(lab[1]), float(lab[2]))
+
+def hypothetical_garment(slot: str, color: str, pattern: str = 'plain', warmth: int = 5, formality: int = 5, season_tags: str = 'all') -> dict:
+    """Riga garment (id 0, mai usato dal database) di un capo non ancora acquistato"""
+    if slot not in SLOT_GARMENT:
+        raise ValueError(f"Slot non valido: {slot}. Slot disponibili: {SLOTS}")
+    category, layer_role = SLOT_GARMENT[slot]
+    color_hex, l, a, b = color_lab(color)
+    return {
+        'id': 0, 'name': color, 'category': category, 'layer_role': layer_role,
+        'color_hex': color_hex, 'color_lab_l': l, 'color_lab_a': a, 'color_lab_b': b,
+        'pattern': pattern, 'warmth': warmth, 'formality': formality,
+        'season_tags': season_tags, 'occasion_tags': '', 'active': True,
+    }
+
+class SlotContext:
+    """
+    Combinazioni valide degli altri quattro slot e le loro parti di score che non
+    dipendono dal capo nello slot `slot`. Le regole additive (warmth) si applicano
+    per candidato, perché il capo nuovo contribuisce alla somma.
+    """
+    def __init__(self, generator: OutfitGenerator, db, slot: str, slot_options: dict):
+        self.generator = generator
+        self.slot = slot
+        self.others = [s for s in SLOTS if s != slot]
+        self.options = [slot_options[s] for s in self.others]
+        cache = generator._garment_cache(db)
+        cache.refresh()
+        constraints = generator.constraints(db)
+        self.rules = constraints.rules
+        pairwise = [rule for rule in self.rules if not rule.additive]
+        packed = np.frombuffer(ConstraintSet(pairwise).compile(self.options).candidates(), dtype=np.int64)
+
+        # Indici delle opzioni per slot, decodificati dalla base mista
+        self.idx = {}
+        for s, options in reversed(list(zip(self.others, self.options))):
+            packed, self.idx[s] = np.divmod(packed, len(options))
+        self.size = len(self.idx[self.others[0]])
+
+        def per_option(s, value, empty):
+            return np.array([value(g) if g is not None else empty for g in slot_options[s]])[self.idx[s]]
+
+        # Presenza e caso dello score colore (lo slot del capo nuovo è sempre presente)
+        self.present = {s: per_option(s, lambda g: True, False) for s in self.others}
+        self.present[slot] = np.ones(self.size, dtype=bool)
+        self.case = self.present['mid_top'].astype(np.int64) + 2 * self.present['outerwear']
+        self.denominator = np.array([sum(m.values()) for m in PAIR_MULTIPLIERS])[self.case]
+
+        # Score colore e penalità delle coppie che non coinvolgono il capo nuovo
+        penalties = generator.pair_penalties
+        self.color = np.zeros(self.size)
+        self.penalty = np.zeros(self.size)
+        for s1, s2 in combinations(self.others, 2):
+            o1, o2 = slot_options[s1], slot_options[s2]
+            scores = np.array([[cache.pair_color_score(g1['id'], g2['id']) if g1 and g2 else 0.0 for g2 in o2] for g1 in o1])
+            weights = np.array([_multiplier(case, s1, s2) for case in range(len(PAIR_MULTIPLIERS))])
+            self.color += weights[self.case] * scores[self.idx[s1], self.idx[s2]]
+            if penalties:
+                pair_penalty = np.array([[
+                    penalties.get((min(g1['id'], g2['id']), max(g1['id'], g2['id'])), 0.0) if g1 and g2 else 0.0
+                    for g2 in o2] for g1 in o1])
+                self.penalty += pair_penalty[self.idx[s1], self.idx[s2]]
+
+        # Attributi non cromatici degli altri slot
+        traits = lambda g: cache.garment_traits(g['id'])
+        self.pattern_weight = {s: per_option(s, lambda g: traits(g).pattern_weight, 0) for s in self.others}
+        formality = {s: per_option(s, lambda g: traits(g).formality, 0) for s in self.others}
+        self.formality_min = np.min([np.where(self.present[s], formality[s], np.iinfo(np.int64).max) for s in self.others], axis=0)
+        self.formality_max = np.max([np.where(self.present[s], formality[s], np.iinfo(np.int64).min) for s in self.others], axis=0)
+        self.layers = 1 + np.sum([self.present[s] for s in self.others], axis=0)
+        self.neutrals = np.sum([per_option(s, lambda g: traits(g).neutral, False) for s in self.others], axis=0)
+        self.sums = [np.sum([per_option(s, rule.value, 0) for s in self.others], axis=0) for rule in self.rules if rule.additive]
+
+        # Tabelle delle componenti discrete
+        weights = range(3)
+        self.pattern_table = np.array([[[OutfitGenerator.pattern_coherence_for((s, b, v)) for v in weights] for b in weights] for s in weights])
+        self.neutral_table = np.array([[OutfitGenerator.neutral_penalty_for(n, l) if l else 0.0 for l in range(6)] for n in range(6)])
+        self.color_bonus_table = np.array([OutfitGenerator.color_diversity_bonus_for(c) for c in range(6)])
+        self.simplicity_table = np.array([OutfitGenerator.simplicity_bonus_for(l) for l in range(6)])
+
+    def scores(self, garment) -> np.ndarray:
+        """Score degli outfit con il capo nello slot (NaN dove i vincoli lo escludono)"""
+        valid = np.ones(self.size, dtype=bool)
+        for rule in self.rules:
+            if rule.unary and not rule.allows(garment):
+                return np.full(self.size, np.nan)
+        pairwise = [rule for rule in self.rules if rule.pairwise]
+        color = self.color.copy()
+        pair_multipliers = np.array([[_multiplier(case, self.slot, s) for case in range(len(PAIR_MULTIPLIERS))] for s in self.others])
+        lab = OutfitGenerator.extract_lab(garment)
+        neutral = OutfitGenerator.is_neutral_color(garment)
+        for k, (s, options) in enumerate(zip(self.others, self.options)):
+            scores, compatible = [], []
+            for other in options:
+                if other is None:
+                    scores.append(0.0)
+                    compatible.append(True)
+                else:
+                    distance = OutfitGenerator.calculate_lab_distance(lab, OutfitGenerator.extract_lab(other))
+                    scores.append(OutfitGenerator.score_color_pair(distance, neutral, OutfitGenerator.is_neutral_color(other)))
+                    compatible.append(all(rule.compatible(garment, other) for rule in pairwise))
+            color += pair_multipliers[k][self.case] * np.array(scores)[self.idx[s]]
+            valid &= np.array(compatible)[self.idx[s]]
+        for rule, total in zip((rule for rule in self.rules if rule.additive), self.sums):
+            lo, hi = rule.bounds
+            total = total + rule.value(garment)
+            valid &= (total >= lo) & (total <= hi)
+        color /= self.denominator
+
+        # Componenti non cromatiche con il capo al suo posto
+        pattern_weight = OutfitGenerator.get_pattern_weight(garment['pattern'])
+        weight = lambda s: self.pattern_weight[s] if s != self.slot else pattern_weight
+        visible = weight('base_top')
+        for s in ('mid_top', 'outerwear'):
+            visible = np.where(self.present[s], weight(s), visible)
+        pattern = self.pattern_table[weight('shoes'), weight('bottom'), visible]
+        gap = np.maximum(self.formality_max, garment['formality']) - np.minimum(self.formality_min, garment['formality'])
+        formality = np.array([OutfitGenerator.formality_alignment_for(g) for g in range(int(gap.max(initial=0)) + 1)])[gap]
+        neutrals = self.neutrals + neutral
+
+        w = self.generator.weights
+        total = color * w['color_weight'] + pattern * w['pattern_weight'] + formality * w['formality_weight']
+        total = np.maximum(0.0, total + self.neutral_table[neutrals, self.layers] + self.color_bonus_table[self.layers - neutrals]
+                           + self.simplicity_table[self.layers] + self.penalty)
+        return np.where(valid, total, np.nan)
+
+def marginal_gains(wardrobe, slot: str, colors=None, top_pool: int = DEFAULT_TOP_POOL, **attributes) -> list[dict]:
+    """
+    Per ogni colore candidato (CSS o #rrggbb; default: tutta la tabella CSS) il
+    numero di outfit nuovi con score almeno pari al top_pool-esimo outfit attuale,
+    in ordine decrescente. `attributes` (pattern, warmth, formality, season_tags)
+    descrive il capo ipotetico; warmth e formality di default sono le mediane dello slot.
+    """
+    shoes, bottoms, base_tops, mid_tops, outerwear = wardrobe.garment_lists()
+    slot_options = {
+        'shoes': shoes, 'bottom': bottoms, 'base_top': base_tops,
+        'mid_top': [None] + mid_tops, 'outerwear': [None] + outerwear,
+    }
+    if slot not in slot_options:
+        raise ValueError(f"Slot non valido: {slot}. Slot disponibili: {SLOTS}")
+    current = [g for g in slot_options[slot] if g is not None]
+    for attribute in ('warmth', 'formality'):
+        if attribute not in attributes and current:
+            attributes[attribute] = int(np.median([g[attribute] for g in current]))
+
+    # Soglia: score del top_pool-esimo outfit attuale (0 se ce ne sono meno)
+    wardrobe.ranking.sync(min_rows=top_pool)
+    top = wardrobe.ranking.top(top_pool)
+    cutoff = top[-1].score if len(top) >= top_pool else 0.0
+
+    context = SlotContext(wardrobe.generator, wardrobe.db, slot, slot_options)
+    results = []
+    for color in (colors if colors is not None else webcolors.names('css3')):
+        garment = hypothetical_garment(slot, color, **attributes)
+        scores = context.scores(garment)
+        valid = scores[~np.isnan(scores)]
+        results.append({
+            'color': color,
+            'color_hex': garment['color_hex'],
+            'unlocked': int(np.count_nonzero(valid >= cutoff - SCORE_TOLERANCE)),
+            'best_score': float(valid.max()) if len(valid) else None,
+        })
+    results.sort(key=lambda r: -r['unlocked'])
+    return results
@@ -0,0 +1,137 @@
+"""
+Indice a griglia dei garment nello spazio CIELAB per trovare capi simili.
+
+Ogni categoria ha la propria griglia di celle cubiche (LAB_CELL_SIZE unità Lab
+di lato). La distanza tra due capi combina distanza Lab, differenza di
+formality (scalata) e una penalità fissa se il pattern è diverso; dato che
+non è mai inferiore alla sola distanza Lab, la ricerca k-NN visita le celle
+ad anelli crescenti attorno al capo e si ferma appena il k-esimo vicino è più
+vicino di qualsiasi cella non ancora visitata.
+"""
+import heapq
+import math
+
+LAB_CELL_SIZE = 20.0
+# Un punto di formality pesa come FORMALITY_SCALE unità Lab
+FORMALITY_SCALE = 5.0
+PATTERN_MISMATCH_DISTANCE = 15.0
+
+def _point(garment) -> tuple:
+    """(L, a, b, formality scalata, pattern) del garment"""
+    return (
+        garment['color_lab_l'], garment['color_lab_a'], garment['color_lab_b'],
+        FORMALITY_SCALE * garment['formality'], garment['pattern'],
+    )
+
+def _cell(point: tuple) -> tuple:
+    return (
+        math.floor(point[0] / LAB_CELL_SIZE),
+        math.floor(point[1] / LAB_CELL_SIZE),
+        math.floor(point[2] / LAB_CELL_SIZE),
+    )
+
+def _distance(p1: tuple, p2: tuple) -> float:
+    distance = math.dist(p1[:4], p2[:4])
+    if p1[4] != p2[4]:
+        distance += PATTERN_MISMATCH_DISTANCE
+    return distance
+
+def garment_distance(g1, g2) -> float:
+    """Distanza di sostituibilità tra due garment (0 = equivalenti)"""
+    return _distance(_point(g1), _point(g2))
+
+class _CategoryGrid:
+    """Celle occupate di una categoria e bounding box (in celle) che le contiene"""
+    def __init__(self):
+        self.cells = {}
+        self.lo = None
+        self.hi = None
+
+    def add(self, cell: tuple, garment_id: int):
+        self.cells.setdefault(cell, set()).add(garment_id)
+        # Il bounding box si allarga soltanto: dopo le rimozioni resta un sovrainsieme valido
+        if self.lo is None:
+            self.lo, self.hi = cell, cell
+        else:
+            self.lo = tuple(map(min, self.lo, cell))
+            self.hi = tuple(map(max, self.hi, cell))
+
+    def remove(self, cell: tuple, garment_id: int):
+        ids = self.cells.get(cell)
+        if ids is not None:
+            ids.discard(garment_id)
+            if not ids:
+                del self.cells[cell]
+
+    def shell(self, center: tuple, r: int):
+        """Celle occupate a distanza di Chebyshev esattamente r dal centro"""
+        ci, cj, ck = center
+        lo, hi = self.lo, self.hi
+        for i in range(max(ci - r, lo[0]), min(ci + r, hi[0]) + 1):
+            for j in range(max(cj - r, lo[1]), min(cj + r, hi[1]) + 1):
+                if abs(i - ci) == r or abs(j - cj) == r:
+                    ks = range(max(ck - r, lo[2]), min(ck + r, hi[2]) + 1)
+                else:
+                    ks = [k for k in {ck - r, ck + r} if lo[2] <= k <= hi[2]]
+                for k in ks:
+                    ids = self.cells.get((i, j, k))
+                    if ids:
+                        yield ids
+
+    def max_radius(self, center: tuple) -> int:
+        return max(max(abs(c - l), abs(h - c)) for c, l, h in zip(center, self.lo, self.hi))
+
+class GarmentIndex:
+    """
+    Indice k-NN dei garment per categoria, aggiornabile un capo alla volta.
+    `version` è il garment_version del database a cui l'indice corrisponde
+    (None = da ricostruire).
+    """
+    def __init__(self, garments=(), version=None):
+        self.garments = {}
+        self.points = {}
+        self.grids = {}
+        self.version = version
+        for garment in garments:
+            self.upsert(garment)
+
+    def upsert(self, garment):
+        """Inserisce o aggiorna un garment (riga con id, categoria, Lab, formality, pattern, active)"""
+        self.remove(garment['id'])
+        point = _point(garment)
+        self.garments[garment['id']] = garment
+        self.points[garment['id']] = point
+        self.grids.setdefault(garment['category'], _CategoryGrid()).add(_cell(point), garment['id'])
+
+    def remove(self, garment_id: int):
+        garment = self.garments.pop(garment_id, None)
+        if garment is not None:
+            self.grids[garment['category']].remove(_cell(self.points.pop(garment_id)), garment_id)
+
+    def nearest(self, garment, k: int, category: str = None, active_only: bool = True, exclude=()) -> list[tuple]:
+        """
+        I k garment più vicini a `garment` nella categoria indicata (default: la sua),
+        come lista di (distanza, garment) in ordine crescente di distanza.
+        """
+        grid = self.grids.get(category or garment['category'])
+        if grid is None or grid.lo is None or k <= 0:
+            return []
+        exclude = set(exclude)
+        query = _point(garment)
+        center = _cell(query)
+        garments, points = self.garments, self.points
+        best = []  # max-heap (distanza negata, id negato) dei k migliori finora
+        for r in range(grid.max_radius(center) + 1):
+            for ids in grid.shell(center, r):
+                for garment_id in ids:
+                    if garment_id in exclude or (active_only and not garments[garment_id]['active']):
+                        continue
+                    item = (-_distance(query, points[garment_id]), -garment_id)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+            # Le celle oltre l'anello r distano almeno r * LAB_CELL_SIZE in Lab
+            if len(best) == k and -best[0][0] <= r * LAB_CELL_SIZE:
+                break
+        return [(-distance, garments[-garment_id]) for distance, garment_id in sorted(best, reverse=True)]
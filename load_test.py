@@ -0,0 +1,161 @@
+"""
+Load test del server API con client asyncio locali.
+
+Avvia il server in-process su un guardaroba sintetico (cartella temporanea),
+poi N client concorrenti inviano un mix di generate, swap, lettura capi e
+feedback. Riporta throughput, latenze p50/p99 per endpoint e quante
+generazioni sono state condivise dal coalescing o servite dalla cache
+dei risultati (richieste con seed).
+
+    python load_test.py --clients 20 --requests 20 --size 30
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from benchmark import synthesize_wardrobe
+from db_manager import DB_Manager, FeedbackReason, wardrobe_path
+from server import OutfitServer
+from wardrobe import WardrobeRegistry
+
+DEFAULT_CLIENTS = 20
+DEFAULT_REQUESTS = 20
+DEFAULT_SIZE = 30
+DEFAULT_WARDROBES = 2
+# Probabilità di ciascuna operazione nel mix di richieste
+REQUEST_MIX = [('generate', 0.5), ('garments', 0.2), ('swap', 0.2), ('feedback', 0.1)]
+# Metà delle generate usa uno di pochi seed condivisi tra i client
+GENERATE_SEEDS = 4
+
+async def request(reader, writer, method: str, path: str, body: dict = None):
+    """Invia una richiesta HTTP/1.1 keep-alive e restituisce (status, json)"""
+    data = json.dumps(body).encode() if body is not None else b''
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+async def client(port: int, wardrobe_ids: list, n_requests: int, rng: random.Random, latencies: dict, errors: list):
+    """Singolo client: una connessione, n_requests richieste sequenziali"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    operations, weights = zip(*REQUEST_MIX)
+    reasons = [r.value for r in FeedbackReason]
+    last_outfit = {}
+    try:
+        for _ in range(n_requests):
+            wardrobe_id = rng.choice(wardrobe_ids)
+            base = f"/wardrobes/{wardrobe_id}"
+            operation = rng.choices(operations, weights)[0]
+            if operation != 'generate' and wardrobe_id not in last_outfit and operation != 'garments':
+                operation = 'generate'
+
+            if operation == 'generate':
+                body = {'count': 1}
+                if rng.random() < 0.5:
+                    body['seed'] = rng.randrange(GENERATE_SEEDS)
+                args = ('POST', f"{base}/generate", body)
+            elif operation == 'garments':
+                args = ('GET', f"{base}/garments", None)
+            elif operation == 'swap':
+                args = ('POST', f"{base}/swap", {'outfit': last_outfit[wardrobe_id], 'slot': rng.choice(['mid_top', 'shoes', 'outerwear'])})
+            else:
+                args = ('POST', f"{base}/feedback", {'outfit': last_outfit[wardrobe_id], 'verdict': 0, 'reason': rng.choice(reasons)})
+
+            start = time.perf_counter()
+            status, payload = await request(reader, writer, *args)
+            latencies[operation].append(time.perf_counter() - start)
+            if status >= 500 or (status >= 400 and operation != 'swap'):
+                errors.append(f"{operation} {status}: {payload}")
+            elif operation == 'generate' and payload:
+                last_outfit[wardrobe_id] = payload[0]
+    finally:
+        writer.close()
+
+def _percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+async def run(clients: int, n_requests: int, size: int, wardrobes: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        wardrobe_ids = [f"load{i}" for i in range(wardrobes)]
+        for wardrobe_id in wardrobe_ids:
+            db = DB_Manager(wardrobe_path(wardrobe_id, Path(tmp)))
+            synthesize_wardrobe(db, size, rng)
+            db.close()
+
+        app = OutfitServer(WardrobeRegistry(directory=Path(tmp)))
+        server = await asyncio.start_server(app.handle_connection, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+
+        latencies = defaultdict(list)
+        errors = []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            client(port, wardrobe_ids, n_requests, random.Random(seed + i), latencies, errors)
+            for i in range(clients)
+        ))
+        elapsed = time.perf_counter() - start
+
+        server.close()
+        await server.wait_closed()
+        cache_hits = sum(app.registry.get(wardrobe_id).result_cache_hits for wardrobe_id in wardrobe_ids)
+        app.close()
+
+    total = sum(len(v) for v in latencies.values())
+    return {
+        'clients': clients,
+        'requests': total,
+        'elapsed_s': elapsed,
+        'throughput_rps': total / elapsed,
+        'coalesced_generate': app.coalesced,
+        'cached_generate': cache_hits,
+        'errors': len(errors),
+        'endpoints': {
+            operation: {
+                'count': len(values),
+                'p50_ms': statistics.median(values) * 1e3,
+                'p99_ms': _percentile(values, 0.99) * 1e3,
+            }
+            for operation, values in sorted(latencies.items())
+        },
+        'first_errors': errors[:5],
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test del server API di Dressense")
+    parser.add_argument('--clients', type=int, default=DEFAULT_CLIENTS, help="client concorrenti")
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help="richieste per client")
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE, help="capi per guardaroba sintetico")
+    parser.add_argument('--wardrobes', type=int, default=DEFAULT_WARDROBES, help="numero di guardaroba")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    # process_feedback stampa i propri log: qui interessa solo il risultato finale
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = asyncio.run(run(args.clients, args.requests, args.size, args.wardrobes, args.seed))
+    print(json.dumps(result, indent=2))
+    return 1 if result['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,29 @@
-from db_manager import DB_Manager, Garment, FeedbackReason, WeightsManager
-from color_utils import css_to_rgb, rgb_to_cielab, css_to_hex
-import sys
-from outfit_engine import OutfitGenerator
-from feedback_engine import FeedbackManager
+"""
+Dressense da riga di comando.
+
+    python main.py                      sessione interattiva (come `interactive`)
+    python main.py generate --count 3 --json
+    python main.py import capi.json     aggiunge capi da un file JSON (- = stdin)
+    python main.py export -o capi.json  esporta i capi (--features: feature store)
+    python main.py feedback 6 3 7 --verdict dislike --reason boring
+    python main.py report --json
+    python main.py never 4 9            vieta i capi 4 e 9 nello stesso outfit (--remove, senza id: elenco)
+    python main.py bench -- --scales 40 80
 
-db = DB_Manager()
-weights_manager = WeightsManager(db)
-feedback_manager = FeedbackManager(db)
+Ogni sottocomando importa solo i moduli che gli servono e apre il guardaroba
+solo se lo usa: i comandi leggeri partono senza caricare il motore di generazione.
+"""
+import argparse
+import functools
+import json
+import sys
 
-OutfitGenerator.load_weights(weights_manager.get_all_weights())
+FEEDBACK_VERDICTS = {'like': 1, 'dislike': 0}
 
-current_outfit = None
+def add_new_garment(db):
+    from color_utils import css_to_rgb, rgb_to_cielab, css_to_hex
+    from db_manager import Garment
 
-def add_new_garment(db: DB_Manager):
     name = input("Inserisci nome: ")
     category = input("Inserisci categoria: ")
     layer_role = input("Inserisci layer_role [base, mid, outer, none]: ")
@@ -49,8 +60,11 @@ def garment_details(garment):
     print(f"Occasion Tags: {garment['occasion_tags']}")
     print(f"Active: {garment['active']}")
 
-def generate_and_display_outfit(db: DB_Manager):
+def generate_and_display_outfit(wardrobe, temperature=None, learned_scorer=None, profile_mode=False):
     """Genera e mostra outfit suggerito"""
+    from db_manager import FeedbackReason
+
+    db = wardrobe.db
     # Fetch garment
     shoes_list = db.get_garments_by_category('shoes')
     bottoms_list = db.get_garments_by_category('trousers')
@@ -64,11 +78,16 @@ def generate_and_display_outfit(db: DB_Manager):
     mid_tops_list = db.get_garments_by_layer('mid')
     outerwear_list = db.get_garments_by_layer('outer')
     
-    # Genera
-    outfits = OutfitGenerator.generate(
-        shoes_list, bottoms_list, base_tops_list,
-        mid_tops_list, outerwear_list, db, count=1
-    )
+    # Genera: con lo scorer manuale basta leggere il top-N materializzato,
+    # la modalità profile, lo scorer appreso e la temperatura rieseguono la pipeline completa
+    if learned_scorer is None and not profile_mode and temperature is None:
+        outfits = wardrobe.suggest(count=1)
+    else:
+        outfits = wardrobe.generator.generate(
+            shoes_list, bottoms_list, base_tops_list,
+            mid_tops_list, outerwear_list, db, count=1,
+            scorer=learned_scorer, verbose=profile_mode, temperature=temperature
+        )
     
     # Display
     if outfits:
@@ -85,7 +104,7 @@ def generate_and_display_outfit(db: DB_Manager):
         print("=======================\n")
         
         #print(f"\n=== DEBUG SCORE ===")
-        #OutfitGenerator.debug_score_breakdown(outfit, db)
+        #generator.debug_score_breakdown(outfit, db)
         #print("===================\n")
 
         try:
@@ -108,7 +127,7 @@ def generate_and_display_outfit(db: DB_Manager):
                     raise ValueError("Scelta non valida")
                 reason = reasons[choice - 1]
 
-            feedback_manager.process_feedback(outfit, verdict, reason)
+            wardrobe.feedback.process_feedback(outfit, verdict, reason)
         except (KeyboardInterrupt, EOFError):
             print("\n⏭️  Rating saltato\n")
         
@@ -117,58 +136,395 @@ def generate_and_display_outfit(db: DB_Manager):
         print("Nessun outfit valido trovato!")
         return None
 
-print("Buongiorno Michele!")
-print("Cosa vuoi fare?")
-print("a -> Aggiungere nuovo capo")
-print("l -> Listare capi esistenti")
-print("deac -> Disattiva un capo")
-print("ac -> Attiva un capo")
-print("d -> Ottieni dettagli su un capo")
-print("r -> Rimuovi un capo")
-while True:
+def _temperature(args):
+    """Temperatura del giorno: da riga di comando o dal file di previsioni (None = ignorata)"""
+    if args.temperature is not None:
+        return args.temperature
+    from weather import FORECAST_PATH, forecast_temperature
+    return forecast_temperature(args.forecast or FORECAST_PATH)
+
+def _open_wardrobe(args):
+    """Guardaroba scelto (default data/wardrobe.db): pesi e penalità caricati all'apertura"""
+    from wardrobe import Wardrobe
+    try:
+        return Wardrobe(args.wardrobe) if args.wardrobe else Wardrobe()
+    except ValueError as e:
+        sys.exit(f"Errore: {e}")
+
+def _open_db(args):
+    """Database del guardaroba scelto, senza caricare il motore di generazione"""
+    from db_manager import DB_Manager, wardrobe_path
+    try:
+        return DB_Manager(wardrobe_path(args.wardrobe)) if args.wardrobe else DB_Manager()
+    except ValueError as e:
+        sys.exit(f"Errore: {e}")
+
+def cmd_interactive(args) -> int:
+    wardrobe = _open_wardrobe(args)
+    db = wardrobe.db
+
+    # Scorer appreso (Phase 5), attivato con il comando 'ml'
+    learned_scorer = None
+    # Modalità profile: statistiche di generate() dopo ogni 'g'
+    profile_mode = False
+    temperature = _temperature(args)
+
+    print("Buongiorno Michele!")
+    if temperature is not None:
+        print(f"Temperatura: {temperature:.1f} °C")
+    print("Cosa vuoi fare?")
+    print("a -> Aggiungere nuovo capo")
+    print("l -> Listare capi esistenti")
+    print("deac -> Disattiva un capo")
+    print("ac -> Attiva un capo")
+    print("d -> Ottieni dettagli su un capo")
+    print("sim -> Capi simili a un capo (possibili sostituti)")
+    print("r -> Rimuovi un capo")
+    print("never -> Vieta/consenti due capi nello stesso outfit")
+    print("buy -> Colori da acquistare che sbloccano più outfit")
+    print("report -> Utilizzo e feedback dei capi")
+    print("replay -> Ricalcola pesi e penalità dallo storico dei feedback")
+    print("train -> Addestra lo scorer appreso dai feedback")
+    print("ml -> Attiva/disattiva lo scorer appreso")
+    print("export -> Esporta i nuovi feedback nel feature store colonnare")
+    print("profile -> Attiva/disattiva le statistiche di generazione")
+    print("sql -> Attiva/disattiva il report delle query SQL dopo ogni comando")
+    while True:
+        try:
+            option = input("> ").lower()
+            if option == 'a':
+                add_new_garment(db)
+            elif option == 'l':
+                garments = db.list_garments(show_inactive=True)
+                for garment in garments:
+                    print(f"{garment['id']}: {garment['name']} ({garment['category']})")
+            elif option == "deac":
+                garment_id = int(input("Inserisci id: "))
+                if db.deactivate_garment(garment_id):
+                    print("Capo disattivato")
+                else:
+                    print("ID non trovato")
+            elif option == "ac":
+                garment_id = int(input("Inserisci id: "))
+                if db.activate_garment(garment_id):
+                    print("Capo attivato")
+                else:
+                    print("ID non trovato")
+            elif option == "d":
+                garment_id = int(input("Inserisci id: "))
+                garment = db.get_garment(garment_id)
+                if garment:
+                    garment_details(garment)
+                else:
+                    print("✗ Capo non trovato")
+            elif option == "sim":
+                garment_id = int(input("Inserisci id: "))
+                substitutes = db.find_substitutes(garment_id)
+                if not substitutes:
+                    print("✗ Nessun capo simile trovato")
+                for distance, garment in substitutes:
+                    print(f"{garment['id']}: {garment['name']} (distanza {distance:.1f})")
+            elif option == "r":
+                garment_id = int(input("Inserisci id: "))
+                db.delete_garment(garment_id)
+            elif option == "never":
+                for id_1, id_2 in sorted(db.get_never_together()):
+                    print(f"{id_1} ✗ {id_2}")
+                garment_id_1 = int(input("Inserisci id del primo capo: "))
+                garment_id_2 = int(input("Inserisci id del secondo capo: "))
+                if db.remove_never_together(garment_id_1, garment_id_2):
+                    print("✓ I due capi possono di nuovo stare insieme")
+                else:
+                    try:
+                        db.add_never_together(garment_id_1, garment_id_2)
+                    except ValueError as e:
+                        print(f"✗ {e}")
+                    else:
+                        print("✓ I due capi non verranno più proposti insieme")
+            elif option == "buy":
+                from gap_analysis import marginal_gains, SLOTS
+                slot = input(f"Slot [{', '.join(SLOTS)}]: ")
+                colors = input("Colori (CSS o #hex, separati da virgola; vuoto = tabella CSS): ").strip()
+                try:
+                    gains = marginal_gains(wardrobe, slot, [c.strip() for c in colors.split(',')] if colors else None)
+                except ValueError as e:
+                    print(f"✗ {e}")
+                else:
+                    for gain in gains[:10]:
+                        print(f"{gain['color']} ({gain['color_hex']}): +{gain['unlocked']} outfit tra i migliori")
+            # Funzionalità fantasma, l'utente NON ne è a conoscenza
+            elif option == 'm':
+                garment_id = int(input("Inserisci id: "))
+                field_name = input("Inserisci field_name: ")
+                new_value = input("Inserisci il nuovo valore: ")
+                edit = db.update_garment_field(garment_id, field_name, new_value)
+                if edit:
+                    print("Elemento aggiornato con successo!")
+                else:
+                    print("Id non valido")
+            elif option == 'g':
+                generate_and_display_outfit(wardrobe, temperature, learned_scorer, profile_mode)
+            elif option == 'report':
+                from reports import wardrobe_report, format_report
+                print(format_report(wardrobe_report(wardrobe)))
+            elif option == 'replay':
+                summary = wardrobe.feedback.replay_feedback()
+                print(f"✓ {summary['events']} feedback rigiocati, {summary['pair_penalties']} coppie penalizzate")
+                for key, value in summary['weights'].items():
+                    print(f"  → {key}: {value:.3f}")
+            elif option == 'train':
+                from ml_scorer import LearnedScorer
+                try:
+                    scorer = LearnedScorer.train(db)
+                except ValueError as e:
+                    print(f"✗ {e}")
+                else:
+                    scorer.save()
+                    print("✓ Scorer addestrato e salvato")
+                    if learned_scorer is not None:
+                        learned_scorer = scorer
+            elif option == 'ml':
+                if learned_scorer is None:
+                    from ml_scorer import LearnedScorer, MODEL_PATH
+                    if MODEL_PATH.exists():
+                        learned_scorer = LearnedScorer.load()
+                        print("Scorer appreso attivo")
+                    else:
+                        print("✗ Nessun modello salvato, usa prima 'train'")
+                else:
+                    learned_scorer = None
+                    print("Scorer manuale attivo")
+            elif option == 'sql':
+                if db.pool.profiler is None:
+                    db.enable_profiling()
+                    print("Profiling SQL attivo")
+                else:
+                    db.disable_profiling()
+                    print("Profiling SQL disattivo")
+                continue
+            elif option == 'profile':
+                profile_mode = not profile_mode
+                print(f"Modalità profile {'attiva' if profile_mode else 'disattiva'}")
+            elif option == 'export':
+                from feature_store import FeatureStore
+                added = FeatureStore().export(db)
+                print(f"✓ {added} feedback esportati")
+
+            # Report delle query eseguite dal comando
+            if db.pool.profiler is not None:
+                print(db.pool.profiler.report())
+                db.pool.profiler.reset()
+        except KeyboardInterrupt:
+            print("Exiting...")
+            db.close()
+            return 0
+
+def cmd_generate(args) -> int:
+    wardrobe = _open_wardrobe(args)
+    temperature = _temperature(args)
+    # Come nella sessione interattiva: il top-N materializzato basta se non c'è una temperatura
+    if temperature is None:
+        outfits = wardrobe.suggest(count=args.count, top_pool=args.top_pool, seed=args.seed)
+    else:
+        outfits = wardrobe.generate(count=args.count, seed=args.seed, top_pool=args.top_pool, temperature=temperature)
+    if args.json:
+        import dataclasses
+        print(json.dumps([dataclasses.asdict(outfit) for outfit in outfits], indent=2))
+    else:
+        from db_manager import OUTFIT_SLOTS
+        for outfit in outfits:
+            names = [wardrobe.db.get_garment(getattr(outfit, slot))['name'] for slot in OUTFIT_SLOTS if getattr(outfit, slot)]
+            print(f"{outfit.score:.2f}  " + " + ".join(names))
+    wardrobe.close()
+    return 0 if outfits else 1
+
+def _garment_from_json(data: dict):
+    """Garment da un oggetto JSON: o i campi esportati (color_hex e Lab) o un colore CSS/#hex in 'color'"""
+    from db_manager import Garment
+
+    fields = dict(data)
+    fields.pop('id', None)
+    if 'color' in fields:
+        from color_utils import css_to_hex, css_to_rgb, hex_to_rgb, rgb_to_cielab
+        color = fields.pop('color')
+        if color.startswith('#'):
+            color_hex, rgb = color.lower(), hex_to_rgb(color)
+        else:
+            color_hex, rgb = css_to_hex(color), css_to_rgb(color)
+        lab = rgb_to_cielab(rgb)
+        fields.update(color_hex=color_hex, color_lab_l=float(lab[0]), color_lab_a=float(lab[1]), color_lab_b=float(lab[2]))
+    fields.setdefault('layer_role', 'none')
+    fields.setdefault('pattern', 'plain')
+    fields.setdefault('season_tags', '')
+    fields.setdefault('occasion_tags', '')
+    fields['active'] = bool(fields.get('active', True))
+    return Garment(**fields)
+
+def cmd_import(args) -> int:
+    import sqlite3
+    from db_manager import validate_garment
+
+    try:
+        source = sys.stdin if args.file == '-' else open(args.file, encoding='utf-8')
+        with source:
+            data = json.load(source)
+    except (OSError, ValueError) as e:
+        print(f"✗ File non leggibile: {e}", file=sys.stderr)
+        return 1
+    # Tutti i capi controllati prima di scrivere: un record non valido non lascia un import a metà
+    try:
+        garments = [validate_garment(_garment_from_json(item)) for item in data]
+    except (TypeError, ValueError) as e:
+        print(f"✗ Capo non valido: {e}", file=sys.stderr)
+        return 1
+    db = _open_db(args)
     try:
-        option = input("> ").lower()
-        if option == 'a':
-            add_new_garment(db)
-        elif option == 'l':
-            garments = db.list_garments(show_inactive=True)
+        with db.transaction():
             for garment in garments:
-                print(f"{garment['id']}: {garment['name']} ({garment['category']})")
-        elif option == "deac":
-            garment_id = int(input("Inserisci id: "))
-            if db.deactivate_garment(garment_id):
-                print("Capo disattivato")
-            else:
-                print("ID non trovato")
-        elif option == "ac":
-            garment_id = int(input("Inserisci id: "))
-            if db.activate_garment(garment_id):
-                print("Capo attivato")
-            else:
-                print("ID non trovato")
-        elif option == "d":
-            garment_id = int(input("Inserisci id: "))
-            garment = db.get_garment(garment_id)
-            if garment:
-                garment_details(garment)
-            else:
-                print("✗ Capo non trovato")
-        elif option == "r":
-            garment_id = int(input("Inserisci id: "))
-            db.delete_garment(garment_id)
-        # Funzionalità fantasma, l'utente NON ne è a conoscenza
-        elif option == 'm':
-            garment_id = int(input("Inserisci id: "))
-            field_name = input("Inserisci field_name: ")
-            new_value = input("Inserisci il nuovo valore: ")
-            edit = db.update_garment_field(garment_id, field_name, new_value)
-            if edit:
-                print("Elemento aggiornato con successo!")
-            else:
-                print("Id non valido")
-        elif option == 'g':
-            current_outfit = generate_and_display_outfit(db)
-    except KeyboardInterrupt:
-        print("Exiting...")
+                db.add_garment(garment)
+    except sqlite3.IntegrityError as e:
+        print(f"✗ Import annullato: {e}", file=sys.stderr)
+        return 1
+    finally:
         db.close()
-        sys.exit(0)
\ No newline at end of file
+    print(f"✓ {len(garments)} capi importati")
+    return 0
+
+def cmd_export(args) -> int:
+    db = _open_db(args)
+    if args.features:
+        from feature_store import FeatureStore
+        added = FeatureStore().export(db)
+        print(f"✓ {added} feedback esportati")
+    else:
+        garments = [dict(row) for row in db.get_all_garments()]
+        text = json.dumps(garments, indent=2, ensure_ascii=False)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text + "\n")
+            print(f"✓ {len(garments)} capi esportati in {args.output}")
+        else:
+            print(text)
+    db.close()
+    return 0
+
+def cmd_feedback(args) -> int:
+    from db_manager import FeedbackReason
+    from outfit_engine import Outfit
+
+    verdict = FEEDBACK_VERDICTS[args.verdict]
+    reasons = [r.value for r in FeedbackReason]
+    if verdict == 0 and args.reason not in reasons:
+        print(f"✗ Con un dislike serve --reason tra: {', '.join(reasons)}", file=sys.stderr)
+        return 1
+    if verdict == 1 and args.reason is not None:
+        print("✗ --reason vale solo per i dislike", file=sys.stderr)
+        return 1
+    wardrobe = _open_wardrobe(args)
+    outfit = Outfit(args.shoes, args.bottom, args.base_top, args.mid_top, args.outerwear)
+    wardrobe.feedback.process_feedback(outfit, verdict, args.reason)
+    wardrobe.close()
+    return 0
+
+def cmd_never(args) -> int:
+    db = _open_db(args)
+    try:
+        if not args.garments:
+            for id_1, id_2 in sorted(db.get_never_together()):
+                print(f"{id_1} {id_2}")
+        elif len(args.garments) != 2:
+            print("✗ Servono esattamente due id", file=sys.stderr)
+            return 1
+        elif args.remove:
+            if not db.remove_never_together(*args.garments):
+                print("✗ Coppia non presente", file=sys.stderr)
+                return 1
+        else:
+            try:
+                db.add_never_together(*args.garments)
+            except ValueError as e:
+                print(f"✗ {e}", file=sys.stderr)
+                return 1
+        return 0
+    finally:
+        db.close()
+
+def cmd_report(args) -> int:
+    from reports import wardrobe_report, format_report
+
+    wardrobe = _open_wardrobe(args)
+    report = wardrobe_report(wardrobe, top_pool=args.top_pool)
+    print(json.dumps(report, indent=2, ensure_ascii=False) if args.json else format_report(report))
+    wardrobe.close()
+    return 0
+
+def cmd_bench(args) -> int:
+    from benchmark import main as benchmark_main
+
+    bench_args = args.bench_args[1:] if args.bench_args[:1] == ['--'] else args.bench_args
+    return benchmark_main(bench_args)
+
+def build_parser() -> argparse.ArgumentParser:
+    def with_temperature(command, default=None):
+        command.add_argument('--temperature', type=float, default=default, help="temperatura in °C per la fascia di warmth degli outfit")
+        command.add_argument('--forecast', default=default, help="file JSON locale di previsioni (se --temperature manca)")
+        return command
+
+    # --temperature/--forecast anche prima del sottocomando, come quando main.py era solo interattivo;
+    # nei sottocomandi il default SUPPRESS non sovrascrive il valore già letto
+    parser = with_temperature(argparse.ArgumentParser(description="Dressense"))
+    parser.add_argument('--wardrobe', help="ID del guardaroba (default: data/wardrobe.db)")
+    parser.set_defaults(handler=cmd_interactive)
+    commands = parser.add_subparsers(dest='command')
+    with_temperature = functools.partial(with_temperature, default=argparse.SUPPRESS)
+
+    with_temperature(commands.add_parser('interactive', help="sessione interattiva")).set_defaults(handler=cmd_interactive)
+
+    generate = with_temperature(commands.add_parser('generate', help="genera outfit"))
+    generate.add_argument('--count', type=int, default=1)
+    generate.add_argument('--top-pool', type=int, default=150)
+    generate.add_argument('--seed', type=int, help="risultato deterministico")
+    generate.add_argument('--json', action='store_true', help="output JSON")
+    generate.set_defaults(handler=cmd_generate)
+
+    import_ = commands.add_parser('import', help="aggiunge capi da un file JSON")
+    import_.add_argument('file', help="lista JSON di capi (- = stdin)")
+    import_.set_defaults(handler=cmd_import)
+
+    export = commands.add_parser('export', help="esporta i capi in JSON")
+    export.add_argument('-o', '--output', help="file di destinazione (default: stdout)")
+    export.add_argument('--features', action='store_true', help="esporta invece i nuovi feedback nel feature store")
+    export.set_defaults(handler=cmd_export)
+
+    feedback = commands.add_parser('feedback', help="registra un feedback su un outfit")
+    feedback.add_argument('shoes', type=int)
+    feedback.add_argument('bottom', type=int)
+    feedback.add_argument('base_top', type=int)
+    feedback.add_argument('--mid-top', type=int)
+    feedback.add_argument('--outerwear', type=int)
+    feedback.add_argument('--verdict', choices=sorted(FEEDBACK_VERDICTS), required=True)
+    feedback.add_argument('--reason', help="motivo del dislike")
+    feedback.set_defaults(handler=cmd_feedback)
+
+    never = commands.add_parser('never', help="coppie di capi da non proporre mai insieme")
+    never.add_argument('garments', type=int, nargs='*', help="i due id (nessuno = elenco delle coppie)")
+    never.add_argument('--remove', action='store_true', help="consente di nuovo la coppia")
+    never.set_defaults(handler=cmd_never)
+
+    report = commands.add_parser('report', help="utilizzo e feedback dei capi")
+    report.add_argument('--top-pool', type=int, default=150)
+    report.add_argument('--json', action='store_true', help="output JSON")
+    report.set_defaults(handler=cmd_report)
+
+    bench = commands.add_parser('bench', help="benchmark su guardaroba sintetici (argomenti passati a benchmark.py)")
+    bench.add_argument('bench_args', nargs=argparse.REMAINDER)
+    bench.set_defaults(handler=cmd_bench)
+    return parser
+
+def main(argv=None) -> int:
+    # Senza sottocomando: sessione interattiva
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
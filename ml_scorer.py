@@ -0,0 +1,155 @@
+import numpy as np
+from pathlib import Path
+from db_manager import DB_Manager, OUTFIT_SLOTS
+from outfit_engine import OutfitGenerator
+
+MODEL_PATH = Path('data/scorer_model.npz')
+
+# Iperparametri della regressione logistica
+LEARNING_RATE = 0.5
+TRAINING_EPOCHS = 2000
+L2_REGULARIZATION = 1e-3
+MIN_TRAINING_SAMPLES = 10
+
+SLOT_NAMES = list(OUTFIT_SLOTS)
+# Coppie di slot di cui si misura la distanza CIELAB (5 slot → 10 coppie)
+SLOT_PAIRS = [(i, j) for i in range(len(SLOT_NAMES)) for j in range(i + 1, len(SLOT_NAMES))]
+
+FEATURE_NAMES = (
+    [f"distance_{SLOT_NAMES[i]}_{SLOT_NAMES[j]}" for i, j in SLOT_PAIRS]
+    + [f"chroma_{slot}" for slot in OUTFIT_SLOTS]
+    + [f"pattern_{slot}" for slot in OUTFIT_SLOTS]
+    + ['formality_gap', 'layer_count', 'bias']
+)
+
+class GarmentFeatures:
+    """
+    Attributi dei garment in array NumPy allineati, indicizzati per posizione.
+    La riga 0 è riservata allo slot vuoto (mid/outer assenti).
+    """
+    def __init__(self, garments):
+        garments = list(garments)
+        n = len(garments) + 1
+        self.index = {}
+        self.lab = np.zeros((n, 3))
+        self.pattern = np.zeros(n)
+        self.formality = np.zeros(n)
+        self.warmth = np.zeros(n)
+        for row, g in enumerate(garments, 1):
+            self.index[g['id']] = row
+            self.lab[row] = OutfitGenerator.extract_lab(g)
+            self.pattern[row] = OutfitGenerator.get_pattern_weight(g['pattern'])
+            self.formality[row] = g['formality']
+            self.warmth[row] = g['warmth']
+        self.chroma = np.hypot(self.lab[:, 1], self.lab[:, 2])
+
+    def rows_for(self, outfits) -> np.ndarray:
+        """Matrice (n, 5) di righe garment per ogni outfit (0 = slot vuoto)"""
+        index = self.index
+        return np.array([
+            (index[o.shoes], index[o.bottom], index[o.base_top],
+             index[o.mid_top] if o.mid_top else 0,
+             index[o.outerwear] if o.outerwear else 0)
+            for o in outfits
+        ], dtype=np.intp).reshape(-1, len(OUTFIT_SLOTS))
+
+    def rows_for_ids(self, garment_ids: np.ndarray) -> np.ndarray:
+        """Converte in blocco una matrice di garment_id in righe (0 = vuoto o capo eliminato)"""
+        lookup = np.zeros(max(self.index, default=0) + 1, dtype=np.intp)
+        for garment_id, row in self.index.items():
+            lookup[garment_id] = row
+        valid = (garment_ids > 0) & (garment_ids < len(lookup))
+        return np.where(valid, lookup[np.where(valid, garment_ids, 0)], 0)
+
+    def feature_matrix(self, rows: np.ndarray) -> np.ndarray:
+        """Costruisce le feature di tutti gli outfit in blocco"""
+        present = rows > 0
+        lab = self.lab[rows]                        # (n, 5, 3)
+        n = rows.shape[0]
+
+        features = np.empty((n, len(FEATURE_NAMES)))
+        col = 0
+        for i, j in SLOT_PAIRS:
+            distance = np.linalg.norm(lab[:, i] - lab[:, j], axis=1)
+            features[:, col] = np.where(present[:, i] & present[:, j], distance, 0.0) / 100
+            col += 1
+        features[:, col:col + 5] = self.chroma[rows] / 100
+        col += 5
+        features[:, col:col + 5] = self.pattern[rows] / 2
+        col += 5
+
+        formality = self.formality[rows]
+        form_max = np.where(present, formality, -np.inf).max(axis=1)
+        form_min = np.where(present, formality, np.inf).min(axis=1)
+        features[:, col] = (form_max - form_min) / 10
+        features[:, col + 1] = (present.sum(axis=1) - 3) / 2
+        features[:, col + 2] = 1.0
+        return features
+
+class LearnedScorer:
+    """
+    Scorer appreso dai feedback (Phase 5): regressione logistica in NumPy.
+    Lo score di un outfit è la probabilità stimata di un feedback positivo.
+    """
+    def __init__(self, coefficients: np.ndarray):
+        self.coefficients = coefficients
+
+    @staticmethod
+    def _sigmoid(z: np.ndarray) -> np.ndarray:
+        return 1.0 / (1.0 + np.exp(-z))
+
+    @classmethod
+    def train(cls, db: DB_Manager) -> 'LearnedScorer':
+        """Addestra il modello sull'intera tabella feedback"""
+        cursor = db.conn.cursor()
+        cursor.execute("SELECT * FROM garment")
+        features = GarmentFeatures(cursor.fetchall())
+
+        cursor.execute("SELECT shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id, verdict FROM feedback")
+        index = features.index
+        rows, labels = [], []
+        for *garment_ids, verdict in cursor:
+            # Salta i feedback che riferiscono capi eliminati
+            if any(g is not None and g not in index for g in garment_ids):
+                continue
+            rows.append([index[g] if g is not None else 0 for g in garment_ids])
+            labels.append(verdict)
+
+        if len(labels) < MIN_TRAINING_SAMPLES or len(set(labels)) < 2:
+            raise ValueError(f"Feedback insufficienti per l'addestramento (servono almeno {MIN_TRAINING_SAMPLES}, con like e dislike)")
+
+        X = features.feature_matrix(np.array(rows, dtype=np.intp))
+        y = np.array(labels, dtype=float)
+
+        # Discesa del gradiente full-batch con regolarizzazione L2 (bias escluso)
+        w = np.zeros(X.shape[1])
+        regularization = np.full(X.shape[1], L2_REGULARIZATION)
+        regularization[-1] = 0.0
+        for _ in range(TRAINING_EPOCHS):
+            error = cls._sigmoid(X @ w) - y
+            w -= LEARNING_RATE * (X.T @ error / len(y) + regularization * w)
+
+        return cls(w)
+
+    def save(self, path: Path = MODEL_PATH):
+        np.savez(path, coefficients=self.coefficients, feature_names=np.array(FEATURE_NAMES))
+
+    @classmethod
+    def load(cls, path: Path = MODEL_PATH) -> 'LearnedScorer':
+        """Carica un modello salvato; fallisce se le feature non corrispondono"""
+        data = np.load(path)
+        if tuple(data['feature_names']) != tuple(FEATURE_NAMES):
+            raise ValueError("Modello salvato con feature diverse: riaddestrare")
+        return cls(data['coefficients'])
+
+    def score_batch(self, outfits, garments) -> np.ndarray:
+        """
+        Calcola lo score di un blocco di outfit con un'unica moltiplicazione matriciale
+
+        Args:
+            outfits: lista di Outfit candidati
+            garments: righe garment che compaiono negli outfit
+        """
+        features = GarmentFeatures(garments)
+        X = features.feature_matrix(features.rows_for(outfits))
+        return self._sigmoid(X @ self.coefficients)
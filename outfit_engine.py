@@ -1,11 +1,17 @@
-from dataclasses import dataclass
-from typing import Optional
-from itertools import product, combinations
+from dataclasses import dataclass, replace
+from typing import NamedTuple, Optional
+from itertools import combinations
+from collections import Counter
+import heapq
 import random
 import math
-from db_manager import DB_Manager, WeightsManager
-
-FORMALITY_THRESHOLD = 4
+import time
+from array import array
+from db_manager import DB_Manager, OUTFIT_SLOTS, outfit_signature
+from constraints import ConstraintSet, FormalityGap, NeverTogether, TemperatureWarmth, FORMALITY_THRESHOLD
+from palette import cluster_garments, PALETTE_EXPAND
+from snapshot import PairScoreSnapshot, snapshot_path
+from score_cache import ScoreCache, score_cache_path, SCORE_CACHE_COMPONENTS, SCORE_CACHE_MAX_ENTRIES
 NEUTRAL_SATURATION_THRESHOLD = 20
 
 BASE_TOP_TO_BOTTOM_MULTIPLIER = 1.0
@@ -26,7 +32,7 @@ OUTERWEAR_TO_BOTTOM_MULTIPLIER_CASE4 = 0.3
 #PATTERN_WEIGHT = 0.3
 #FORMALITY_WEIGHT = 0.15
 
-@dataclass
+@dataclass(slots=True)
 class Outfit:
     shoes: int # garment_id
     bottom: int # garment_id
@@ -37,19 +43,298 @@ class Outfit:
 
     # Metodi della classe
 
+    def signature(self) -> tuple:
+        """Chiave canonica dell'outfit (vedi db_manager.outfit_signature)"""
+        return outfit_signature(self.shoes, self.bottom, self.base_top, self.mid_top, self.outerwear)
+
+@dataclass
+class GenerationStats:
+    """
+    Tempi e contatori per fase di una chiamata a generate().
+    L'enumerazione applica già i vincoli hard: filtering_s misura solo
+    l'esclusione degli outfit con dislike.
+    """
+    enumeration_s: float = 0.0
+    filtering_s: float = 0.0
+    scoring_s: float = 0.0
+    selection_s: float = 0.0
+    candidates_enumerated: int = 0
+    candidates_pruned: int = 0
+    candidates_disliked: int = 0
+    candidates_scored: int = 0
+    candidates_cached: int = 0
+    db_queries: int = 0
+
+    @property
+    def total_s(self) -> float:
+        return self.enumeration_s + self.filtering_s + self.scoring_s + self.selection_s
+
+    def report(self) -> str:
+        return (
+            f"Candidati: {self.candidates_enumerated} enumerati, {self.candidates_pruned} scartati, "
+            f"{self.candidates_disliked} con dislike, {self.candidates_scored} valutati, "
+            f"{self.candidates_cached} dalla cache | query DB: {self.db_queries}\n"
+            f"Tempi: enumerazione {self.enumeration_s*1000:.1f} ms, filtri {self.filtering_s*1000:.1f} ms, "
+            f"scoring {self.scoring_s*1000:.1f} ms, selezione {self.selection_s*1000:.1f} ms "
+            f"(totale {self.total_s*1000:.1f} ms)"
+        )
+
+class ScoreComponents(NamedTuple):
+    """Componenti dello score di un outfit; solo le prime tre dipendono dai pesi"""
+    color: float
+    pattern: float
+    formality: float
+    neutral_penalty: float
+    color_bonus: float
+    simplicity_bonus: float
+    pair_penalty: float
+
+    def total(self, weights: dict) -> float:
+        total_score = self.color*weights['color_weight'] + self.pattern*weights['pattern_weight'] + self.formality*weights['formality_weight']
+        return max(0.0, total_score+self.neutral_penalty+self.color_bonus+self.simplicity_bonus+self.pair_penalty)
+
+DEFAULT_WEIGHTS = {
+    'formality_threshold': 4,
+    'neutral_saturation_threshold': 20,
+    'color_weight': 0.55,
+    'pattern_weight': 0.3,
+    'formality_weight': 0.15,
+}
+
+# Stima approssimativa della memoria occupata dalle cache
+GARMENT_CACHE_ENTRY_BYTES = 1024
+PAIR_SCORE_CACHE_ENTRY_BYTES = 160
+# Oltre questa soglia la cache degli score colore di coppia viene svuotata
+MAX_PAIR_SCORES = 250_000
+# Outfit materializzati per volta quando si usa uno scorer in blocco
+SCORER_CHUNK_SIZE = 65_536
+
+class GarmentTraits(NamedTuple):
+    """Attributi di un garment da cui dipendono le componenti non cromatiche"""
+    neutral: bool
+    pattern_weight: int
+    formality: int
+
+class WardrobeCache:
+    """
+    Cache in memoria dei garment di un guardaroba e delle componenti dello score.
+    Espone get_garment() come DB_Manager; viene invalidata quando cambia
+    il contatore garment_version del database (garment e coppie "mai insieme").
+
+    Le componenti non cromatiche sono memorizzate per chiave minima (pesi pattern
+    dei capi visibili, gap di formality, numero di neutrali, numero di layer):
+    non dipendono dai pesi, che entrano solo in ScoreComponents.total.
+    Gli score colore di coppia vengono da uno snapshot su file mappato in
+    memoria (vedi snapshot.py), ricostruito quando il guardaroba cambia;
+    componenti e score degli outfit già valutati da una cache persistente
+    (vedi score_cache.py).
+    """
+    def __init__(self, db: DB_Manager):
+        self.db = db
+        self.version = None
+        self.snapshot = None
+        self.snapshot_path = snapshot_path(db.pool.path)
+        self.weights_version = None
+        self.scores = None
+        self.scores_path = score_cache_path(db.pool.path)
+        self.garments = {}
+        self.never_together = frozenset()
+        self.pair_scores = {}
+        self.traits = {}
+        self.pattern_scores = {}
+        self.formality_scores = {}
+        self.neutral_scores = {}
+        self.simplicity_scores = {}
+        self.palettes = {}
+
+    def refresh(self):
+        """Ricarica i garment (una sola query) se il guardaroba è cambiato"""
+        versions = self.db.get_versions()
+        version = versions.get('garment_version')
+        self.weights_version = versions.get('weights_version')
+        if version != self.version or not self.garments:
+            self.garments = {g['id']: g for g in self.db.get_all_garments()}
+            self.never_together = frozenset(self.db.get_never_together())
+            self.pair_scores = {}
+            self.traits = {}
+            self.palettes = {}
+            self.version = version
+            self._map_snapshot()
+            self._map_scores()
+
+    def _map_snapshot(self):
+        """Mappa lo snapshot degli score di coppia, ricostruendolo se non corrisponde ai garment"""
+        if self.snapshot_path is None:
+            return
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.covers(self.garments):
+            # Un altro processo può averlo già ricostruito
+            snapshot = PairScoreSnapshot.load(self.snapshot_path) or snapshot
+            if snapshot is None or not snapshot.covers(self.garments):
+                snapshot = PairScoreSnapshot.build(self.snapshot_path, self.version, self.garments, snapshot)
+        self.snapshot = snapshot
+
+    def _map_scores(self):
+        """Mappa la cache persistente degli score, escludendo i candidati con capi modificati"""
+        if self.scores_path is None:
+            self.scores = None
+            return
+        # Il file può essere stato riscritto da un altro processo
+        scores = ScoreCache.load(self.scores_path) or self.scores
+        if scores is not None:
+            scores.invalidate(self.score_traits())
+        self.scores = scores
+
+    def score_traits(self) -> dict:
+        """Tratti di ogni garment da cui dipendono le componenti dello score (vedi ScoreCache)"""
+        return {
+            garment_id: (garment['color_lab_l'], garment['color_lab_a'], garment['color_lab_b'],
+                         float(OutfitGenerator.get_pattern_weight(garment['pattern'])), float(garment['formality']))
+            for garment_id, garment in self.garments.items()
+        }
+
+    def save_scores(self, slot_ids: list, candidates: array, components: array, scores: array):
+        """Salva nella cache persistente componenti e score dei candidati di una ricerca esaustiva"""
+        if self.scores_path is None or len(candidates) > SCORE_CACHE_MAX_ENTRIES:
+            return
+        self.scores = ScoreCache.build(self.scores_path, self.version, self.weights_version, self.score_traits(),
+                                       slot_ids, candidates, components, scores, self.scores)
+
+    @staticmethod
+    def _compute_pair_score(g1, g2) -> float:
+        distance = OutfitGenerator.calculate_lab_distance(OutfitGenerator.extract_lab(g1), OutfitGenerator.extract_lab(g2))
+        return OutfitGenerator.score_color_pair(distance, OutfitGenerator.is_neutral_color(g1), OutfitGenerator.is_neutral_color(g2))
+
+    def get_garment(self, garment_id: int):
+        if self.version is None:
+            self.refresh()
+        garment = self.garments.get(garment_id)
+        if garment is None:
+            garment = self.db.get_garment(garment_id)
+            if garment is not None:
+                self.garments[garment_id] = garment
+        return garment
+
+    def palette(self, garments: list, k: int) -> list[list]:
+        """Cluster di palette delle opzioni di uno slot (palette.cluster_garments), calcolati una volta per versione"""
+        key = (tuple(g['id'] for g in garments), k)
+        clusters = self.palettes.get(key)
+        if clusters is None:
+            clusters = self.palettes[key] = cluster_garments(garments, k)
+        return clusters
+
+    def pair_color_score(self, garment_id_1: int, garment_id_2: int) -> float:
+        """Score colore di una coppia di garment (simmetrico, calcolato una volta sola)"""
+        key = (garment_id_1, garment_id_2) if garment_id_1 < garment_id_2 else (garment_id_2, garment_id_1)
+        score = self.pair_scores.get(key)
+        if score is None:
+            # Dal file mappato se c'è, altrimenti calcolato e salvato nel file
+            if self.snapshot is not None:
+                score = self.snapshot.pair_score(garment_id_1, garment_id_2)
+            if score is None:
+                score = self._compute_pair_score(self.get_garment(garment_id_1), self.get_garment(garment_id_2))
+                if self.snapshot is not None:
+                    self.snapshot.store(garment_id_1, garment_id_2, score)
+            if len(self.pair_scores) >= MAX_PAIR_SCORES:
+                self.pair_scores.clear()
+            self.pair_scores[key] = score
+        return score
+
+    def garment_traits(self, garment_id: int) -> GarmentTraits:
+        traits = self.traits.get(garment_id)
+        if traits is None:
+            garment = self.get_garment(garment_id)
+            traits = GarmentTraits(
+                OutfitGenerator.is_neutral_color(garment),
+                OutfitGenerator.get_pattern_weight(garment['pattern']),
+                garment['formality'],
+            )
+            self.traits[garment_id] = traits
+        return traits
+
+    def outfit_components(self, outfit) -> tuple:
+        """(pattern, formality, neutral_penalty, color_bonus, simplicity_bonus) dell'outfit"""
+        traits = self.garment_traits
+        shoes, bottom, visible_top = traits(outfit.shoes), traits(outfit.bottom), traits(outfit.base_top)
+        layers = [shoes, bottom, visible_top]
+        if outfit.mid_top:
+            visible_top = traits(outfit.mid_top)
+            layers.append(visible_top)
+        if outfit.outerwear:
+            visible_top = traits(outfit.outerwear)
+            layers.append(visible_top)
+
+        # Pattern: solo i tre capi visibili (l'ordine non conta, le chiavi restano poche)
+        key = (shoes.pattern_weight, bottom.pattern_weight, visible_top.pattern_weight)
+        pattern_score = self.pattern_scores.get(key)
+        if pattern_score is None:
+            pattern_score = self.pattern_scores[key] = OutfitGenerator.pattern_coherence_for(key)
+
+        formalities = [t.formality for t in layers]
+        gap = max(formalities) - min(formalities)
+        formality_score = self.formality_scores.get(gap)
+        if formality_score is None:
+            formality_score = self.formality_scores[gap] = OutfitGenerator.formality_alignment_for(gap)
+
+        layer_count = len(layers)
+        neutral_count = sum(t.neutral for t in layers)
+        key = (neutral_count, layer_count)
+        neutral_scores = self.neutral_scores.get(key)
+        if neutral_scores is None:
+            neutral_scores = self.neutral_scores[key] = (
+                OutfitGenerator.neutral_penalty_for(neutral_count, layer_count),
+                OutfitGenerator.color_diversity_bonus_for(layer_count - neutral_count),
+            )
+
+        simplicity_bonus = self.simplicity_scores.get(layer_count)
+        if simplicity_bonus is None:
+            simplicity_bonus = self.simplicity_scores[layer_count] = OutfitGenerator.simplicity_bonus_for(layer_count)
+
+        return pattern_score, formality_score, neutral_scores[0], neutral_scores[1], simplicity_bonus
+
+    def approx_size_bytes(self) -> int:
+        return (len(self.garments) + len(self.traits)) * GARMENT_CACHE_ENTRY_BYTES + len(self.pair_scores) * PAIR_SCORE_CACHE_ENTRY_BYTES
+
 class OutfitGenerator:
-    weights = {
-        'formality_threshold': 4,
-        'neutral_saturation_threshold': 20,
-        'color_weight': 0.55,
-        'pattern_weight': 0.3,
-        'formality_weight': 0.15,
-    }
-
-    @classmethod
-    def load_weights(cls, weights_dict: dict):
+    """
+    Generatore di outfit di un singolo guardaroba.
+    Pesi, penalità e cache sono per istanza: guardaroba diversi non condividono stato.
+    """
+    def __init__(self, db: DB_Manager = None):
+        self.weights = dict(DEFAULT_WEIGHTS)
+        # Penalità di coppia in memoria {(id1, id2): penalty} con id1 < id2
+        self.pair_penalties = {}
+        self.cache = WardrobeCache(db) if db is not None else None
+        # Vincoli hard sempre attivi; le coppie "mai insieme" arrivano dalla cache
+        self.rules = [FormalityGap()]
+
+    def load_weights(self, weights_dict: dict):
         """Carica i pesi dal database"""
-        cls.weights.update(weights_dict)
+        self.weights.update(weights_dict)
+
+    def load_pair_penalties(self, penalties: dict):
+        """Carica le penalità di coppia (già decadute) dal database"""
+        self.pair_penalties = penalties
+
+    def _garment_cache(self, db) -> WardrobeCache:
+        """Cache dei garment legata al database passato"""
+        if self.cache is None or self.cache.db is not db:
+            self.cache = WardrobeCache(db)
+        return self.cache
+
+    def constraints(self, db, rules=()) -> ConstraintSet:
+        """Vincoli hard del guardaroba più le regole di contesto `rules` (es. stagione)"""
+        rules = list(self.rules) + list(rules)
+        never_together = self._garment_cache(db).never_together
+        if never_together:
+            rules.append(NeverTogether(never_together))
+        return ConstraintSet(rules)
+
+    def approx_size_bytes(self) -> int:
+        size = len(self.pair_penalties) * PAIR_SCORE_CACHE_ENTRY_BYTES
+        if self.cache is not None:
+            size += self.cache.approx_size_bytes()
+        return size
     
     @staticmethod
     def extract_lab(garment) -> tuple:
@@ -119,8 +404,11 @@ class OutfitGenerator:
             garments.append(db.get_garment(outfit.outerwear))
 
         neutral_count = sum(1 for g in garments if OutfitGenerator.is_neutral_color(g))
-        total_count = len(garments)
+        return OutfitGenerator.neutral_penalty_for(neutral_count, len(garments))
 
+    @staticmethod
+    def neutral_penalty_for(neutral_count: int, total_count: int) -> float:
+        """Penalità neutrali dato il numero di capi neutrali sul totale"""
         neutral_ratio = neutral_count / total_count
 
         # Penalità progressiva
@@ -147,7 +435,11 @@ class OutfitGenerator:
             garments.append(db.get_garment(outfit.outerwear))
         
         colored_count = sum(1 for g in garments if not OutfitGenerator.is_neutral_color(g))
+        return OutfitGenerator.color_diversity_bonus_for(colored_count)
 
+    @staticmethod
+    def color_diversity_bonus_for(colored_count: int) -> float:
+        """Bonus diversità dato il numero di capi colorati"""
         # Bonus progressivo
         if colored_count >= 3:
             return 0.10
@@ -206,7 +498,11 @@ class OutfitGenerator:
         
         # Ottieni pesi pattern
         pattern_weights = [OutfitGenerator.get_pattern_weight(g['pattern']) for g in visible_garments]
+        return OutfitGenerator.pattern_coherence_for(pattern_weights)
 
+    @staticmethod
+    def pattern_coherence_for(pattern_weights) -> float:
+        """Coerenza pattern dai pesi dei capi visibili (shoes, bottom, top visibile)"""
         # Conta pattern per tipo
         plain_count = pattern_weights.count(0)
         moderate_count = pattern_weights.count(1)
@@ -254,8 +550,11 @@ class OutfitGenerator:
         # Calcola gap
         min_form = min(formalities)
         max_form = max(formalities)
-        gap = max_form - min_form
+        return OutfitGenerator.formality_alignment_for(max_form - min_form)
 
+    @staticmethod
+    def formality_alignment_for(gap: int) -> float:
+        """Allineamento formality dato il gap tra il capo più e meno formale"""
         # Score basato sul gap
         if gap <= FORMALITY_THRESHOLD-3:
             return 1.0
@@ -278,7 +577,11 @@ class OutfitGenerator:
             layer_count += 1
         if outfit.outerwear:
             layer_count += 1
-        
+        return OutfitGenerator.simplicity_bonus_for(layer_count)
+
+    @staticmethod
+    def simplicity_bonus_for(layer_count: int) -> float:
+        """Bonus semplicità dato il numero di layer"""
         # Bonus decrescente (più layer = meno bonus)
         if layer_count == 3:
             return 0.03 # outfit minimale
@@ -289,10 +592,11 @@ class OutfitGenerator:
         else:
             return 0.0
         
-    @staticmethod
-    def calculate_pair_penalties(outfit, db) -> float:
+    def calculate_pair_penalties(self, outfit, db) -> float:
         """Calcola la somma delle penalità per tutte le coppie nell'outfit"""
-        weights_mgr = WeightsManager(db)
+        penalties = self.pair_penalties
+        if not penalties:
+            return 0.0
 
         # Raccogli tutti i garment_id
         garment_ids = [outfit.shoes, outfit.bottom, outfit.base_top]
@@ -304,8 +608,8 @@ class OutfitGenerator:
         # Calcola penalità totale
         total_penalty = 0.0
         for id1, id2 in combinations(garment_ids, 2):
-            penalty = weights_mgr.get_pair_penalty(id1, id2)
-            total_penalty += penalty
+            pair = (id1, id2) if id1 < id2 else (id2, id1)
+            total_penalty += penalties.get(pair, 0.0)
         
         return total_penalty
     
@@ -314,126 +618,55 @@ class OutfitGenerator:
         """Calcola penalità per capi indossati di recente"""
         pass
     
-    @staticmethod
-    def score_calculator(outfit, db) -> float:
-        color_weight = OutfitGenerator.weights['color_weight']
-        pattern_weight = OutfitGenerator.weights['pattern_weight']
-        formality_weight = OutfitGenerator.weights['formality_weight']
+    def score_calculator(self, outfit, db) -> float:
+        return self.score_components(outfit, db).total(self.weights)
+
+    def score_components(self, outfit, db) -> ScoreComponents:
+        """Calcola le componenti dello score (combinate con i pesi da ScoreComponents.total)"""
+        # Garment e score colore di coppia dalla cache: niente query per outfit
+        cache = self._garment_cache(db)
+        pair_score = cache.pair_color_score
         # Caso 1: shoes + bottom + base_top
         if outfit.mid_top is None and outfit.outerwear is None:
-            shoes = db.get_garment(outfit.shoes)
-            bottom = db.get_garment(outfit.bottom)
-            base_top = db.get_garment(outfit.base_top)
-            lab_shoes = OutfitGenerator.extract_lab(shoes)
-            lab_bottom = OutfitGenerator.extract_lab(bottom)
-            lab_base_top = OutfitGenerator.extract_lab(base_top)
-            is_shoes_neutral = OutfitGenerator.is_neutral_color(shoes)
-            is_bottom_neutral = OutfitGenerator.is_neutral_color(bottom)
-            is_base_top_neutral = OutfitGenerator.is_neutral_color(base_top)
-
-            distance_base_top_to_bottom = OutfitGenerator.calculate_lab_distance(lab_bottom, lab_base_top)
-            score_base_top_to_bottom = OutfitGenerator.score_color_pair(distance_base_top_to_bottom, is_base_top_neutral, is_bottom_neutral)
-            distance_base_top_to_shoes = OutfitGenerator.calculate_lab_distance(lab_base_top, lab_shoes)
-            score_base_top_to_shoes = OutfitGenerator.score_color_pair(distance_base_top_to_shoes, is_base_top_neutral, is_shoes_neutral)
+            score_base_top_to_bottom = pair_score(outfit.base_top, outfit.bottom)
+            score_base_top_to_shoes = pair_score(outfit.base_top, outfit.shoes)
 
             color_score = (score_base_top_to_bottom*BASE_TOP_TO_BOTTOM_MULTIPLIER + score_base_top_to_shoes*BASE_TOP_TO_SHOES_MULTIPLIER)/(BASE_TOP_TO_BOTTOM_MULTIPLIER+BASE_TOP_TO_SHOES_MULTIPLIER)
         # Caso 2: shoes + bottom + base_top + mid_top
         elif outfit.outerwear is None:
-            shoes = db.get_garment(outfit.shoes)
-            bottom = db.get_garment(outfit.bottom)
-            base_top = db.get_garment(outfit.base_top)
-            mid_top = db.get_garment(outfit.mid_top)
-            lab_shoes = OutfitGenerator.extract_lab(shoes)
-            lab_bottom = OutfitGenerator.extract_lab(bottom)
-            lab_base_top = OutfitGenerator.extract_lab(base_top)
-            lab_mid_top = OutfitGenerator.extract_lab(mid_top)
-            is_shoes_neutral = OutfitGenerator.is_neutral_color(shoes)
-            is_bottom_neutral = OutfitGenerator.is_neutral_color(bottom)
-            is_base_top_neutral = OutfitGenerator.is_neutral_color(base_top)
-            is_mid_top_neutral = OutfitGenerator.is_neutral_color(mid_top)
-
-            distance_mid_top_to_bottom = OutfitGenerator.calculate_lab_distance(lab_mid_top, lab_bottom)
-            score_mid_top_to_bottom = OutfitGenerator.score_color_pair(distance_mid_top_to_bottom, is_mid_top_neutral, is_bottom_neutral)
-            distance_mid_top_to_shoes = OutfitGenerator.calculate_lab_distance(lab_mid_top, lab_shoes)
-            score_mid_top_to_shoes = OutfitGenerator.score_color_pair(distance_mid_top_to_shoes, is_mid_top_neutral, is_shoes_neutral)
-            distance_mid_top_to_base_top = OutfitGenerator.calculate_lab_distance(lab_mid_top, lab_base_top)
-            score_mid_top_to_base_top = OutfitGenerator.score_color_pair(distance_mid_top_to_base_top, is_mid_top_neutral, is_base_top_neutral)
+            score_mid_top_to_bottom = pair_score(outfit.mid_top, outfit.bottom)
+            score_mid_top_to_shoes = pair_score(outfit.mid_top, outfit.shoes)
+            score_mid_top_to_base_top = pair_score(outfit.mid_top, outfit.base_top)
             
             color_score = (score_mid_top_to_bottom*MID_TOP_TO_BOTTOM_MULTIPLIER + score_mid_top_to_shoes*MID_TOP_TO_SHOES_MULTIPLIER + score_mid_top_to_base_top*MID_TOP_TO_BASE_TOP_MULTIPLIER)/(MID_TOP_TO_BOTTOM_MULTIPLIER + MID_TOP_TO_SHOES_MULTIPLIER + MID_TOP_TO_BASE_TOP_MULTIPLIER)
         # Caso 3: shoes + bottom + base_top + outerwear
         elif outfit.mid_top is None:
-            shoes = db.get_garment(outfit.shoes)
-            bottom = db.get_garment(outfit.bottom)
-            base_top = db.get_garment(outfit.base_top)
-            outerwear = db.get_garment(outfit.outerwear)
-            lab_shoes = OutfitGenerator.extract_lab(shoes)
-            lab_bottom = OutfitGenerator.extract_lab(bottom)
-            lab_base_top = OutfitGenerator.extract_lab(base_top)
-            lab_outerwear = OutfitGenerator.extract_lab(outerwear)
-            is_shoes_neutral = OutfitGenerator.is_neutral_color(shoes)
-            is_bottom_neutral = OutfitGenerator.is_neutral_color(bottom)
-            is_base_top_neutral = OutfitGenerator.is_neutral_color(base_top)
-            is_outerwear_neutral = OutfitGenerator.is_neutral_color(outerwear)
-
-            distance_base_to_bottom = OutfitGenerator.calculate_lab_distance(lab_base_top, lab_bottom)
-            score_base_top_to_bottom = OutfitGenerator.score_color_pair(distance_base_to_bottom, is_base_top_neutral, is_bottom_neutral)
-            distance_base_to_shoes = OutfitGenerator.calculate_lab_distance(lab_base_top, lab_shoes)
-            score_base_top_to_shoes = OutfitGenerator.score_color_pair(distance_base_to_shoes, is_base_top_neutral, is_shoes_neutral)
-            distance_outerwear_to_bottom = OutfitGenerator.calculate_lab_distance(lab_outerwear, lab_bottom)
-            score_outerwear_to_bottom = OutfitGenerator.score_color_pair(distance_outerwear_to_bottom, is_outerwear_neutral, is_bottom_neutral)
-            distance_outerwear_to_shoes = OutfitGenerator.calculate_lab_distance(lab_outerwear, lab_shoes)
-            score_outerwear_to_shoes = OutfitGenerator.score_color_pair(distance_outerwear_to_shoes, is_outerwear_neutral, is_shoes_neutral)
-            distance_outerwear_to_base_top = OutfitGenerator.calculate_lab_distance(lab_outerwear, lab_base_top)
-            score_outerwear_to_base_top = OutfitGenerator.score_color_pair(distance_outerwear_to_base_top, is_outerwear_neutral, is_base_top_neutral)
+            score_base_top_to_bottom = pair_score(outfit.base_top, outfit.bottom)
+            score_base_top_to_shoes = pair_score(outfit.base_top, outfit.shoes)
+            score_outerwear_to_bottom = pair_score(outfit.outerwear, outfit.bottom)
+            score_outerwear_to_shoes = pair_score(outfit.outerwear, outfit.shoes)
+            score_outerwear_to_base_top = pair_score(outfit.outerwear, outfit.base_top)
             
             color_score = (score_base_top_to_bottom*BASE_TOP_TO_BOTTOM_MULTIPLIER + score_base_top_to_shoes*BASE_TOP_TO_SHOES_MULTIPLIER + score_outerwear_to_bottom*OUTERWEAR_TO_BOTTOM_MULTIPLIER + score_outerwear_to_shoes*OUTERWEAR_TO_SHOES_MULTIPLIER + score_outerwear_to_base_top*OUTERWEAR_TO_BASE_TOP_MULTIPLIER)/(BASE_TOP_TO_BOTTOM_MULTIPLIER + BASE_TOP_TO_SHOES_MULTIPLIER + OUTERWEAR_TO_BOTTOM_MULTIPLIER + OUTERWEAR_TO_SHOES_MULTIPLIER + OUTERWEAR_TO_BASE_TOP_MULTIPLIER)
         # Caso 4: shoes + bottom + base_top + mid_top + outerwear
         else:
-            shoes = db.get_garment(outfit.shoes)
-            bottom = db.get_garment(outfit.bottom)
-            base_top = db.get_garment(outfit.base_top)
-            mid_top = db.get_garment(outfit.mid_top)
-            outerwear = db.get_garment(outfit.outerwear)
-            lab_shoes = OutfitGenerator.extract_lab(shoes)
-            lab_bottom = OutfitGenerator.extract_lab(bottom)
-            lab_base_top = OutfitGenerator.extract_lab(base_top)
-            lab_mid_top = OutfitGenerator.extract_lab(mid_top)
-            lab_outerwear = OutfitGenerator.extract_lab(outerwear)
-            is_shoes_neutral = OutfitGenerator.is_neutral_color(shoes)
-            is_bottom_neutral = OutfitGenerator.is_neutral_color(bottom)
-            is_base_top_neutral = OutfitGenerator.is_neutral_color(base_top)
-            is_mid_top_neutral = OutfitGenerator.is_neutral_color(mid_top)
-            is_outerwear_neutral = OutfitGenerator.is_neutral_color(outerwear)
-
-            distance_mid_top_to_bottom = OutfitGenerator.calculate_lab_distance(lab_mid_top, lab_bottom)
-            score_mid_top_to_bottom = OutfitGenerator.score_color_pair(distance_mid_top_to_bottom, is_mid_top_neutral, is_bottom_neutral)
-            distance_mid_top_to_shoes = OutfitGenerator.calculate_lab_distance(lab_mid_top, lab_shoes)
-            score_mid_top_to_shoes = OutfitGenerator.score_color_pair(distance_mid_top_to_shoes, is_mid_top_neutral, is_shoes_neutral)
-            distance_mid_top_to_base_top = OutfitGenerator.calculate_lab_distance(lab_mid_top, lab_base_top)
-            score_mid_top_to_base_top = OutfitGenerator.score_color_pair(distance_mid_top_to_base_top, is_mid_top_neutral, is_base_top_neutral)
-            distance_outerwear_to_bottom = OutfitGenerator.calculate_lab_distance(lab_outerwear, lab_bottom)
-            score_outerwear_to_bottom = OutfitGenerator.score_color_pair(distance_outerwear_to_bottom, is_outerwear_neutral, is_bottom_neutral)
-            distance_outerwear_to_shoes = OutfitGenerator.calculate_lab_distance(lab_outerwear, lab_shoes)
-            score_outerwear_to_shoes = OutfitGenerator.score_color_pair(distance_outerwear_to_shoes, is_outerwear_neutral, is_shoes_neutral)
-            distance_outerwear_to_mid_top = OutfitGenerator.calculate_lab_distance(lab_outerwear, lab_mid_top)
-            score_outerwear_to_mid_top = OutfitGenerator.score_color_pair(distance_outerwear_to_mid_top, is_outerwear_neutral, is_mid_top_neutral)
+            score_mid_top_to_bottom = pair_score(outfit.mid_top, outfit.bottom)
+            score_mid_top_to_shoes = pair_score(outfit.mid_top, outfit.shoes)
+            score_mid_top_to_base_top = pair_score(outfit.mid_top, outfit.base_top)
+            score_outerwear_to_bottom = pair_score(outfit.outerwear, outfit.bottom)
+            score_outerwear_to_shoes = pair_score(outfit.outerwear, outfit.shoes)
+            score_outerwear_to_mid_top = pair_score(outfit.outerwear, outfit.mid_top)
             
             color_score = (score_mid_top_to_bottom*MID_TOP_TO_BOTTOM_MULTIPLIER + score_mid_top_to_shoes*MID_TOP_TO_SHOES_MULTIPLIER + score_mid_top_to_base_top*MID_TOP_TO_BASE_TOP_MULTIPLIER + score_outerwear_to_bottom*OUTERWEAR_TO_BOTTOM_MULTIPLIER_CASE4 + score_outerwear_to_shoes*OUTERWEAR_TO_SHOES_MULTIPLIER + score_outerwear_to_mid_top*OUTERWEAR_TO_MID_TOP_MULTIPLIER)/(MID_TOP_TO_BOTTOM_MULTIPLIER + MID_TOP_TO_SHOES_MULTIPLIER + MID_TOP_TO_BASE_TOP_MULTIPLIER + OUTERWEAR_TO_BOTTOM_MULTIPLIER_CASE4 + OUTERWEAR_TO_SHOES_MULTIPLIER + OUTERWEAR_TO_MID_TOP_MULTIPLIER)
         
-        pattern_score = OutfitGenerator.calculate_pattern_coherence(outfit, db)
-        formality_score = OutfitGenerator.calculate_formality_alignment(outfit, db)
-        total_score = color_score*color_weight + pattern_score*pattern_weight + formality_score*formality_weight
+        # Componenti non cromatiche memorizzate per chiave minima
+        pattern_score, formality_score, neutral_penalty, color_bonus, simplicity_bonus = cache.outfit_components(outfit)
         
-        neutral_penalty = OutfitGenerator.calculate_neutral_penalty(outfit, db)
-        color_bonus = OutfitGenerator.calculate_color_diversity_bonus(outfit, db)
-        simplicity_bonus = OutfitGenerator.calculate_simplicity_bonus(outfit)
-        
-        pair_penalties = OutfitGenerator.calculate_pair_penalties(outfit, db)
+        pair_penalties = self.calculate_pair_penalties(outfit, cache)
 
-        return max(0.0, total_score+neutral_penalty+color_bonus+simplicity_bonus+ pair_penalties)
+        return ScoreComponents(color_score, pattern_score, formality_score, neutral_penalty, color_bonus, simplicity_bonus, pair_penalties)
     
-    @staticmethod
-    def debug_score_breakdown(outfit, db):
+    def debug_score_breakdown(self, outfit, db):
         """Mostra i dettagli dello scoring"""
 
         print("--- Garment Details ---")
@@ -521,7 +754,7 @@ class OutfitGenerator:
         neutral_penalty = OutfitGenerator.calculate_neutral_penalty(outfit, db)
         color_bonus = OutfitGenerator.calculate_color_diversity_bonus(outfit, db)
         simplicity_bonus = OutfitGenerator.calculate_simplicity_bonus(outfit)
-        pair_penalties = OutfitGenerator.calculate_pair_penalties(outfit, db)
+        pair_penalties = self.calculate_pair_penalties(outfit, db)
 
         print(f"Pattern coherence: {pattern_score:.3f}")
         print(f"Formality alignment: {formality_score:.3f}")
@@ -563,63 +796,280 @@ class OutfitGenerator:
         print(f"\n--- Final Score: {outfit.score:.3f} ---")
 
     @staticmethod
-    def generate(shoes_list, bottoms_list, base_tops_list, mid_tops_list, outerwear_list, db, count: int = 1, top_pool: int = 150) -> list[Outfit]:
-        # Logica generazionale
+    def _unpack_into(outfit: Outfit, packed: int, slot_ids: list, radices: list):
+        """Decodifica un candidato impacchettato nei campi di un Outfit esistente"""
+        packed, i_outer = divmod(packed, radices[4])
+        packed, i_mid = divmod(packed, radices[3])
+        packed, i_base = divmod(packed, radices[2])
+        i_shoes, i_bottom = divmod(packed, radices[1])
+        outfit.shoes = slot_ids[0][i_shoes]
+        outfit.bottom = slot_ids[1][i_bottom]
+        outfit.base_top = slot_ids[2][i_base]
+        outfit.mid_top = slot_ids[3][i_mid]
+        outfit.outerwear = slot_ids[4][i_outer]
+
+    @staticmethod
+    def _unpack(packed: int, slot_ids: list, radices: list) -> Outfit:
+        outfit = Outfit(0, 0, 0)
+        OutfitGenerator._unpack_into(outfit, packed, slot_ids, radices)
+        return outfit
+
+    @staticmethod
+    def _disliked_candidates(disliked: set, slot_ids: list, radices: list) -> set:
+        """Candidati impacchettati corrispondenti alle firme con dislike presenti nelle liste"""
+        positions = [{garment_id: i for i, garment_id in enumerate(ids)} for ids in slot_ids]
+        packed_set = set()
+        for signature in disliked:
+            packed = 0
+            for garment_id, index, radix in zip(signature, positions, radices):
+                i = index.get(garment_id)
+                if i is None:
+                    break
+                packed = packed * radix + i
+            else:
+                packed_set.add(packed)
+        return packed_set
+
+    def swap(self, outfit: Outfit, slot: str, candidates: list, db) -> Optional[Outfit]:
+        """
+        Sostituisce un solo capo dell'outfit con il candidato dal punteggio migliore
+
+        Args:
+            slot: campo di Outfit da sostituire (shoes, bottom, base_top, mid_top, outerwear)
+            candidates: garment ammessi nello slot; per mid_top/outerwear si valuta anche lo slot vuoto
+        """
+        cache = self._garment_cache(db)
+        cache.refresh()
+        fixed = [cache.get_garment(getattr(outfit, s)) for s in OUTFIT_SLOTS if s != slot and getattr(outfit, s)]
+        constraints = self.constraints(db)
+        current = getattr(outfit, slot)
+        options = list(candidates) + ([None] if slot in ('mid_top', 'outerwear') else [])
+        disliked = db.get_disliked_signatures()
+
+        best = None
+        for garment in options:
+            garment_id = garment['id'] if garment else None
+            if garment_id == current or not constraints.allows(fixed + [garment]):
+                continue
+            candidate = replace(outfit, **{slot: garment_id}, score=None)
+            if candidate.signature() in disliked:
+                continue
+            candidate.score = self.score_calculator(candidate, db)
+            if best is None or candidate.score > best.score:
+                best = candidate
+        return best
+
+    def _search(self, slots: list, db, constraints: ConstraintSet, disliked_signatures: set, scorer, stats: 'GenerationStats', persist: bool = False) -> tuple:
+        """
+        Enumera e valuta le combinazioni delle opzioni per slot; i contatori e i
+        tempi si sommano in stats. Ritorna (candidati impacchettati, score, id per slot, radici).
+        Con persist gli score calcolati vengono salvati nella cache persistente.
+        """
+        # 1-2. Enumerazione con vincoli hard in un solo passaggio: le regole, compilate
+        #      in maschere per slot e per coppia, escludono le opzioni prima di visitarle.
+        #      I candidati validi sono interi impacchettati, non oggetti.
+        #      La fascia di warmth pota già sui prefissi: al freddo si visitano solo
+        #      le combinazioni mid/outer che possono raggiungerla
+        start = time.perf_counter()
+        candidates = constraints.compile(slots).candidates()
+        enumerated = math.prod(len(options) for options in slots)
+        stats.candidates_enumerated += enumerated
+        stats.candidates_pruned += enumerated - len(candidates)
+        stats.enumeration_s += time.perf_counter() - start
+
+        # 2b. Esclusione degli outfit il cui ultimo feedback è un dislike: le firme
+        #     vengono tradotte in candidati impacchettati, poi un solo passaggio di filtro
+        start = time.perf_counter()
+        slot_ids = [[g['id'] if g else None for g in options] for options in slots]
+        radices = [len(options) for options in slots]
+        disliked = OutfitGenerator._disliked_candidates(disliked_signatures, slot_ids, radices)
+        if disliked:
+            valid = len(candidates)
+            candidates = array('q', (packed for packed in candidates if packed not in disliked))
+            stats.candidates_disliked += valid - len(candidates)
+        stats.filtering_s += time.perf_counter() - start
+
+        # 3. Scoring: un Outfit di appoggio riutilizzato, score in un array di double
+        start = time.perf_counter()
+        scores = array('d')
+        if scorer is None:
+            scores = self._score_cached(candidates, slot_ids, radices, db, stats, persist)
+        else:
+            # Scoring in blocco con lo scorer alternativo, un chunk di Outfit alla volta
+            garments = [g for options in slots for g in options if g is not None]
+            for chunk_start in range(0, len(candidates), SCORER_CHUNK_SIZE):
+                chunk = [
+                    OutfitGenerator._unpack(packed, slot_ids, radices)
+                    for packed in candidates[chunk_start:chunk_start + SCORER_CHUNK_SIZE]
+                ]
+                scores.extend(float(score) for score in scorer.score_batch(chunk, garments))
+            stats.candidates_scored += len(candidates)
+        stats.scoring_s += time.perf_counter() - start
+        return candidates, scores, slot_ids, radices
+
+    def _score_cached(self, candidates: array, slot_ids: list, radices: list, db, stats: 'GenerationStats', persist: bool) -> array:
+        """
+        Score dei candidati con score_calculator, riletti dalla cache persistente
+        quando possibile: in blocco se nulla è cambiato, altrimenti candidato per
+        candidato (con pesi diversi lo score si ricalcola dalle componenti salvate).
+        """
+        cache = self._garment_cache(db)
+        saved = cache.scores
+        same_weights = saved is not None and saved.weights_version == cache.weights_version
+        if same_weights and saved.same_candidates(slot_ids, candidates):
+            stats.candidates_cached += len(candidates)
+            return array('d', saved.scores)
+
+        persist = persist and cache.scores_path is not None and len(candidates) <= SCORE_CACHE_MAX_ENTRIES
+        found = saved.find(slot_ids, candidates) if saved is not None else None
+        scores = array('d')
+        components = array('d')
+        scratch = Outfit(0, 0, 0)
+        score_components = self.score_components
+        weights = self.weights
+        width = SCORE_CACHE_COMPONENTS
+        cached = 0
+        for index, packed in enumerate(candidates):
+            position = found[index] if found is not None else -1
+            if position >= 0 and same_weights:
+                scores.append(saved.scores[position])
+                if persist:
+                    components.extend(saved.components[width * position:width * (position + 1)])
+                cached += 1
+                continue
+            OutfitGenerator._unpack_into(scratch, packed, slot_ids, radices)
+            if position >= 0:
+                parts = saved.components[width * position:width * (position + 1)]
+                score = ScoreComponents(*parts, self.calculate_pair_penalties(scratch, db)).total(weights)
+                cached += 1
+            else:
+                parts = score_components(scratch, db)
+                score = parts.total(weights)
+            scores.append(score)
+            if persist:
+                components.extend(parts[:width])
+        stats.candidates_cached += cached
+        stats.candidates_scored += len(candidates) - cached
+
+        # Nuovi candidati o nuovi pesi: la cache su file viene aggiornata
+        if persist and (cached < len(candidates) or not same_weights):
+            cache.save_scores(slot_ids, candidates, components, scores)
+        return scores
+
+    def _search_palette(self, slots: list, db, constraints: ConstraintSet, disliked_signatures: set, scorer, stats: 'GenerationStats', clusters: int, expand: int, top_pool: int) -> list[Outfit]:
+        """
+        Ricerca a due livelli sui cluster di palette (vedi palette.py): prima le
+        combinazioni dei rappresentanti, poi i garment dei cluster delle `expand`
+        combinazioni migliori (e delle successive, finché non si hanno almeno
+        top_pool outfit validi). Ritorna i migliori top_pool di ogni espansione.
+        """
+        cache = self._garment_cache(db)
+        groups = []
+        for options in slots:
+            garments = [g for g in options if g is not None]
+            # Lo slot vuoto resta un cluster a sé
+            groups.append(([[None]] if len(garments) < len(options) else []) + cache.palette(garments, clusters))
+        representatives = [[group[0] for group in slot_groups] for slot_groups in groups]
+        candidates, scores, _, radices = self._search(representatives, db, constraints, disliked_signatures, scorer, stats)
+
+        outfits = []
+        for rank, index in enumerate(sorted(range(len(scores)), key=scores.__getitem__, reverse=True)):
+            if rank >= expand and len(outfits) >= top_pool:
+                break
+            members, packed = [], candidates[index]
+            for slot_groups, radix in zip(reversed(groups), reversed(radices)):
+                packed, i = divmod(packed, radix)
+                members.append(slot_groups[i])
+            members.reverse()
+            expanded, expanded_scores, slot_ids, expanded_radices = self._search(members, db, constraints, disliked_signatures, scorer, stats)
+            for i in heapq.nlargest(top_pool, range(len(expanded_scores)), key=expanded_scores.__getitem__):
+                outfit = OutfitGenerator._unpack(expanded[i], slot_ids, expanded_radices)
+                outfit.score = expanded_scores[i]
+                outfits.append(outfit)
+        return outfits
+
+    def generate(self, shoes_list, bottoms_list, base_tops_list, mid_tops_list, outerwear_list, db, count: int = 1, top_pool: int = 150, scorer=None, stats: 'GenerationStats' = None, verbose: bool = False, seed: int = None, rules=(), temperature: float = None, clusters: int = None, expand: int = PALETTE_EXPAND) -> list[Outfit]:
+        """
+        Genera gli outfit migliori dal guardaroba
+
+        Args:
+            scorer: scorer alternativo con score_batch(outfits, garments), es. LearnedScorer;
+                    se None si usa score_calculator
+            stats: GenerationStats da compilare con tempi e contatori per fase
+            verbose: stampa statistiche e top 10 (modalità profile)
+            seed: seme della scelta casuale nel top_pool; a parità di guardaroba,
+                  pesi e seed il risultato è sempre lo stesso (None = non deterministico)
+            rules: regole hard aggiuntive (constraints.Rule), es. SeasonMatch('winter')
+            temperature: temperatura in °C; la warmth complessiva dell'outfit deve
+                         cadere nella fascia corrispondente (constraints.warmth_band),
+                         spostata verso la warmth raggiungibile se il guardaroba non ci arriva
+            clusters: cluster di palette per slot; se indicato la ricerca non è
+                      esaustiva ma espande solo le `expand` combinazioni di cluster
+                      migliori (più cluster ed expand = più vicino all'esaustiva)
+        """
+        if stats is None:
+            stats = GenerationStats()
+        queries_before = db.pool.statement_count
+        # Una sola verifica di versione per chiamata: la cache resta valida per tutto lo scoring
+        self._garment_cache(db).refresh()
+
+        if temperature is not None:
+            rules = list(rules) + [TemperatureWarmth(temperature)]
+        constraints = self.constraints(db, rules)
+        disliked_signatures = db.get_disliked_signatures()
         mid_options = [None] + mid_tops_list
         outer_options = [None] + outerwear_list
+        slots = [shoes_list, bottoms_list, base_tops_list, mid_options, outer_options]
+        if clusters is None:
+            candidates, scores, slot_ids, radices = self._search(slots, db, constraints, disliked_signatures, scorer, stats, persist=True)
+            found = len(candidates)
+
+            def materialize(index: int) -> Outfit:
+                outfit = OutfitGenerator._unpack(candidates[index], slot_ids, radices)
+                outfit.score = scores[index]
+                return outfit
+        else:
+            outfits = self._search_palette(slots, db, constraints, disliked_signatures, scorer, stats, clusters, expand, top_pool)
+            scores = array('d', (outfit.score for outfit in outfits))
+            found = len(outfits)
+            materialize = outfits.__getitem__
+        stats.db_queries = db.pool.statement_count - queries_before
+
+        if found == 0:
+            band_rules = [rule for rule in constraints.rules if isinstance(rule, TemperatureWarmth)]
+            if band_rules and ConstraintSet(r for r in constraints.rules if r not in band_rules).compile(slots).candidates():
+                # Gli outfit esistono, ma nessuno ha la warmth adatta (tipicamente per i vincoli di coppia)
+                print(f"Nessun outfit con warmth adatta a {band_rules[0].temperature:g} °C")
+            else:
+                print("Wardrobe insufficiente per generare outfit!")
+            return []
+        if found < count:
+            print(f"Trovati solo {found} outfit validi")
+            return [materialize(i) for i in range(found)]  # ritorna tutti
+
+        # 4. Selezione: solo i migliori top_pool diventano Outfit (stesso ordine di un sort stabile)
+        start = time.perf_counter()
+        top_indices = heapq.nlargest(top_pool, range(len(scores)), key=scores.__getitem__)
+        top_candidates = [materialize(i) for i in top_indices]
+        pool_size = min(top_pool, len(top_candidates))
+        # Sceglie random K da questo pool (l'ordine di top_candidates è deterministico)
+        rng = random.Random(seed) if seed is not None else random
+        selected = rng.sample(top_candidates, min(count, pool_size))
+        stats.selection_s = time.perf_counter() - start
 
-        all_combinations = product(
-            shoes_list,
-            bottoms_list,
-            base_tops_list,
-            mid_options,
-            outer_options
-        )
-        
-        valid_outfits = []
-        for shoes, bottom, base, mid, outer in all_combinations:
-            # Validazione formality range
-            formalities = [shoes['formality'], bottom['formality'], base['formality']]
-            if mid is not None: formalities.append(mid['formality'])
-            if outer is not None: formalities.append(outer['formality'])
-            if max(formalities) - min(formalities) > FORMALITY_THRESHOLD:
-                continue # gap troppo grande
-            # Crea outfit candidato
-            outfit = Outfit(
-                shoes=shoes['id'],
-                bottom=bottom['id'],
-                base_top=base['id'],
-                mid_top=mid['id'] if mid else None,
-                outerwear=outer['id'] if outer else None
-            )
-            
-            outfit.score = OutfitGenerator.score_calculator(outfit, db)
+        if verbose:
+            print(stats.report())
 
-            valid_outfits.append(outfit)
-        
-        if len(valid_outfits) == 0:
-            print("Wardrobe insufficiente per generare outfit!")
-            return []
-        if len(valid_outfits) < count:
-            print(f"Trovati solo {len(valid_outfits)} outfit validi")
-            return valid_outfits  # ritorna tutti
-        # Prima del sort
-        print(f"Outfit validi generati: {len(valid_outfits)}")
-
-        # Conta quante volte ogni capo appare
-        from collections import Counter
-        mid_usage = Counter(o.mid_top for o in valid_outfits if o.mid_top)
-        print("Uso mid_tops:", mid_usage)
-        
-        valid_outfits.sort(key=lambda x: x.score, reverse=True)
+            # Conta quante volte ogni capo appare
+            if clusters is None:
+                mid_usage = Counter(slot_ids[3][packed // radices[4] % radices[3]] for packed in candidates)
+            else:
+                mid_usage = Counter(outfit.mid_top for outfit in outfits)
+            del mid_usage[None]
+            print("Uso mid_tops:", mid_usage)
 
-        # Dopo il sort, guarda i top 10
-        print("\nTop 10 outfit per score:")
-        for i, outfit in enumerate(valid_outfits[:10], 1):
-            print(f"{i}. Score: {outfit.score:.3f} - Mid: {outfit.mid_top}")
+            print("\nTop 10 outfit per score:")
+            for i, outfit in enumerate(top_candidates[:10], 1):
+                print(f"{i}. Score: {outfit.score:.3f} - Mid: {outfit.mid_top}")
 
-        top_candidates = valid_outfits[:top_pool]
-        pool_size = min(top_pool, len(top_candidates))
-        # Sceglie random K da questo pool
-        selected = random.sample(top_candidates, min(count, pool_size))
-        return selected
\ No newline at end of file
+        return selected
@@ -0,0 +1,134 @@
+"""
+Cluster di palette per ridurre lo spazio di ricerca di generate().
+
+I garment di ogni slot vengono raggruppati con k-means in Lab (più la
+formality scalata, come in garment_index): capi quasi identici nel colore
+finiscono nello stesso cluster, rappresentato dal suo medoide. generate(clusters=k)
+cerca prima tra le combinazioni di rappresentanti, poi espande nei garment
+concreti solo le `expand` combinazioni migliori. k ed expand regolano il
+compromesso tra esattezza e velocità; compare() misura lo scarto di score
+rispetto alla ricerca esaustiva.
+
+    python palette.py --size 60 --clusters 4 8 --expand 10 50
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from garment_index import FORMALITY_SCALE
+
+PALETTE_CLUSTERS = 8
+PALETTE_EXPAND = 20
+KMEANS_ITERATIONS = 20
+
+def _features(garment) -> tuple:
+    return (garment['color_lab_l'], garment['color_lab_a'], garment['color_lab_b'], FORMALITY_SCALE * garment['formality'])
+
+def _nearest(point: tuple, centroids: list) -> int:
+    return min(range(len(centroids)), key=lambda c: math.dist(point, centroids[c]))
+
+def cluster_garments(garments: list, k: int) -> list[list]:
+    """
+    k-means deterministico dei garment di uno slot. Ogni cluster è una lista
+    di garment con il medoide (il capo più vicino al centroide) in testa.
+    """
+    garments = list(garments)
+    if len(garments) <= k:
+        return [[g] for g in garments]
+    points = [_features(g) for g in garments]
+
+    # Inizializzazione farthest-point: il capo più vicino alla media, poi ogni
+    # volta quello più lontano dai centroidi già scelti
+    mean = tuple(sum(axis) / len(points) for axis in zip(*points))
+    centroids = [points[_nearest(mean, points)]]
+    while len(centroids) < k:
+        centroids.append(max(points, key=lambda p: min(math.dist(p, c) for c in centroids)))
+
+    assignment = None
+    for _ in range(KMEANS_ITERATIONS):
+        new_assignment = [_nearest(p, centroids) for p in points]
+        if new_assignment == assignment:
+            break
+        assignment = new_assignment
+        for c in range(k):
+            members = [p for p, a in zip(points, assignment) if a == c]
+            if members:
+                centroids[c] = tuple(sum(axis) / len(members) for axis in zip(*members))
+
+    clusters = []
+    for c in range(k):
+        members = [i for i, a in enumerate(assignment) if a == c]
+        if not members:
+            continue
+        medoid = min(members, key=lambda i: math.dist(points[i], centroids[c]))
+        clusters.append([garments[medoid]] + [garments[i] for i in members if i != medoid])
+    return clusters
+
+def compare(wardrobe, clusters: int, expand: int, top_pool: int = 150) -> dict:
+    """Scarto di score e tempi della ricerca per cluster rispetto a quella esaustiva"""
+    from outfit_engine import GenerationStats
+
+    # Confronto tra strategie di ricerca: senza la cache persistente degli score
+    cache = wardrobe.generator._garment_cache(wardrobe.db)
+    scores_path, cache.scores_path, cache.scores = cache.scores_path, None, None
+    results = {}
+    for label, kwargs in (('exhaustive', {}), ('palette', {'clusters': clusters, 'expand': expand})):
+        stats = GenerationStats()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool = wardrobe.generate(count=top_pool, top_pool=top_pool, seed=0, stats=stats, **kwargs)
+        results[label] = {
+            'elapsed_s': time.perf_counter() - start,
+            'candidates_scored': stats.candidates_scored,
+            'scores': sorted((o.score for o in pool), reverse=True),
+        }
+    cache.scores_path = scores_path
+    exhaustive, palette = results['exhaustive'], results['palette']
+    # Scarto medio sui primi n outfit, con n il pool più corto dei due
+    n = min(len(exhaustive['scores']), len(palette['scores']))
+    return {
+        'clusters': clusters,
+        'expand': expand,
+        'exhaustive_elapsed_s': exhaustive['elapsed_s'],
+        'palette_elapsed_s': palette['elapsed_s'],
+        'speedup': exhaustive['elapsed_s'] / palette['elapsed_s'],
+        'exhaustive_candidates_scored': exhaustive['candidates_scored'],
+        'palette_candidates_scored': palette['candidates_scored'],
+        'pool_size': len(palette['scores']),
+        'best_score_gap': exhaustive['scores'][0] - palette['scores'][0] if n else None,
+        'mean_top_score_gap': (sum(exhaustive['scores'][:n]) - sum(palette['scores'][:n])) / n if n else None,
+    }
+
+def main(argv=None) -> int:
+    from benchmark import synthesize_wardrobe
+    from db_manager import DB_Manager
+    from wardrobe import Wardrobe
+
+    parser = argparse.ArgumentParser(description="Scarto di score della ricerca per cluster di palette")
+    parser.add_argument('--size', type=int, default=60, help="capi del guardaroba sintetico")
+    parser.add_argument('--clusters', type=int, nargs='+', default=[PALETTE_CLUSTERS], help="cluster per slot")
+    parser.add_argument('--expand', type=int, nargs='+', default=[PALETTE_EXPAND], help="combinazioni di cluster espanse")
+    parser.add_argument('--top-pool', type=int, default=150)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'palette.db'
+        db = DB_Manager(path)
+        synthesize_wardrobe(db, args.size, random.Random(args.seed))
+        db.close()
+        wardrobe = Wardrobe(path=path)
+        rows = [compare(wardrobe, k, e, args.top_pool) for k in args.clusters for e in args.expand]
+        wardrobe.close()
+    print(json.dumps(rows, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
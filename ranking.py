@@ -0,0 +1,299 @@
+"""
+Top-N degli outfit materializzato nella tabella ranked_outfit.
+
+La tabella contiene i migliori `capacity` outfit con le componenti dello score
+e sopravvive ai riavvii: "dammi un outfit" diventa una lettura indicizzata.
+Le modifiche a garment, penalità e vincoli di coppia, pesi e feedback vengono
+registrate da trigger in ranked_outfit_changes e applicate da sync(), che
+rivaluta solo le combinazioni coinvolte. Il decadimento in blocco delle
+penalità all'avvio resta fuori dal log (vedi decay_pair_penalties). Gli outfit
+con dislike (ultimo feedback negativo) non entrano in tabella.
+
+Invariante: ogni outfit valido fuori dalla tabella ha score <= floor
+(floor NULL = la tabella contiene tutti gli outfit validi). Quando non è
+più possibile garantirla con almeno `min_rows` righe si ricostruisce da zero.
+"""
+import heapq
+import random
+from itertools import combinations, product
+from db_manager import OUTFIT_SLOTS, OUTFIT_COLUMNS_SQL, OUTFIT_MATCH_SQL
+from outfit_engine import Outfit, OutfitGenerator, ScoreComponents
+
+RANKED_CAPACITY = 600
+DEFAULT_TOP_POOL = 150
+# Oltre questo numero di modifiche pendenti conviene ricostruire
+REBUILD_CHANGE_LIMIT = 200
+# Pesi che moltiplicano componenti dello score in [0, 1]
+SCORE_WEIGHT_KEYS = ('color_weight', 'pattern_weight', 'formality_weight')
+# Score di ogni riga ricalcolato dalle componenti salvate (parametri: SCORE_WEIGHT_KEYS)
+RESCORE_SQL = '''
+    UPDATE ranked_outfit SET score = MAX(0.0,
+        color_score*? + pattern_score*? + formality_score*?
+        + neutral_penalty + color_bonus + simplicity_bonus + pair_penalty)
+'''
+
+class RankedOutfits:
+    """
+    Manutenzione incrementale del top-N di un guardaroba
+
+    Args:
+        wardrobe: Wardrobe con db, generator e garment_lists()
+        capacity: righe mantenute in tabella (>= top_pool usato da pick)
+    """
+    def __init__(self, wardrobe, capacity: int = RANKED_CAPACITY):
+        self.db = wardrobe.db
+        self.weights_manager = wardrobe.weights_manager
+        self.generator = wardrobe.generator
+        self.garment_lists = wardrobe.garment_lists
+        self.capacity = capacity
+
+    # --- Enumerazione e scoring ---
+
+    def _scored(self, lists, disliked: set):
+        """Genera gli outfit validi (vincoli hard, senza dislike) delle liste per slot, con componenti e score"""
+        generator = self.generator
+        slot_ids = [[g['id'] if g else None for g in options] for options in lists]
+        radices = [len(options) for options in lists]
+        for packed in generator.constraints(self.db).compile(lists).candidates():
+            outfit = OutfitGenerator._unpack(packed, slot_ids, radices)
+            if disliked and outfit.signature() in disliked:
+                continue
+            components = generator.score_components(outfit, self.db)
+            outfit.score = components.total(generator.weights)
+            yield outfit, components
+
+    def _slot_options(self) -> list[list]:
+        """Garment attivi per slot; mid_top e outerwear ammettono lo slot vuoto"""
+        shoes, bottoms, base_tops, mid_tops, outerwear = self.garment_lists()
+        return [shoes, bottoms, base_tops, [None] + mid_tops, [None] + outerwear]
+
+    @staticmethod
+    def _signature_lists(options: list[list], signature: tuple):
+        """Liste per slot ridotte all'outfit della firma; None se un capo non è più attivo nel suo slot"""
+        lists = []
+        for slot_options, garment_id in zip(options, signature):
+            match = [g for g in slot_options if (g['id'] if g else None) == garment_id]
+            if not match:
+                return None
+            lists.append(match)
+        return lists
+
+    def _scored_containing(self, options: list[list], garment_ids: tuple, disliked: set) -> list[tuple]:
+        """Outfit validi che contengono tutti i garment indicati (in slot diversi)"""
+        positions = [
+            [(slot, g) for slot, slot_options in enumerate(options) for g in slot_options if g and g['id'] == garment_id]
+            for garment_id in garment_ids
+        ]
+        scored = []
+        for assignment in product(*positions):
+            slots = [slot for slot, _ in assignment]
+            if len(set(slots)) < len(slots):
+                continue
+            lists = list(options)
+            for slot, garment in assignment:
+                lists[slot] = [garment]
+            scored.extend(self._scored(lists, disliked))
+        return scored
+
+    # --- Scrittura ---
+
+    @staticmethod
+    def _row(outfit: Outfit, components: ScoreComponents) -> tuple:
+        return (outfit.shoes, outfit.bottom, outfit.base_top, outfit.mid_top, outfit.outerwear, *components, outfit.score)
+
+    @staticmethod
+    def _insert(cursor, scored):
+        cursor.executemany('''
+            INSERT OR REPLACE INTO ranked_outfit (shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id,
+                color_score, pattern_score, formality_score, neutral_penalty, color_bonus, simplicity_bonus, pair_penalty, score)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [RankedOutfits._row(outfit, components) for outfit, components in scored])
+
+    def _merge(self, cursor, scored, floor):
+        """Inserisce gli outfit rivalutati sopra il floor e rimuove gli altri"""
+        keep = [(o, c) for o, c in scored if floor is None or o.score > floor]
+        drop = [o.signature() for o, _ in scored if floor is not None and o.score <= floor]
+        self._insert(cursor, keep)
+        cursor.executemany(f"DELETE FROM ranked_outfit WHERE {OUTFIT_MATCH_SQL}", drop)
+
+    def _trim(self, cursor, floor):
+        """Riporta la tabella a `capacity` righe, alzando il floor se necessario"""
+        row = cursor.execute(
+            "SELECT score FROM ranked_outfit ORDER BY score DESC LIMIT 1 OFFSET ?", (self.capacity,)
+        ).fetchone()
+        if row is None:
+            return floor
+        cursor.execute("DELETE FROM ranked_outfit WHERE score <= ?", (row['score'],))
+        return row['score'] if floor is None else max(floor, row['score'])
+
+    @staticmethod
+    def _set_floor(cursor, floor):
+        cursor.execute("INSERT OR REPLACE INTO ranked_outfit_state (id, floor) VALUES (1, ?)", (floor,))
+
+    # --- Manutenzione ---
+
+    def rebuild(self):
+        """Ricalcola da zero il top-N"""
+        # Lo scoring avviene dentro la transazione: nessuna modifica può sfuggire al log
+        with self.db.transaction() as cursor:
+            self.generator._garment_cache(self.db).refresh()
+            # Stream dei candidati: in memoria restano solo i migliori capacity + 1
+            scored = self._scored(self._slot_options(), self.db.get_disliked_signatures())
+            top = heapq.nlargest(self.capacity + 1, scored, key=lambda item: item[0].score)
+            floor = None
+            if len(top) > self.capacity:
+                floor = top[-1][0].score
+                top = [(o, c) for o, c in top if o.score > floor]
+
+            cursor.execute("DELETE FROM ranked_outfit")
+            self._insert(cursor, top)
+            self._set_floor(cursor, floor)
+            cursor.execute("DELETE FROM ranked_outfit_changes")
+        return len(top)
+
+    def sync(self, min_rows: int = DEFAULT_TOP_POOL) -> bool:
+        """
+        Applica le modifiche registrate dai trigger; restituisce True se ha ricostruito.
+        Il decadimento continuo delle penalità tra due decay_pair_penalties non è
+        tracciato: viene riassorbito dal decadimento in blocco all'avvio.
+        """
+        min_rows = min(min_rows, self.capacity)
+        with self.db.transaction() as cursor:
+            state = cursor.execute("SELECT floor FROM ranked_outfit_state").fetchone()
+            changes = cursor.execute("SELECT * FROM ranked_outfit_changes ORDER BY id").fetchall()
+            if state is None or len(changes) > REBUILD_CHANGE_LIMIT:
+                rebuild = True
+            elif changes:
+                rebuild = not self._apply(cursor, changes, state['floor'], min_rows)
+            else:
+                rebuild = not self._enough_rows(cursor, state['floor'], min_rows)
+            if rebuild:
+                self.rebuild()
+            elif changes:
+                cursor.execute("DELETE FROM ranked_outfit_changes WHERE id <= ?", (changes[-1]['id'],))
+        return rebuild
+
+    def decay_pair_penalties(self, half_life_days: float, epsilon: float) -> tuple[int, int]:
+        """
+        Decadimento in blocco delle penalità di coppia (WeightsManager.decay_pair_penalties)
+        senza passare dal log delle modifiche: le componenti pair_penalty delle righe
+        vengono ricalcolate in SQL e il floor alzato del massimo aumento possibile
+        dello score di un outfit escluso (le sue al più 10 coppie con l'aumento maggiore).
+
+        Returns:
+            (coppie aggiornate, coppie eliminate)
+        """
+        with self.db.transaction() as cursor:
+            state = cursor.execute("SELECT floor FROM ranked_outfit_state").fetchone()
+            last_change = cursor.execute("SELECT IFNULL(MAX(id), 0) FROM ranked_outfit_changes").fetchone()[0]
+            # Variazione di ogni penalità: decaduta ad oggi, o azzerata se sotto epsilon
+            cursor.execute('''
+                SELECT penalty_score, penalty_score * half_life_decay(julianday('now') - julianday(last_updated), ?)
+                FROM pair_penalties WHERE last_updated < datetime('now')
+            ''', (half_life_days,))
+            increases = [(new if abs(new) >= epsilon else 0.0) - old for old, new in cursor.fetchall()]
+            updated, deleted = self.weights_manager.decay_pair_penalties(half_life_days, epsilon)
+            if state is None or not (updated or deleted):
+                return updated, deleted
+
+            cursor.execute("DELETE FROM ranked_outfit_changes WHERE id > ?", (last_change,))
+            cursor.execute(f'''
+                UPDATE ranked_outfit SET pair_penalty = (
+                    SELECT IFNULL(SUM(penalty_score), 0.0) FROM pair_penalties
+                    WHERE garment_id_1 IN ({OUTFIT_COLUMNS_SQL}) AND garment_id_2 IN ({OUTFIT_COLUMNS_SQL})
+                )
+            ''')
+            cursor.execute(RESCORE_SQL, self._score_weights())
+            floor = state['floor']
+            if floor is not None:
+                pairs_per_outfit = len(list(combinations(OUTFIT_SLOTS, 2)))
+                floor += sum(increase for increase in heapq.nlargest(pairs_per_outfit, increases) if increase > 0)
+                cursor.execute("DELETE FROM ranked_outfit WHERE score <= ?", (floor,))
+                self._set_floor(cursor, floor)
+        return updated, deleted
+
+    def _score_weights(self) -> tuple:
+        return tuple(self.generator.weights[key] for key in SCORE_WEIGHT_KEYS)
+
+    @staticmethod
+    def _enough_rows(cursor, floor, min_rows) -> bool:
+        """Il top-N garantito copre almeno min_rows outfit (o tutti quelli validi)"""
+        return floor is None or cursor.execute("SELECT COUNT(*) FROM ranked_outfit").fetchone()[0] >= min_rows
+
+    def _apply(self, cursor, changes, floor, min_rows) -> bool:
+        """Manutenzione incrementale; False se serve una ricostruzione"""
+        garments = set()
+        pairs = set()
+        outfits = set()
+        weight_deltas = {}
+        for change in changes:
+            if change['kind'] == 'garment':
+                garments.add(change['garment_id_1'])
+            elif change['kind'] == 'pair':
+                pairs.add((change['garment_id_1'], change['garment_id_2']))
+            elif change['kind'] == 'outfit':
+                outfits.add(tuple(change[column] for column in OUTFIT_SLOTS.values()))
+            elif change['weight_key'] in SCORE_WEIGHT_KEYS:
+                if change['old_value'] is None or change['new_value'] is None:
+                    return False
+                weight_deltas[change['weight_key']] = weight_deltas.get(change['weight_key'], 0.0) + change['new_value'] - change['old_value']
+
+        # 1. Pesi: nuovo totale dalle componenti salvate; fuori tabella lo score
+        #    può crescere al più di sum(|delta|), perché le componenti pesate sono in [0, 1]
+        if any(weight_deltas.values()):
+            cursor.execute(RESCORE_SQL, self._score_weights())
+            if floor is not None:
+                floor += sum(abs(delta) for delta in weight_deltas.values())
+
+        if garments or pairs or outfits:
+            self.generator._garment_cache(self.db).refresh()
+            options = self._slot_options()
+            disliked = self.db.get_disliked_signatures()
+
+        # 2. Garment modificati: via le righe che li contengono, poi rivaluta le loro combinazioni
+        for garment_id in garments:
+            cursor.execute('''
+                DELETE FROM ranked_outfit
+                WHERE ? IN (shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id)
+            ''', (garment_id,))
+            self._merge(cursor, self._scored_containing(options, (garment_id,), disliked), floor)
+
+        # 3. Penalità e vincoli di coppia: via le righe con entrambi i capi, poi rivaluta
+        for pair in pairs - {p for p in pairs if garments & set(p)}:
+            cursor.execute('''
+                DELETE FROM ranked_outfit
+                WHERE ? IN (shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id)
+                  AND ? IN (shoes_id, bottom_id, base_top_id, mid_top_id, outerwear_id)
+            ''', pair)
+            self._merge(cursor, self._scored_containing(options, pair, disliked), floor)
+
+        # 4. Feedback: l'outfit esce dalla tabella e rientra solo se non ha più un dislike
+        for signature in outfits:
+            cursor.execute(f"DELETE FROM ranked_outfit WHERE {OUTFIT_MATCH_SQL}", signature)
+            lists = self._signature_lists(options, signature)
+            if lists is not None:
+                self._merge(cursor, list(self._scored(lists, disliked)), floor)
+
+        if floor is not None:
+            cursor.execute("DELETE FROM ranked_outfit WHERE score <= ?", (floor,))
+        floor = self._trim(cursor, floor)
+        self._set_floor(cursor, floor)
+        return self._enough_rows(cursor, floor, min_rows)
+
+    # --- Lettura ---
+
+    def top(self, limit: int = DEFAULT_TOP_POOL) -> list[Outfit]:
+        """I migliori `limit` outfit, in ordine di score (a parità, di garment_id per slot)"""
+        cursor = self.db.conn.cursor()
+        cursor.execute(f'''
+            SELECT {OUTFIT_COLUMNS_SQL}, score
+            FROM ranked_outfit ORDER BY score DESC, {OUTFIT_COLUMNS_SQL} LIMIT ?
+        ''', (limit,))
+        return [Outfit(*row) for row in cursor.fetchall()]
+
+    def pick(self, count: int = 1, top_pool: int = DEFAULT_TOP_POOL, seed: int = None) -> list[Outfit]:
+        """Come generate(): `count` outfit a caso tra i migliori `top_pool` (deterministici se seed non è None)"""
+        self.sync(min_rows=top_pool)
+        candidates = self.top(top_pool)
+        rng = random.Random(seed) if seed is not None else random
+        return rng.sample(candidates, min(count, len(candidates)))
@@ -0,0 +1,107 @@
+"""
+Report di utilizzo e feedback dei capi (Roadmap Phase 4).
+
+Ogni sezione è una sola query aggregata sulle tabelle normalizzate
+outfit_items/feedback_items (indicizzate per garment), su pair_penalties e
+sul top-N materializzato: il costo non cresce con una query per capo e resta
+sotto il secondo anche con anni di storico.
+"""
+from db_manager import OUTFIT_COLUMNS_SQL
+from feedback_engine import PAIR_PENALTY_HALF_LIFE_DAYS
+from ranking import DEFAULT_TOP_POOL
+
+REPORT_PAIR_LIMIT = 10
+
+def garment_usage(db) -> list[dict]:
+    """Per ogni capo: volte indossato, ultima data e giorni da allora, like/dislike e rapporto"""
+    cursor = db.conn.cursor()
+    cursor.execute('''
+        SELECT g.id, g.name, g.category, g.active,
+               COALESCE(w.wear_count, 0) AS wear_count,
+               w.last_worn,
+               CAST(julianday('now') - julianday(w.last_worn) AS INTEGER) AS last_worn_days,
+               COALESCE(f.likes, 0) AS likes,
+               COALESCE(f.dislikes, 0) AS dislikes
+        FROM garment g
+        LEFT JOIN (
+            SELECT garment_id, COUNT(*) AS wear_count, MAX(worn_date) AS last_worn
+            FROM outfit_items GROUP BY garment_id
+        ) w ON w.garment_id = g.id
+        LEFT JOIN (
+            SELECT i.garment_id, SUM(f.verdict) AS likes, SUM(1 - f.verdict) AS dislikes
+            FROM feedback_items i JOIN feedback f ON f.id = i.feedback_id
+            GROUP BY i.garment_id
+        ) f ON f.garment_id = g.id
+        ORDER BY wear_count DESC, g.id
+    ''')
+    usage = []
+    for row in cursor.fetchall():
+        entry = dict(row)
+        entry['active'] = bool(entry['active'])
+        rated = entry['likes'] + entry['dislikes']
+        entry['like_ratio'] = entry['likes'] / rated if rated else None
+        usage.append(entry)
+    return usage
+
+def most_penalized_pairs(db, limit: int = REPORT_PAIR_LIMIT, half_life_days: float = PAIR_PENALTY_HALF_LIFE_DAYS) -> list[dict]:
+    """Le coppie con la penalità (decaduta ad oggi) più negativa"""
+    cursor = db.conn.cursor()
+    cursor.execute('''
+        SELECT p.garment_id_1, g1.name AS name_1, p.garment_id_2, g2.name AS name_2,
+               p.penalty_score * half_life_decay(julianday('now') - julianday(p.last_updated), ?) AS penalty
+        FROM pair_penalties p
+        JOIN garment g1 ON g1.id = p.garment_id_1
+        JOIN garment g2 ON g2.id = p.garment_id_2
+        ORDER BY penalty, p.garment_id_1, p.garment_id_2
+        LIMIT ?
+    ''', (half_life_days, limit))
+    return [dict(row) for row in cursor.fetchall()]
+
+def unranked_garments(wardrobe, top_pool: int = DEFAULT_TOP_POOL) -> list[dict]:
+    """Capi attivi che non compaiono in nessuno dei migliori top_pool outfit"""
+    wardrobe.ranking.sync(min_rows=top_pool)
+    cursor = wardrobe.db.conn.cursor()
+    cursor.execute(f'''
+        WITH top AS (
+            SELECT * FROM ranked_outfit ORDER BY score DESC, {OUTFIT_COLUMNS_SQL} LIMIT ?
+        ), used AS (
+            SELECT shoes_id AS id FROM top
+            UNION SELECT bottom_id FROM top
+            UNION SELECT base_top_id FROM top
+            UNION SELECT mid_top_id FROM top
+            UNION SELECT outerwear_id FROM top
+        )
+        SELECT id, name, category FROM garment
+        WHERE active = 1 AND id NOT IN (SELECT id FROM used WHERE id IS NOT NULL)
+        ORDER BY id
+    ''', (top_pool,))
+    return [dict(row) for row in cursor.fetchall()]
+
+def wardrobe_report(wardrobe, top_pool: int = DEFAULT_TOP_POOL, pair_limit: int = REPORT_PAIR_LIMIT) -> dict:
+    """Tutte le sezioni del report, serializzabili in JSON"""
+    return {
+        'garments': garment_usage(wardrobe.db),
+        'penalized_pairs': most_penalized_pairs(wardrobe.db, pair_limit),
+        'unranked': unranked_garments(wardrobe, top_pool),
+    }
+
+def format_report(report: dict) -> str:
+    """Report testuale per la CLI"""
+    lines = ["=== UTILIZZO CAPI ==="]
+    for g in report['garments']:
+        last_worn = f"{g['last_worn_days']} giorni fa" if g['last_worn'] is not None else "mai"
+        ratio = f"{g['like_ratio']:.0%}" if g['like_ratio'] is not None else "-"
+        status = "" if g['active'] else " [inattivo]"
+        lines.append(f"{g['id']}: {g['name']}{status} — indossato {g['wear_count']} volte (ultima: {last_worn}), "
+                     f"like {g['likes']}/dislike {g['dislikes']} ({ratio})")
+    lines.append("\n=== COPPIE PIÙ PENALIZZATE ===")
+    for p in report['penalized_pairs']:
+        lines.append(f"{p['name_1']} + {p['name_2']}: {p['penalty']:.3f}")
+    if not report['penalized_pairs']:
+        lines.append("Nessuna")
+    lines.append("\n=== CAPI MAI TRA I MIGLIORI OUTFIT ===")
+    for g in report['unranked']:
+        lines.append(f"{g['id']}: {g['name']} ({g['category']})")
+    if not report['unranked']:
+        lines.append("Nessuno")
+    return "\n".join(lines)
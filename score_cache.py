@@ -0,0 +1,210 @@
+"""
+Cache persistente degli score degli outfit, in un file mappato in memoria.
+
+Il file (accanto al database, estensione .scores) contiene, per ogni candidato
+valutato da una ricerca esaustiva di generate(), le componenti dello score che
+non dipendono da pesi e penalità e lo score totale. La chiave è il candidato
+impacchettato in base mista sulle liste per slot salvate nel file (vedi
+OutfitGenerator._unpack), cioè la firma dell'outfit in forma compatta:
+
+    header (magic, garment_version, weights_version, g, n, radici[5])
+    | id int64[g] | tratti double[5g] | id per slot int64[sum(radici)]
+    | chiavi int64[n] (crescenti) | componenti double[6n] | score double[n]
+
+La validità è a due livelli:
+- le componenti dipendono solo dai tratti dei capi (Lab, peso del pattern,
+  formality): quando cambia garment_version si scartano solo i candidati con
+  un capo i cui tratti sono cambiati;
+- lo score dipende anche da pesi e penalità di coppia: se weights_version non
+  coincide viene ricalcolato dalle componenti salvate, senza rivalutare i colori.
+Se liste per slot, candidati e versioni coincidono gli score si copiano in blocco.
+"""
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+SCORE_CACHE_MAGIC = b'DRSCOR01'
+SCORE_CACHE_HEADER = struct.Struct('=8sqqqq5q')
+SCORE_CACHE_SUFFIX = '.scores'
+# Componenti salvate per candidato (ScoreComponents senza pair_penalty)
+SCORE_CACHE_COMPONENTS = 6
+TRAIT_FIELDS = 5
+# Oltre questo numero di candidati il file non viene scritto (~64 byte per candidato)
+SCORE_CACHE_MAX_ENTRIES = 1_000_000
+
+def score_cache_path(db_path) -> Path:
+    """Percorso della cache degli score del database (None per i database in memoria)"""
+    if str(db_path) == ':memory:':
+        return None
+    return Path(db_path).with_suffix(SCORE_CACHE_SUFFIX)
+
+def _version(value) -> int:
+    return -1 if value is None else value
+
+class ScoreCache:
+    """
+    Componenti e score dei candidati valutati, per chiave impacchettata
+
+    Args:
+        traits: {garment_id: tratti} dei capi al momento del salvataggio
+        slot_ids: id dei garment per slot (None = slot vuoto) su cui sono impacchettate le chiavi
+    """
+    def __init__(self, garment_version, weights_version, traits: dict, slot_ids: list, keys, components, scores, mapped=None):
+        self.garment_version = garment_version
+        self.weights_version = weights_version
+        self.traits = traits
+        self.slot_ids = slot_ids
+        self.radices = [len(ids) for ids in slot_ids]
+        self.keys = keys
+        self.components = components
+        self.scores = scores
+        self.n = len(keys)
+        self.stale = set()
+        self.positions = [{garment_id: i for i, garment_id in enumerate(ids)} for ids in slot_ids]
+        self._mapped = mapped  # mmap da mantenere aperto finché servono le viste
+
+    def invalidate(self, traits: dict):
+        """Esclude dalle letture i candidati con capi i cui tratti non coincidono con `traits`"""
+        self.stale = {garment_id for garment_id, saved in self.traits.items() if traits.get(garment_id) != saved}
+        self.positions = [
+            {garment_id: i for i, garment_id in enumerate(ids) if garment_id not in self.stale}
+            for ids in self.slot_ids
+        ]
+
+    def same_candidates(self, slot_ids: list, candidates: array) -> bool:
+        """True se i candidati sono esattamente quelli salvati, tutti ancora validi"""
+        return (not self.stale and len(candidates) == self.n and slot_ids == self.slot_ids
+                and candidates.tobytes() == self.keys.tobytes())
+
+    def _key_map(self, slot_ids: list) -> list:
+        """Per slot: indice nelle liste `slot_ids` → indice nelle liste salvate (-1 se manca o non è valido)"""
+        return [[positions.get(garment_id, -1) for garment_id in ids] for positions, ids in zip(self.positions, slot_ids)]
+
+    def find(self, slot_ids: list, candidates: array) -> array:
+        """Posizione nel file di ogni candidato impacchettato su `slot_ids` (-1 se non salvato)"""
+        keys, n = self.keys, self.n
+        found = array('q')
+        if not self.stale and slot_ids == self.slot_ids:
+            # Stesse liste: la chiave è il candidato stesso
+            for packed in candidates:
+                i = bisect_left(keys, packed)
+                found.append(i if i < n and keys[i] == packed else -1)
+            return found
+
+        key_map = self._key_map(slot_ids)
+        radices = [len(ids) for ids in slot_ids]
+        for packed in candidates:
+            key = _repack(packed, radices, key_map, self.radices)
+            i = bisect_left(keys, key) if key >= 0 else n
+            found.append(i if i < n and keys[i] == key else -1)
+        return found
+
+    @classmethod
+    def load(cls, path: Path) -> 'ScoreCache':
+        """Mappa la cache (None se manca o non è leggibile)"""
+        try:
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(mapped) < SCORE_CACHE_HEADER.size:
+            return None
+        magic, garment_version, weights_version, g, n, *radices = SCORE_CACHE_HEADER.unpack_from(mapped)
+        expected = SCORE_CACHE_HEADER.size + 8 * (g + TRAIT_FIELDS * g + sum(radices) + n + SCORE_CACHE_COMPONENTS * n + n)
+        if magic != SCORE_CACHE_MAGIC or len(mapped) != expected:
+            return None
+        view = memoryview(mapped)
+        offset = SCORE_CACHE_HEADER.size
+
+        def take(count: int, fmt: str):
+            nonlocal offset
+            part = view[offset:offset + 8 * count].cast(fmt)
+            offset += 8 * count
+            return part
+
+        ids = take(g, 'q')
+        values = take(TRAIT_FIELDS * g, 'd')
+        traits = {garment_id: tuple(values[TRAIT_FIELDS * i:TRAIT_FIELDS * (i + 1)]) for i, garment_id in enumerate(ids)}
+        flat = take(sum(radices), 'q')
+        slot_ids, start = [], 0
+        for radix in radices:
+            slot_ids.append([garment_id or None for garment_id in flat[start:start + radix]])
+            start += radix
+        keys = take(n, 'q')
+        components = take(SCORE_CACHE_COMPONENTS * n, 'd')
+        scores = take(n, 'd')
+        return cls(garment_version if garment_version >= 0 else None, weights_version if weights_version >= 0 else None,
+                   traits, slot_ids, keys, components, scores, mapped)
+
+    @classmethod
+    def build(cls, path: Path, garment_version, weights_version, traits: dict, slot_ids: list,
+              keys: array, components: array, scores: array, previous: 'ScoreCache' = None) -> 'ScoreCache':
+        """
+        Salva i candidati appena valutati (keys crescenti, su slot_ids) più quelli
+        ancora validi di `previous` che non ne fanno parte, se hanno gli stessi pesi.
+        """
+        if previous is not None and previous.weights_version == weights_version:
+            key_map = previous._key_map(slot_ids) if previous.stale or slot_ids != previous.slot_ids else None
+            radices = [len(ids) for ids in slot_ids]
+            if key_map is not None:
+                # Dalla chiave nelle liste nuove a quella nelle liste salvate, e ritorno
+                inverse = [[-1] * len(ids) for ids in previous.slot_ids]
+                for slot, mapping in enumerate(key_map):
+                    for i, saved in enumerate(mapping):
+                        if saved >= 0:
+                            inverse[slot][saved] = i
+            current = set(keys)
+            extra = []
+            for position, key in enumerate(previous.keys):
+                if key_map is not None:
+                    key = _repack(key, previous.radices, inverse, radices)
+                if key >= 0 and key not in current:
+                    extra.append((key, position))
+            if extra and len(keys) + len(extra) <= SCORE_CACHE_MAX_ENTRIES:
+                merged = sorted([(key, -1, i) for i, key in enumerate(keys)] + [(key, position, 0) for key, position in extra])
+                new_keys, new_components, new_scores = array('q'), array('d'), array('d')
+                width = SCORE_CACHE_COMPONENTS
+                for key, position, i in merged:
+                    new_keys.append(key)
+                    if position < 0:
+                        new_components.extend(components[width * i:width * (i + 1)])
+                        new_scores.append(scores[i])
+                    else:
+                        new_components.extend(previous.components[width * position:width * (position + 1)])
+                        new_scores.append(previous.scores[position])
+                keys, components, scores = new_keys, new_components, new_scores
+
+        cache = cls(garment_version, weights_version, traits, slot_ids, array('q', keys), array('d', components), array('d', scores))
+        # Scrittura atomica: i processi che hanno già mappato il file precedente non se ne accorgono
+        try:
+            with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name, delete=False) as f:
+                f.write(SCORE_CACHE_HEADER.pack(SCORE_CACHE_MAGIC, _version(garment_version), _version(weights_version),
+                                                len(traits), cache.n, *cache.radices))
+                array('q', traits).tofile(f)
+                array('d', [v for garment_id in traits for v in traits[garment_id]]).tofile(f)
+                array('q', [garment_id or 0 for ids in slot_ids for garment_id in ids]).tofile(f)
+                cache.keys.tofile(f)
+                cache.components.tofile(f)
+                cache.scores.tofile(f)
+            os.replace(f.name, path)
+        except OSError:
+            return cache
+        return cls.load(path) or cache
+
+def _repack(packed: int, radices: list, key_map: list, target_radices: list) -> int:
+    """Candidato impacchettato su `radices` ricodificato su `target_radices` tramite key_map (-1 se non traducibile)"""
+    indices = []
+    for radix in reversed(radices):
+        packed, i = divmod(packed, radix)
+        indices.append(i)
+    key = 0
+    for slot, i in enumerate(reversed(indices)):
+        i = key_map[slot][i]
+        if i < 0:
+            return -1
+        key = key * target_radices[slot] + i
+    return key
@@ -0,0 +1,399 @@
+"""
+Server HTTP/JSON locale basato su asyncio.
+
+Espone CRUD dei capi, generazione, swap di un capo, riparazione di un
+outfit con capi non più attivi e feedback per più
+guardaroba. L'accesso a SQLite e la generazione girano in executor separati,
+così l'event loop resta libero di servire altri client; richieste di
+generazione identiche e concorrenti sullo stesso guardaroba condividono
+un unico calcolo, e quelle con un seed sono memoizzate finché il
+guardaroba non cambia.
+
+    python server.py --port 8080
+
+Endpoint (prefisso /wardrobes/<id>):
+    GET    /garments               lista dei capi
+    POST   /garments               aggiunge un capo
+    GET    /garments/<gid>         dettagli di un capo
+    PATCH  /garments/<gid>         modifica campi di un capo
+    DELETE /garments/<gid>         rimuove un capo
+    POST   /generate               {"count": 1, "top_pool": 150, "seed": 7,
+                                    "rules": [{"rule": "season", "season": "winter"}]}
+    POST   /swap                   {"outfit": {...}, "slot": "mid_top", "nearest": 5}
+    POST   /repair                 {"outfit": {...}}
+    POST   /feedback               {"outfit": {...}, "verdict": 0, "reason": "colors_clash"}
+    GET    /report                 utilizzo e feedback dei capi, coppie penalizzate
+    GET    /never_together         coppie di capi da non proporre mai insieme
+    POST   /never_together         {"garments": [4, 9]}
+    DELETE /never_together         {"garments": [4, 9]}
+"""
+import argparse
+import asyncio
+import dataclasses
+import functools
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from color_utils import css_to_hex, css_to_rgb, hex_to_rgb, rgb_to_cielab
+from constraints import rule_from_dict
+from db_manager import FeedbackReason, Garment, OUTFIT_SLOTS, validate_garment, validate_garment_field
+from outfit_engine import Outfit
+from reports import wardrobe_report
+from wardrobe import WardrobeRegistry
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DB_WORKERS = 8
+GENERATE_WORKERS = os.cpu_count() or 4
+MAX_BODY_BYTES = 1024 * 1024
+
+# Campi modificabili via PATCH (il nome colonna finisce nella query SQL)
+EDITABLE_FIELDS = {'name', 'category', 'layer_role', 'pattern', 'warmth', 'formality', 'season_tags', 'occasion_tags', 'active'}
+# Slot che un outfit deve sempre avere (mid_top e outerwear possono mancare)
+REQUIRED_SLOTS = ('shoes', 'bottom', 'base_top')
+
+ROUTE = re.compile(r'^/wardrobes/(?P<wardrobe>[^/]+)/(?P<resource>garments|generate|swap|repair|feedback|report|never_together)(?:/(?P<garment_id>\d+))?/?$')
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+def _row_to_dict(row) -> dict:
+    return dict(row) if row is not None else None
+
+def _outfit_to_dict(outfit: Outfit) -> dict:
+    return dataclasses.asdict(outfit)
+
+def _outfit_from_dict(data) -> Outfit:
+    if not isinstance(data, dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Campo 'outfit' mancante")
+    ids = {slot: data.get(slot) for slot in OUTFIT_SLOTS}
+    for slot, garment_id in ids.items():
+        if garment_id is None:
+            if slot in REQUIRED_SLOTS:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"Outfit non valido: manca '{slot}'")
+        elif isinstance(garment_id, bool) or not isinstance(garment_id, int):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Outfit non valido: '{slot}' deve essere un id intero")
+    return Outfit(**ids)
+
+def _positive_int(body: dict, name: str, default: int) -> int:
+    value = body.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} deve essere un intero positivo")
+    return value
+
+def _garment_from_dict(data: dict) -> Garment:
+    """Costruisce un Garment da JSON; il colore è un nome CSS o un esadecimale"""
+    try:
+        color = data['color']
+        if color.startswith('#'):
+            color_hex, rgb = color.lower(), hex_to_rgb(color)
+        else:
+            color_hex, rgb = css_to_hex(color), css_to_rgb(color)
+        lab = rgb_to_cielab(rgb)
+        return validate_garment(Garment(
+            name=data['name'],
+            category=data['category'],
+            layer_role=data.get('layer_role', 'none'),
+            color_hex=color_hex,
+            color_lab_l=float(lab[0]),
+            color_lab_a=float(lab[1]),
+            color_lab_b=float(lab[2]),
+            pattern=data.get('pattern', 'plain'),
+            warmth=int(data['warmth']),
+            formality=int(data['formality']),
+            season_tags=data.get('season_tags', ''),
+            occasion_tags=data.get('occasion_tags', ''),
+            active=bool(data.get('active', True)),
+        ))
+    except KeyError as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Campo mancante: {e.args[0]}")
+    except (TypeError, ValueError) as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+class OutfitServer:
+    def __init__(self, registry: WardrobeRegistry = None):
+        self.registry = registry or WardrobeRegistry()
+        # SQLite (I/O, scritture serializzate dal pool) e generazione (CPU) in executor distinti
+        self.db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db')
+        self.generate_executor = ThreadPoolExecutor(max_workers=GENERATE_WORKERS, thread_name_prefix='generate')
+        # Generazioni in corso: (wardrobe_id, contesto) → Future condiviso
+        self._inflight = {}
+        self.coalesced = 0
+
+    async def _run(self, executor, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    async def _outfit(self, wardrobe, data) -> Outfit:
+        """Outfit dal body, con tutti i capi esistenti nel guardaroba"""
+        outfit = _outfit_from_dict(data)
+        ids = [getattr(outfit, slot) for slot in OUTFIT_SLOTS if getattr(outfit, slot) is not None]
+        missing = await self._run(self.db_executor, lambda: [gid for gid in ids if wardrobe.db.get_garment(gid) is None])
+        if missing:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Capo non trovato: {missing[0]}")
+        return outfit
+
+    async def _wardrobe(self, wardrobe_id: str):
+        """Guardaroba della richiesta, in uso (registry.acquire) fino al release"""
+        try:
+            return await self._run(self.db_executor, self.registry.acquire, wardrobe_id)
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+    # --- Handler ---
+
+    async def list_garments(self, wardrobe, body):
+        rows = await self._run(self.db_executor, wardrobe.db.get_all_garments)
+        return HTTPStatus.OK, [_row_to_dict(r) for r in rows]
+
+    async def add_garment(self, wardrobe, body):
+        garment = _garment_from_dict(body)
+        garment_id = await self._run(self.db_executor, wardrobe.db.add_garment, garment)
+        return HTTPStatus.CREATED, {'id': garment_id}
+
+    async def get_garment(self, wardrobe, body, garment_id):
+        row = await self._run(self.db_executor, wardrobe.db.get_garment, garment_id)
+        if row is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Capo non trovato")
+        return HTTPStatus.OK, _row_to_dict(row)
+
+    async def update_garment(self, wardrobe, body, garment_id):
+        invalid = set(body) - EDITABLE_FIELDS
+        if invalid:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Campi non modificabili: {', '.join(sorted(invalid))}")
+        try:
+            body = {field: validate_garment_field(field, value) for field, value in body.items()}
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+        def update():
+            with wardrobe.db.transaction():
+                return min((wardrobe.db.update_garment_field(garment_id, field, value) for field, value in body.items()), default=1)
+
+        if not await self._run(self.db_executor, update):
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Capo non trovato")
+        return await self.get_garment(wardrobe, body, garment_id)
+
+    async def delete_garment(self, wardrobe, body, garment_id):
+        if not await self._run(self.db_executor, wardrobe.db.delete_garment, garment_id):
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Capo non trovato")
+        return HTTPStatus.OK, {'deleted': garment_id}
+
+    async def generate(self, wardrobe, body):
+        count = _positive_int(body, 'count', 1)
+        top_pool = _positive_int(body, 'top_pool', 150)
+        seed = body.get('seed')
+        if seed is not None and not isinstance(seed, int):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "seed deve essere un intero")
+        try:
+            rules = tuple(rule_from_dict(spec) for spec in body.get('rules', []))
+        except (TypeError, ValueError) as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        key = (wardrobe.id, count, top_pool, seed, rules)
+
+        # Coalescing: una richiesta identica già in corso viene condivisa
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            if rules:
+                # Il top-N materializzato non conosce le regole di contesto: generazione completa
+                call = functools.partial(wardrobe.generate, count, seed=seed, top_pool=top_pool, rules=rules)
+            else:
+                call = functools.partial(wardrobe.suggest, count, top_pool, seed)
+            # Il calcolo condiviso tiene in uso il guardaroba anche se la richiesta che l'ha avviato termina
+            self.registry.retain(wardrobe)
+            future = asyncio.ensure_future(self._run(self.generate_executor, call))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            future.add_done_callback(lambda _: self.registry.release(wardrobe))
+        outfits = await asyncio.shield(future)
+        return HTTPStatus.OK, [_outfit_to_dict(o) for o in outfits]
+
+    async def swap(self, wardrobe, body):
+        outfit = await self._outfit(wardrobe, body.get('outfit'))
+        try:
+            nearest = body.get('nearest')
+            if nearest is None:
+                swapped = await self._run(self.generate_executor, wardrobe.swap, outfit, body.get('slot'))
+            elif isinstance(nearest, int) and nearest > 0:
+                # Solo i capi più simili a quello attuale (indice Lab)
+                swapped = await self._run(self.generate_executor, wardrobe.substitute, outfit, body.get('slot'), nearest)
+            else:
+                raise ValueError("nearest deve essere un intero positivo")
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        if swapped is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Nessuna alternativa valida per lo slot")
+        return HTTPStatus.OK, _outfit_to_dict(swapped)
+
+    async def repair(self, wardrobe, body):
+        outfit = await self._outfit(wardrobe, body.get('outfit'))
+        repaired = await self._run(self.generate_executor, wardrobe.repair, outfit)
+        if repaired is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Nessun sostituto valido per i capi non attivi")
+        return HTTPStatus.OK, _outfit_to_dict(repaired)
+
+    async def feedback(self, wardrobe, body):
+        outfit = await self._outfit(wardrobe, body.get('outfit'))
+        verdict = body.get('verdict')
+        reason = body.get('reason')
+        if verdict not in (0, 1):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "verdict deve essere 0 o 1")
+        if verdict == 0 and reason not in {r.value for r in FeedbackReason}:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Motivo non valido: {reason}")
+        await self._run(self.db_executor, wardrobe.feedback.process_feedback, outfit, verdict, reason)
+        return HTTPStatus.OK, {'recorded': True}
+
+    async def list_never_together(self, wardrobe, body):
+        pairs = await self._run(self.db_executor, wardrobe.db.get_never_together)
+        return HTTPStatus.OK, [list(pair) for pair in sorted(pairs)]
+
+    @staticmethod
+    def _garment_pair(body) -> tuple:
+        pair = body.get('garments')
+        if not isinstance(pair, list) or len(pair) != 2 or not all(isinstance(g, int) and not isinstance(g, bool) for g in pair):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "'garments' deve essere una coppia di id")
+        return tuple(pair)
+
+    async def add_never_together(self, wardrobe, body):
+        pair = self._garment_pair(body)
+        try:
+            await self._run(self.db_executor, wardrobe.db.add_never_together, *pair)
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        return HTTPStatus.CREATED, {'garments': list(pair)}
+
+    async def remove_never_together(self, wardrobe, body):
+        pair = self._garment_pair(body)
+        if not await self._run(self.db_executor, wardrobe.db.remove_never_together, *pair):
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Coppia non presente")
+        return HTTPStatus.OK, {'deleted': list(pair)}
+
+    async def report(self, wardrobe, body):
+        # Il report legge il top-N materializzato, che può richiedere una ricostruzione
+        return HTTPStatus.OK, await self._run(self.generate_executor, wardrobe_report, wardrobe)
+
+    ROUTES = {
+        ('GET', 'garments', False): list_garments,
+        ('POST', 'garments', False): add_garment,
+        ('GET', 'garments', True): get_garment,
+        ('PATCH', 'garments', True): update_garment,
+        ('DELETE', 'garments', True): delete_garment,
+        ('POST', 'generate', False): generate,
+        ('POST', 'swap', False): swap,
+        ('POST', 'repair', False): repair,
+        ('POST', 'feedback', False): feedback,
+        ('GET', 'report', False): report,
+        ('GET', 'never_together', False): list_never_together,
+        ('POST', 'never_together', False): add_never_together,
+        ('DELETE', 'never_together', False): remove_never_together,
+    }
+
+    async def dispatch(self, method: str, path: str, body: dict):
+        match = ROUTE.match(path)
+        if match is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Risorsa non trovata: {path}")
+        garment_id = match['garment_id']
+        handler = self.ROUTES.get((method, match['resource'], garment_id is not None))
+        if handler is None:
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"Metodo {method} non supportato su {path}")
+        wardrobe = await self._wardrobe(match['wardrobe'])
+        try:
+            if garment_id is not None:
+                return await handler(self, wardrobe, body, int(garment_id))
+            return await handler(self, wardrobe, body)
+        finally:
+            # L'eventuale chiusura (guardaroba già rimosso dalla LRU) non blocca l'event loop
+            await self._run(self.db_executor, self.registry.release, wardrobe)
+
+    # --- HTTP ---
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Gestisce una connessione HTTP/1.1 (con keep-alive)"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {'error': "Richiesta non valida"}, False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+                try:
+                    length = int(headers.get('content-length', 0))
+                    if length > MAX_BODY_BYTES:
+                        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Body troppo grande")
+                    raw = await reader.readexactly(length) if length else b''
+                    body = json.loads(raw) if raw else {}
+                    if not isinstance(body, dict):
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, "Il body deve essere un oggetto JSON")
+                    status, payload = await self.dispatch(method.upper(), path.split('?', 1)[0], body)
+                except HTTPError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except (json.JSONDecodeError, ValueError) as e:
+                    status, payload = HTTPStatus.BAD_REQUEST, {'error': str(e)}
+                except Exception as e:
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"{type(e).__name__}: {e}"}
+
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: HTTPStatus, payload, keep_alive: bool):
+        data = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Dressense API su http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.generate_executor.shutdown(wait=True)
+        self.db_executor.shutdown(wait=True)
+        self.registry.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Server HTTP/JSON di Dressense")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+
+    server = OutfitServer()
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Exiting...")
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    main()
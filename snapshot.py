@@ -0,0 +1,162 @@
+"""
+Snapshot binario delle strutture derivate di WardrobeCache, mappato in memoria.
+
+Il file (accanto al database, estensione .snapshot) contiene gli id dei
+garment, le loro coordinate Lab e la matrice n×n degli score colore di coppia,
+in formato nativo della macchina:
+
+    header (magic, garment_version, n) | id int64[n] | Lab double[3n] | score double[n*n]
+
+La matrice si riempie su richiesta: NaN indica una coppia non ancora
+calcolata, e lo score calcolato viene scritto nel file mappato (condiviso
+con gli altri processi). Creare lo snapshot costa quindi solo la scrittura
+del file, e all'avvio nessuno score viene ricalcolato.
+
+Uno score di coppia è valido finché il Lab dei due capi coincide con quello
+salvato: lo snapshot resta buono anche quando cambia garment_version per
+modifiche che non toccano i colori, e uno snapshot superato viene
+ricostruito copiando a blocchi le righe dei capi non modificati.
+"""
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from pathlib import Path
+
+# Score di coppia non ancora calcolato
+MISSING = float('nan')
+
+SNAPSHOT_MAGIC = b'DRSNAP01'
+SNAPSHOT_HEADER = struct.Struct('=8sqq8x')
+SNAPSHOT_SUFFIX = '.snapshot'
+
+def snapshot_path(db_path) -> Path:
+    """Percorso dello snapshot del database (None per i database in memoria)"""
+    if str(db_path) == ':memory:':
+        return None
+    return Path(db_path).with_suffix(SNAPSHOT_SUFFIX)
+
+def _lab(garment) -> tuple:
+    return (garment['color_lab_l'], garment['color_lab_a'], garment['color_lab_b'])
+
+class PairScoreSnapshot:
+    """Matrice degli score colore di coppia mappata da file, riempita su richiesta"""
+    def __init__(self, version: int, ids, labs, scores, mapped=None):
+        self.version = version
+        self.ids = ids
+        self.labs = labs
+        self.scores = scores
+        self.n = len(ids)
+        self.positions = {garment_id: i for i, garment_id in enumerate(ids)}
+        self._mapped = mapped  # mmap da mantenere aperto finché servono le viste
+
+    def pair_score(self, garment_id_1: int, garment_id_2: int):
+        """Score della coppia, o None se non ancora calcolato o se un capo non è nello snapshot"""
+        i = self.positions.get(garment_id_1)
+        j = self.positions.get(garment_id_2)
+        if i is None or j is None:
+            return None
+        score = self.scores[i * self.n + j]
+        return None if score != score else score
+
+    def store(self, garment_id_1: int, garment_id_2: int, score: float):
+        """Salva lo score calcolato di una coppia (ignorato se lo snapshot è di sola lettura)"""
+        i = self.positions.get(garment_id_1)
+        j = self.positions.get(garment_id_2)
+        if i is None or j is None or getattr(self.scores, 'readonly', False):
+            return
+        self.scores[i * self.n + j] = self.scores[j * self.n + i] = score
+
+    def covers(self, garments: dict) -> bool:
+        """True se lo snapshot contiene esattamente questi garment, con lo stesso Lab"""
+        return self.n == len(garments) and len(self.valid_positions(garments)) == self.n
+
+    def valid_positions(self, garments: dict) -> dict:
+        """id → posizione dei capi il cui Lab coincide con quello salvato"""
+        labs = self.labs
+        valid = {}
+        for garment_id, garment in garments.items():
+            i = self.positions.get(garment_id)
+            if i is not None and tuple(labs[3 * i:3 * i + 3]) == _lab(garment):
+                valid[garment_id] = i
+        return valid
+
+    @classmethod
+    def load(cls, path: Path) -> 'PairScoreSnapshot':
+        """Mappa lo snapshot (None se manca o non è leggibile)"""
+        try:
+            # In scrittura per salvare gli score calcolati; in sola lettura se il file non è scrivibile
+            try:
+                with open(path, 'r+b') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
+            except PermissionError:
+                with open(path, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(mapped) < SNAPSHOT_HEADER.size:
+            return None
+        magic, version, n = SNAPSHOT_HEADER.unpack_from(mapped)
+        if magic != SNAPSHOT_MAGIC or len(mapped) != SNAPSHOT_HEADER.size + 8 * (n + 3 * n + n * n):
+            return None
+        view = memoryview(mapped)
+        offset = SNAPSHOT_HEADER.size
+        ids = view[offset:offset + 8 * n].cast('q')
+        offset += 8 * n
+        labs = view[offset:offset + 24 * n].cast('d')
+        offset += 24 * n
+        scores = view[offset:].cast('d')
+        return cls(version, ids, labs, scores, mapped)
+
+    @classmethod
+    def build(cls, path: Path, version: int, garments: dict, previous: 'PairScoreSnapshot' = None) -> 'PairScoreSnapshot':
+        """
+        Crea e salva lo snapshot dei `garments` ({id: riga}) con tutte le coppie
+        da calcolare; gli score già presenti in `previous` per i capi con lo
+        stesso Lab vengono copiati.
+        """
+        ids = sorted(garments)
+        n = len(ids)
+        labs = array('d', [v for garment_id in ids for v in _lab(garments[garment_id])])
+        scores = array('d', [MISSING]) * (n * n)
+        if previous is not None:
+            valid = previous.valid_positions(garments)
+            old_scores, old_n = memoryview(previous.scores), previous.n
+            # Colonne in comune come tratti contigui (id ordinati in entrambi gli snapshot):
+            # ogni riga valida si copia con una slice per tratto, non elemento per elemento
+            runs = []
+            for j, garment_id in enumerate(ids):
+                old_j = previous.positions.get(garment_id)
+                if old_j is None:
+                    continue
+                if runs and runs[-1][0] + runs[-1][2] == j and runs[-1][1] + runs[-1][2] == old_j:
+                    runs[-1][2] += 1
+                else:
+                    runs.append([j, old_j, 1])
+            target = memoryview(scores)
+            for i, garment_id in enumerate(ids):
+                old_i = valid.get(garment_id)
+                if old_i is None:
+                    continue
+                row, old_row = i * n, old_i * old_n
+                for j, old_j, length in runs:
+                    target[row + j:row + j + length] = old_scores[old_row + old_j:old_row + old_j + length]
+            target.release()
+            # Colonne dei capi con il Lab cambiato: le righe sono già vuote
+            missing_column = array('d', [MISSING]) * n
+            for j, garment_id in enumerate(ids):
+                if garment_id not in valid and garment_id in previous.positions:
+                    scores[j::n] = missing_column
+
+        # Scrittura atomica: i processi che hanno già mappato il file precedente non se ne accorgono
+        try:
+            with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name, delete=False) as f:
+                f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, version, n))
+                array('q', ids).tofile(f)
+                labs.tofile(f)
+                scores.tofile(f)
+            os.replace(f.name, path)
+        except OSError:
+            return cls(version, ids, labs, scores)
+        return cls.load(path) or cls(version, ids, labs, scores)
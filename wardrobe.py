@@ -0,0 +1,214 @@
+import threading
+from collections import OrderedDict
+from dataclasses import replace
+from db_manager import DB_Manager, WeightsManager, DEFAULT_WARDROBE_ID, OUTFIT_SLOTS, wardrobe_path
+from feedback_engine import FeedbackManager, PAIR_PENALTY_HALF_LIFE_DAYS, PAIR_PENALTY_EPSILON
+from outfit_engine import Outfit, OutfitGenerator
+from ranking import RankedOutfits, DEFAULT_TOP_POOL
+
+# Limiti della cache dei guardaroba aperti
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_OPEN_WARDROBES = 32
+# Risultati memoizzati per guardaroba (generate/suggest con seed)
+DEFAULT_RESULT_CACHE_SIZE = 128
+# Capi simili valutati da substitute() e repair()
+SUBSTITUTE_NEIGHBORS = 5
+
+class Wardrobe:
+    """
+    Guardaroba di un singolo utente: database, pesi, penalità e cache propri.
+    """
+    def __init__(self, wardrobe_id: str = DEFAULT_WARDROBE_ID, path=None):
+        self.id = wardrobe_id
+        self.db = DB_Manager(path or wardrobe_path(wardrobe_id))
+        self.weights_manager = WeightsManager(self.db)
+        self.generator = OutfitGenerator(self.db)
+        self.feedback = FeedbackManager(self.db, self.generator)
+        self.ranking = RankedOutfits(self)
+        # Utenti attivi (WardrobeRegistry.acquire/release): un guardaroba in uso non viene chiuso
+        self.users = 0
+        # LRU dei risultati deterministici: chiave = (versioni del db, operazione, parametri, seed)
+        self.result_cache_size = DEFAULT_RESULT_CACHE_SIZE
+        self.result_cache_hits = 0
+        self._results = OrderedDict()
+        self._results_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Carica pesi e penalità (decadute) nel generatore del guardaroba"""
+        self.generator.load_weights(self.weights_manager.get_all_weights())
+        # Decadimento periodico (all'apertura) delle penalità di coppia, poi caricamento in memoria;
+        # il top-N materializzato lo assorbe senza rivalutare le coppie
+        self.ranking.decay_pair_penalties(PAIR_PENALTY_HALF_LIFE_DAYS, PAIR_PENALTY_EPSILON)
+        self.generator.load_pair_penalties(
+            self.weights_manager.load_pair_penalties(PAIR_PENALTY_HALF_LIFE_DAYS, PAIR_PENALTY_EPSILON)
+        )
+
+    def garment_lists(self) -> tuple:
+        """Garment attivi per slot: (shoes, bottoms, base, mid, outer)"""
+        return (
+            self.db.get_garments_by_category('shoes'),
+            self.db.get_garments_by_category('trousers'),
+            self.db.get_garments_by_layer('base'),
+            self.db.get_garments_by_layer('mid'),
+            self.db.get_garments_by_layer('outer'),
+        )
+
+    def _cached(self, key: tuple, compute) -> list:
+        """
+        Risultato di compute() memoizzato per `key` e per le versioni correnti di
+        garment, pesi/penalità e feedback: ogni modifica rende irraggiungibili
+        le voci precedenti, che escono poi dalla LRU.
+        """
+        key = (tuple(sorted(self.db.get_versions().items())), *key)
+        with self._results_lock:
+            outfits = self._results.get(key)
+            if outfits is not None:
+                self._results.move_to_end(key)
+                self.result_cache_hits += 1
+        if outfits is None:
+            outfits = compute()
+            with self._results_lock:
+                self._results[key] = outfits
+                while len(self._results) > self.result_cache_size:
+                    self._results.popitem(last=False)
+        # Copie: chi riceve gli Outfit può modificarli senza toccare la cache
+        return [replace(outfit) for outfit in outfits]
+
+    def generate(self, count: int = 1, seed: int = None, **kwargs) -> list:
+        """
+        Genera outfit dal guardaroba (kwargs passati a OutfitGenerator.generate).
+        Con un seed e senza scorer/statistiche il risultato è memoizzato.
+        """
+        def compute():
+            shoes, bottoms, base_tops, mid_tops, outerwear = self.garment_lists()
+            if not shoes or not bottoms or not base_tops:
+                return []
+            return self.generator.generate(shoes, bottoms, base_tops, mid_tops, outerwear, self.db, count=count, seed=seed, **kwargs)
+
+        if seed is None or set(kwargs) - {'top_pool', 'rules', 'temperature', 'clusters', 'expand'}:
+            return compute()
+        context = (kwargs.get('top_pool'), tuple(kwargs.get('rules', ())), kwargs.get('temperature'), kwargs.get('clusters'), kwargs.get('expand'))
+        return self._cached(('generate', count, *context, seed), compute)
+
+    def suggest(self, count: int = 1, top_pool: int = DEFAULT_TOP_POOL, seed: int = None) -> list:
+        """Outfit dal top-N materializzato (aggiornato incrementalmente se necessario)"""
+        if seed is None:
+            return self.ranking.pick(count, top_pool)
+        return self._cached(('suggest', count, top_pool, seed), lambda: self.ranking.pick(count, top_pool, seed))
+
+    def swap(self, outfit: Outfit, slot: str) -> Outfit | None:
+        """Miglior outfit che differisce da `outfit` solo nello slot indicato"""
+        if slot not in OUTFIT_SLOTS:
+            raise ValueError(f"Slot non valido: {slot}")
+        candidates = self.garment_lists()[list(OUTFIT_SLOTS).index(slot)]
+        return self.generator.swap(outfit, slot, candidates, self.db)
+
+    def substitute(self, outfit: Outfit, slot: str, k: int = SUBSTITUTE_NEIGHBORS) -> Outfit | None:
+        """Come swap(), ma valuta solo i k capi più simili a quello nello slot (indice Lab)"""
+        if slot not in OUTFIT_SLOTS:
+            raise ValueError(f"Slot non valido: {slot}")
+        current = getattr(outfit, slot)
+        neighbors = self.db.find_substitutes(current, k) if current is not None else []
+        if not neighbors:
+            # Slot vuoto o capo eliminato: nessun riferimento nello spazio Lab
+            return self.swap(outfit, slot)
+        # Se nessun vicino rispetta i vincoli si ripiega sull'intero slot
+        return self.generator.swap(outfit, slot, [garment for _, garment in neighbors], self.db) or self.swap(outfit, slot)
+
+    def repair(self, outfit: Outfit, k: int = SUBSTITUTE_NEIGHBORS) -> Outfit | None:
+        """Sostituisce i capi non più attivi (disattivati o eliminati) con i sostituti più vicini"""
+        repaired = outfit
+        for slot in OUTFIT_SLOTS:
+            garment_id = getattr(repaired, slot)
+            if garment_id is None:
+                continue
+            garment = self.db.get_garment(garment_id)
+            if garment is not None and garment['active']:
+                continue
+            repaired = self.substitute(repaired, slot, k)
+            if repaired is None:
+                return None
+        return repaired
+
+    def approx_size_bytes(self) -> int:
+        return self.generator.approx_size_bytes()
+
+    def close(self):
+        self.db.close()
+
+class WardrobeRegistry:
+    """
+    Guardaroba aperti indicizzati per id, in una cache LRU.
+    Quando la memoria stimata delle cache supera max_bytes (o si superano
+    max_open guardaroba) vengono rimossi i meno usati di recente: quelli
+    ancora in uso (acquire senza release) vengono chiusi dall'ultimo release().
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_CACHE_BYTES, max_open: int = DEFAULT_MAX_OPEN_WARDROBES, directory=None):
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        # Cartella alternativa dei database (es. guardaroba sintetici del load test)
+        self.directory = directory
+        self._wardrobes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, wardrobe_id: str) -> Wardrobe:
+        """
+        Restituisce il guardaroba richiesto, aprendolo se necessario.
+        Un'eviction successiva può chiuderlo: chi lo usa a lungo o da altri thread usa acquire().
+        """
+        with self._lock:
+            return self._get(wardrobe_id)
+
+    def _get(self, wardrobe_id: str) -> Wardrobe:
+        wardrobe = self._wardrobes.get(wardrobe_id)
+        if wardrobe is None:
+            wardrobe = Wardrobe(wardrobe_id, wardrobe_path(wardrobe_id, self.directory))
+            self._wardrobes[wardrobe_id] = wardrobe
+        self._wardrobes.move_to_end(wardrobe_id)
+        self._evict(keep=wardrobe_id)
+        return wardrobe
+
+    def acquire(self, wardrobe_id: str) -> Wardrobe:
+        """Come get(), ma il guardaroba resta aperto finché non si chiama release()"""
+        with self._lock:
+            wardrobe = self._get(wardrobe_id)
+            wardrobe.users += 1
+            return wardrobe
+
+    def retain(self, wardrobe: Wardrobe):
+        """Un utente in più per un guardaroba già ottenuto con acquire()"""
+        with self._lock:
+            wardrobe.users += 1
+
+    def release(self, wardrobe: Wardrobe):
+        """Rilascia un acquire()/retain(); chiude il guardaroba se è stato rimosso ed era l'ultimo utente"""
+        with self._lock:
+            wardrobe.users -= 1
+            close = wardrobe.users == 0 and self._wardrobes.get(wardrobe.id) is not wardrobe
+        if close:
+            wardrobe.close()
+
+    def approx_size_bytes(self) -> int:
+        return sum(w.approx_size_bytes() for w in self._wardrobes.values())
+
+    def _evict(self, keep: str):
+        """Rimuove i guardaroba meno usati finché si rientra nei limiti, chiudendo quelli non in uso"""
+        while len(self._wardrobes) > 1 and (
+            len(self._wardrobes) > self.max_open or self.approx_size_bytes() > self.max_bytes
+        ):
+            wardrobe_id, wardrobe = next(iter(self._wardrobes.items()))
+            if wardrobe_id == keep:
+                break
+            del self._wardrobes[wardrobe_id]
+            if not wardrobe.users:
+                wardrobe.close()
+
+    def __contains__(self, wardrobe_id: str) -> bool:
+        return wardrobe_id in self._wardrobes
+
+    def close(self):
+        with self._lock:
+            for wardrobe in self._wardrobes.values():
+                wardrobe.close()
+            self._wardrobes.clear()
@@ -0,0 +1,32 @@
+"""
+Temperatura del giorno da un file JSON locale di previsioni (nessun accesso alla rete).
+
+Formato: una chiave per giorno (YYYY-MM-DD) con i gradi °C, oppure con
+minima e massima, di cui si usa la media:
+
+    {"2026-10-19": 14.5, "2026-10-20": {"min": 8, "max": 17}}
+"""
+import json
+from datetime import date
+from pathlib import Path
+
+FORECAST_PATH = Path('data/forecast.json')
+
+def forecast_temperature(path=FORECAST_PATH, day: date = None) -> float | None:
+    """Temperatura prevista per `day` (default oggi); None se file o giorno mancano"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, encoding='utf-8') as f:
+        forecast = json.load(f)
+    if not isinstance(forecast, dict):
+        raise ValueError(f"Formato previsioni non valido in {path}")
+    entry = forecast.get((day or date.today()).isoformat())
+    if entry is None:
+        return None
+    if isinstance(entry, dict):
+        try:
+            return (float(entry['min']) + float(entry['max'])) / 2
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Previsione non valida in {path}: {entry}")
+    return float(entry)